@@ -12,6 +12,8 @@ class BSPLeaf:
         self.level = level
         self.children = []
         self.generated = False
+        # Frame of the last traverse that found the leaf visible, used to prune lazily generated children
+        self.visited = 0
 
     def is_visible(self, viewport):
         x, y, w, h, zoom = viewport
@@ -136,13 +138,14 @@ class BSPLeaf:
         #     )
         # ]
 
-    def traverse(self, viewport, visible, not_visible, max_depth=None):
+    def traverse(self, viewport, visible, not_visible, max_depth=None, frame=0):
         is_visible, is_fully_visible, contains_viewport = self.is_visible(viewport)
         x, y, w, h, zoom = viewport
         # Not visible discard
         if not is_visible:
             not_visible.append(self)
             return False
+        self.visited = frame
         # Is fully visible
         if is_fully_visible:
             visible.append(self)
@@ -154,9 +157,43 @@ class BSPLeaf:
             #print("Leaves loaded",self)
             self.generate_leaves()
         for c in self.children:
-            c.traverse(viewport, visible, not_visible, max_depth)
+            c.traverse(viewport, visible, not_visible, max_depth, frame)
         return True
 
+    def collapse(self):
+        """
+        Drops the children, traverse generates them again when needed
+        :return: number of removed leaves
+        """
+        removed = self.count() - 1
+        self.children = []
+        self.generated = False
+        return removed
+
+    def prune(self, oldest_frame):
+        """
+        Collapses subtrees not visited since oldest_frame. A visited leaf has visited ancestors, so the children
+        of a stale leaf are stale as well
+        :return: number of removed leaves
+        """
+        if self.visited < oldest_frame:
+            return self.collapse()
+        removed = 0
+        for c in self.children:
+            removed += c.prune(oldest_frame)
+        return removed
+
+    def parents(self):
+        """
+        Leaves with generated children
+        """
+        result = []
+        if len(self.children) > 0:
+            result.append(self)
+        for c in self.children:
+            result += c.parents()
+        return result
+
     def count(self):
         count = 1
         for c in self.children:
@@ -210,6 +247,13 @@ class BSPTree:
         self.depth = depth
         # Set to true to generate leaves dynamically
         self.lazy_load = True
+        # Traverse count, stamped on the visited leaves
+        self.frame = 0
+        # Lazily generated subtrees not visited for prune_age frames are collapsed every prune_interval frames,
+        # then the oldest ones until the tree has at most max_leaves. None disables the limit
+        self.prune_interval = 60
+        self.prune_age = 600
+        self.max_leaves = 100000
 
     def set_size(self, w, h):
         self.width = w
@@ -227,7 +271,34 @@ class BSPTree:
             print("Tree configured for lazy load. Leaves will load dynamically")
 
     def traverse(self, viewport, visible, not_visible):
-        self.leaf.traverse(viewport, visible, not_visible)
+        self.frame += 1
+        self.leaf.traverse(viewport, visible, not_visible, frame=self.frame)
+        if self.lazy_load and self.prune_interval and self.frame % self.prune_interval == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Collapses the subtrees not visited for prune_age frames, then the least recently visited ones while the
+        tree is larger than max_leaves. Leaves visited in the current frame are kept
+        :return: number of removed leaves
+        """
+        removed = 0
+        if self.prune_age is not None:
+            # Root stays generated, its children are checked
+            for c in self.leaf.children:
+                removed += c.prune(self.frame - self.prune_age)
+        if self.max_leaves is not None:
+            count = self.count()
+            if count > self.max_leaves:
+                # Oldest first, deeper first for the same frame so children are collapsed before their parents
+                parents = sorted(self.leaf.parents(), key=lambda leaf: (leaf.visited, -leaf.level))
+                for leaf in parents:
+                    if count <= self.max_leaves or leaf.visited >= self.frame:
+                        break
+                    collapsed = leaf.collapse()
+                    count -= collapsed
+                    removed += collapsed
+        return removed
 
     def dump(self):
         result = f"BSPTree w:{self.width} h:{self.height}"
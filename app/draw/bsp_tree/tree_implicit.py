@@ -0,0 +1,237 @@
+import bisect
+import math
+
+import numpy as np
+
+# Nodes of deeper levels are smaller than the float64 resolution of their bounds, the traversal stops there
+MAX_LEVEL = 52
+
+
+class ImplicitTree:
+    """
+    BSP tree without node objects, a node is (level, column, row) and its bounds are computed from the level size
+    Splits like BSPLeaf.generate_leaves: the wider side of a node is halved, so all nodes of a level have the
+    same size and split along the same axis.
+    Nothing is stored per node, memory of a traversal is proportional to the visible nodes.
+    """
+
+    def __init__(self, width, height):
+        self.width = 0
+        self.height = 0
+        # Node width and height of every level
+        self.widths = None
+        self.heights = None
+        self.width_list = None
+        self.height_list = None
+        # Negated sizes, increasing, bisected to find the levels of a viewport size
+        self.negative_widths = None
+        self.negative_heights = None
+        # True when the nodes of the level are split into columns (left and right child)
+        self.split_columns = None
+        # Number of columns and rows of every level
+        self.columns = None
+        self.rows = None
+        # log2 of rows, bits of the row index in the node key
+        self.row_bits = None
+        self.set_size(width, height)
+
+    def set_size(self, w, h):
+        self.width = w
+        self.height = h
+        widths = [w]
+        heights = [h]
+        split_columns = []
+        for level in range(MAX_LEVEL):
+            split_columns.append(widths[-1] > heights[-1])
+            widths.append(widths[-1] / 2 if split_columns[-1] else widths[-1])
+            heights.append(heights[-1] if split_columns[-1] else heights[-1] / 2)
+        split_columns.append(False)
+        self.widths = np.array(widths, dtype=np.float64)
+        self.heights = np.array(heights, dtype=np.float64)
+        # Float lists for the per level loop of visible_tiles, faster to index than the arrays
+        self.width_list = [float(v) for v in widths]
+        self.height_list = [float(v) for v in heights]
+        self.negative_widths = [-v for v in self.width_list]
+        self.negative_heights = [-v for v in self.height_list]
+        self.split_columns = split_columns
+        # Levels are split along one axis, the column index takes the column splits bits of the key and the row
+        # index the rest
+        self.columns = [1]
+        self.rows = [1]
+        for level in range(MAX_LEVEL):
+            self.columns.append(self.columns[-1] * 2 if split_columns[level] else self.columns[-1])
+            self.rows.append(self.rows[-1] if split_columns[level] else self.rows[-1] * 2)
+        self.row_bits = np.array([r.bit_length() - 1 for r in self.rows], dtype=np.int64)
+
+    def is_regular(self):
+        """
+        Nodes of a level form a grid only for a finite, not empty size, visible_tiles requires it
+        """
+        return bool(np.isfinite(self.width) and np.isfinite(self.height) and self.width > 0 and self.height > 0)
+
+    def bounds(self, levels, columns, rows):
+        """
+        :return: x1, y1, x2, y2 arrays of the nodes
+        """
+        widths = self.widths[levels]
+        heights = self.heights[levels]
+        x1 = columns * widths
+        y1 = rows * heights
+        return x1, y1, x1 + widths, y1 + heights
+
+    def column_range(self, level, x1, x2, inside):
+        """
+        Columns of the level overlapping [x1, x2] or fully inside it, using the same comparisons as BSPLeaf.traverse
+        :return: first, last column, last < first when there are none
+        """
+        return self.index_range(self.width_list[level], self.columns[level], x1, x2, inside)
+
+    def row_range(self, level, y1, y2, inside):
+        return self.index_range(self.height_list[level], self.rows[level], y1, y2, inside)
+
+    @staticmethod
+    def index_range(size, count, v1, v2, inside):
+        # Estimate with a division, then step to the exact boundary, the bounds are index * size
+        if inside:
+            first = math.floor(v1 / size)
+            if first < 0:
+                first = 0
+            while first < count and first * size < v1:
+                first += 1
+            last = math.floor(v2 / size)
+            if last > count - 1:
+                last = count - 1
+            while last >= 0 and last * size + size > v2:
+                last -= 1
+        else:
+            first = math.floor(v1 / size) - 1
+            if first < 0:
+                first = 0
+            while first < count and first * size + size < v1:
+                first += 1
+            last = math.floor(v2 / size) + 1
+            if last > count - 1:
+                last = count - 1
+            while last >= 0 and last * size > v2:
+                last -= 1
+        return first, last
+
+    def visible_levels(self, w, h):
+        """
+        :return: first level with nodes not larger than the viewport, levels above are never fully inside it,
+        and the first level with nodes smaller than a quarter of the viewport, the deepest visible level
+        """
+        first_level = max(bisect.bisect_left(self.negative_widths, -w), bisect.bisect_left(self.negative_heights, -h))
+        last_level = max(bisect.bisect_right(self.negative_widths, -w / 4),
+                         bisect.bisect_right(self.negative_heights, -h / 4))
+        return min(first_level, MAX_LEVEL), min(last_level, MAX_LEVEL)
+
+    def visible_strips(self, viewport):
+        """
+        Visible nodes computed per level without walking the tree, the same nodes BSPLeaf.traverse finds:
+        nodes fully inside the viewport and nodes smaller than a quarter of the viewport overlapping it
+        Nodes fully inside the viewport form a rectangle of every level, a node is visible when its parent is
+        not fully inside, so the visible nodes of a level are the rectangle without the children of the previous
+        level rectangle. At the first level with nodes smaller than a quarter of the viewport the overlapping
+        nodes are visible instead, that ends the traversal.
+        Plain Python on a few integers per level, the nodes are expanded only by strips_nodes.
+        Requires is_regular()
+        :param viewport: (x, y, w, h, zoom) in world coordinates
+        :return: list of (level, first column, last column, first row, last row) not empty strips of visible nodes
+        """
+        x, y, w, h, zoom = viewport
+        wx1, wy1, wx2, wy2 = x, y, x + w, y + h
+        o1, o2 = self.column_range(0, wx1, wx2, inside=False)
+        p1, p2 = self.row_range(0, wy1, wy2, inside=False)
+        if o2 < o1 or p2 < p1:
+            return []
+        strips = []
+        # Children of the fully inside rectangle of the previous level, None at the root
+        parent = None
+        first_level, last_level = self.visible_levels(w, h)
+        first_level = min(first_level, last_level)
+        for level in range(first_level, last_level + 1):
+            inside = level < last_level
+            c1, c2 = self.index_range(self.width_list[level], self.columns[level], wx1, wx2, inside)
+            r1, r2 = self.index_range(self.height_list[level], self.rows[level], wy1, wy2, inside)
+            if c1 > c2 or r1 > r2:
+                parent = None
+                continue
+            if parent is None:
+                strips.append((level, c1, c2, r1, r2))
+            else:
+                pc1, pc2, pr1, pr2 = parent
+                # Rows above and below the parent rectangle, columns left and right of it
+                if r1 < pr1:
+                    strips.append((level, c1, c2, r1, pr1 - 1))
+                if pr2 < r2:
+                    strips.append((level, c1, c2, pr2 + 1, r2))
+                if c1 < pc1:
+                    strips.append((level, c1, pc1 - 1, pr1, pr2))
+                if pc2 < c2:
+                    strips.append((level, pc2 + 1, c2, pr1, pr2))
+            if self.split_columns[level]:
+                parent = (c1 * 2, c2 * 2 + 1, r1, r2)
+            else:
+                parent = (c1, c2, r1 * 2, r2 * 2 + 1)
+        return strips
+
+    def strips_nodes(self, strips):
+        """
+        Strips expanded to nodes at once, node i of a strip is column c1 + i % columns, row r1 + i // columns
+        :return: levels, columns, rows int64 arrays
+        """
+        strips = np.array(strips, dtype=np.int64).reshape(-1, 5)
+        strip_columns = strips[:, 2] - strips[:, 1] + 1
+        sizes = strip_columns * (strips[:, 4] - strips[:, 3] + 1)
+        starts = np.cumsum(sizes) - sizes
+        index = np.arange(int(sizes.sum()), dtype=np.int64) - np.repeat(starts, sizes)
+        strip_columns = np.repeat(strip_columns, sizes)
+        columns = np.repeat(strips[:, 1], sizes) + index % strip_columns
+        rows = np.repeat(strips[:, 3], sizes) + index // strip_columns
+        return np.repeat(strips[:, 0], sizes), columns, rows
+
+    def strips_extent(self, strips):
+        """
+        :return: x1, y1, x2, y2 bounding the nodes of the strips and the deepest level or None for no strips
+        """
+        if len(strips) == 0:
+            return None
+        x1 = y1 = math.inf
+        x2 = y2 = -math.inf
+        deepest = 0
+        for level, c1, c2, r1, r2 in strips:
+            width = self.width_list[level]
+            height = self.height_list[level]
+            x1 = min(x1, c1 * width)
+            y1 = min(y1, r1 * height)
+            x2 = max(x2, c2 * width + width)
+            y2 = max(y2, r2 * height + height)
+            deepest = max(deepest, level)
+        return x1, y1, x2, y2, deepest
+
+    def visible_tiles(self, viewport):
+        """
+        Visible nodes of the viewport, see visible_strips
+        :return: levels, columns, rows int64 arrays of the visible nodes
+        """
+        return self.strips_nodes(self.visible_strips(viewport))
+
+    def keys(self, levels, columns, rows):
+        """
+        Unique int64 key of every node: a level bit above the column and row bits, the key of a level L node
+        is in [2^L, 2^(L+1))
+        """
+        row_bits = self.row_bits[levels]
+        return (np.int64(1) << levels) | (columns << row_bits) | rows
+
+    def leaves(self, levels, columns, rows, create_leaf):
+        """
+        Leaf objects of the nodes, for code working with BSPLeaf objects
+        :param create_leaf: function (x, y, w, h, level) returning the leaf
+        """
+        x1, y1, x2, y2 = self.bounds(levels, columns, rows)
+        widths = self.widths[levels]
+        heights = self.heights[levels]
+        return [create_leaf(float(x1[i]), float(y1[i]), float(widths[i]), float(heights[i]), int(levels[i]))
+                for i in range(len(levels))]
@@ -0,0 +1,369 @@
+"""
+Headless replay of camera paths through the viewer CPU data path, no window or OpenGL context is needed
+Every frame goes through the same steps as a viewport update and a NSceneV2 scene update:
+projection - camera frame applied to the Projection and converted to the world viewport (NWindow.projection)
+tree - NTree.update_viewport
+net - NNet.update_viewport
+chunks - details factor, resident region strips and NNet.get_region_chunks of the cells to upload (NSceneV2)
+Reports p50/p95/p99 latency of every stage and the bytes of the chunks produced per frame
+
+Scripted paths: zoom_in - from the min zoom to one value per pixel, long_pan - across the whole net at one
+value per pixel, layer_jumps - centering random layers at one value per pixel
+A path recorded in the viewer (R key, camera_path.json) is replayed with --path on the net it was recorded on,
+the net is loaded from the source saved with the path (synthetic, safetensors, tile store or diff checkpoints)
+and its grid has to match the recorded grid size
+
+The results are written to a JSON baseline with --save, compared with a baseline of another commit with --compare
+--trace records the spans of the replayed code (n_profiler) and writes them as a Chrome trace
+--alloc reports the allocations of the stages (n_alloc_tracker) and the calls over the --budget,
+the warnings of every call are printed with --verbose
+
+Usage: python -m app.draw.gl.benchmark.bench_camera_replay [--model tinyllama-1b] [--paths zoom_in long_pan]
+       [--path camera_path.json] [--save baseline.json] [--compare baseline.json] [--threshold 0.2]
+       [--trace trace.json] [--alloc] [--budget 256]
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from app.draw.gl.n_alloc_tracker import MB, alloc_tracker
+from app.draw.gl.n_camera import NCameraPath, projection_viewport
+from app.draw.gl.n_layout import RowLayout, ShelfLayout
+from app.draw.gl.n_net import NNet
+from app.draw.gl.n_profiler import profiler
+from app.draw.gl.n_projection import Projection
+from app.draw.gl.n_region import details_factor, leaf_region, resident_strips
+from app.draw.gl.n_synthetic import CONFIGS
+from app.draw.gl.n_tree import NTree
+
+STAGES = ["projection", "tree", "net", "chunks"]
+PERCENTILES = [50, 95, 99]
+SCRIPTED_PATHS = ["zoom_in", "long_pan", "layer_jumps"]
+LAYOUTS = {"RowLayout": RowLayout, "ShelfLayout": ShelfLayout}
+
+
+class Camera:
+    """
+    Projection driven like NWindow does, frames are recorded into a NCameraPath
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.projection = Projection()
+        self.projection.set_aspect_ratio(width / height)
+        self.zoom_factor = 1.0
+        self.camera_path = NCameraPath()
+        self.camera_path.start()
+
+    def zoom(self, zoom_factor):
+        # Around the window center
+        self.zoom_factor = zoom_factor
+        self.projection.zoom(0, 0, zoom_factor)
+
+    def center_on(self, world_x, world_y):
+        sx, sy = self.projection.world_to_window_point(world_x, world_y)
+        self.projection.translate_by(-sx, -sy)
+
+    def pan(self, dx, dy):
+        """
+        :param dx: window widths, positive moves the camera right
+        """
+        self.projection.translate_by(-dx * 2.0, -dy * 2.0)
+
+    def record(self):
+        self.camera_path.record(self.projection, self.zoom_factor, self.width, self.height)
+
+
+def min_zoom(n_net, width, height):
+    """
+    Whole net in the window with a margin, as NWindow.calculate_min_zoom
+    """
+    return min(2.0 / n_net.total_width * width / height, 2.0 / n_net.total_height) / 1.2
+
+
+def pixel_zoom(n_net, width, height):
+    """
+    Zoom showing one value per pixel
+    """
+    return 2.0 * width / height / (width * n_net.node_gap_x)
+
+
+def scripted_path(name, n_net, width, height, frames, seed=0):
+    """
+    :return: list of camera frames
+    """
+    camera = Camera(width, height)
+    start_zoom = min_zoom(n_net, width, height)
+    end_zoom = pixel_zoom(n_net, width, height)
+    if name == "zoom_in":
+        camera.zoom(start_zoom)
+        camera.center_on(n_net.total_width / 2, n_net.total_height / 2)
+        for zoom_factor in np.geomspace(start_zoom, end_zoom, frames):
+            camera.zoom(zoom_factor)
+            camera.record()
+    elif name == "long_pan":
+        camera.zoom(end_zoom)
+        camera.center_on(0, n_net.total_height / 2)
+        # Window widths to cross the net
+        distance = n_net.grid_columns_count / width
+        for _ in range(frames):
+            camera.record()
+            camera.pan(distance / frames, 0)
+    elif name == "layer_jumps":
+        camera.zoom(end_zoom)
+        layers = random.Random(seed).choices(n_net.layers, k=frames)
+        for layer in layers:
+            camera.center_on((layer.column_offset + layer.columns_count / 2) * n_net.node_gap_x,
+                             (layer.row_offset + layer.rows_count / 2) * n_net.node_gap_y)
+            camera.record()
+    else:
+        raise ValueError(f"Unsupported camera path: {name}, expected one of {SCRIPTED_PATHS}")
+    return camera.camera_path.frames
+
+
+class SceneState:
+    """
+    Resident region bookkeeping of NSceneV2.update_scene_entities without the texture
+    """
+
+    def __init__(self, texture_width, texture_height):
+        self.texture_width = texture_width
+        self.texture_height = texture_height
+        self.mega_leaf = None
+        self.details_level = None
+        self.resident_region = None
+        self.resident_factor = None
+
+    def update(self, n_net, n_tree, viewport, width, height):
+        """
+        :return: bytes of the chunks produced
+        """
+        if n_tree.mega_leaf is None:
+            return 0
+        factor = details_factor(n_net, viewport, width, height)
+        if self.mega_leaf == n_tree.mega_leaf and factor == self.details_level:
+            return 0
+        self.mega_leaf = n_tree.mega_leaf
+        self.details_level = factor
+        region = leaf_region(n_net, self.mega_leaf, factor, self.texture_width, self.texture_height)
+        produced = 0
+        for x1, y1, x2, y2 in resident_strips(region, factor, self.resident_region, self.resident_factor):
+            if x2 <= x1 or y2 <= y1:
+                continue
+            chunks, dimensions = n_net.get_region_chunks(x1, y1, x2, y2, factor)
+            produced += sum(chunk.nbytes for chunk in chunks)
+        self.resident_region = region
+        self.resident_factor = factor
+        return produced
+
+
+def replay(n_net, frames):
+    """
+    :return: dictionary of stage name to list of ms per frame, list of bytes per frame
+    """
+    n_tree = NTree(0)
+    n_tree.set_size(n_net.total_width, n_net.total_height)
+    projection = Projection()
+    replayer = NCameraPath(frames)
+    # NSceneV2 creates the texture twice the window size
+    scene = SceneState(frames[0]["width"] * 2, frames[0]["height"] * 2)
+    timings = {stage: [] for stage in STAGES}
+    produced = []
+    for frame in frames:
+        start_time = time.perf_counter()
+        zoom_factor, width, height = replayer.apply(frame, projection)
+        viewport = projection_viewport(projection, zoom_factor)
+        timings["projection"].append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        n_tree.update_viewport(viewport)
+        timings["tree"].append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        n_net.update_viewport(viewport)
+        timings["net"].append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        produced.append(scene.update(n_net, n_tree, viewport, width, height))
+        timings["chunks"].append(time.perf_counter() - start_time)
+    return {stage: [value * 1000 for value in values] for stage, values in timings.items()}, produced
+
+
+def summarize(timings, produced):
+    result = {"frames": len(produced), "stages": {}}
+    for stage, values in timings.items():
+        result["stages"][stage] = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+        result["stages"][stage]["mean"] = float(np.mean(values))
+    result["bytes"] = {f"p{p}": float(np.percentile(produced, p)) for p in PERCENTILES}
+    result["bytes"]["total"] = int(sum(produced))
+    return result
+
+
+def print_summary(name, summary):
+    print(f"{name}: {summary['frames']} frames, {summary['bytes']['total'] / 1024 ** 2:.1f} MB produced")
+    print(f"{'stage':>12} {'p50':>10} {'p95':>10} {'p99':>10} {'mean':>10}")
+    for stage, values in summary["stages"].items():
+        print(f"{stage:>12} " + " ".join(f"{values[key]:>8.3f}ms" for key in ["p50", "p95", "p99", "mean"]))
+    values = summary["bytes"]
+    print(f"{'bytes':>12} " + " ".join(f"{values[f'p{p}'] / 1024:>8.0f}KB" for p in PERCENTILES))
+
+
+def compare(results, baseline, threshold, min_delta):
+    """
+    Compare p95 latencies and p95 bytes with the baseline
+    :param min_delta: ms, smaller latency increases are timer noise and never reported
+    :return: list of regressions descriptions
+    """
+    regressions = []
+    print(f"{'path':>12} {'stage':>12} {'baseline p95':>14} {'p95':>10} {'change':>8}")
+    for name, summary in results.items():
+        if name not in baseline["paths"]:
+            continue
+        previous = baseline["paths"][name]
+        rows = [(stage, previous["stages"][stage]["p95"], summary["stages"][stage]["p95"], "ms")
+                for stage in summary["stages"] if stage in previous["stages"]]
+        rows.append(("bytes", previous["bytes"]["p95"], summary["bytes"]["p95"], "B"))
+        for stage, old, new, unit in rows:
+            change = (new - old) / old if old > 0 else 0.0
+            flag = ""
+            if change > threshold and (unit == "B" or new - old > min_delta):
+                flag = "REGRESSION"
+                regressions.append(f"{name} {stage} p95 {old:.3f}{unit} -> {new:.3f}{unit}")
+            print(f"{name:>12} {stage:>12} {old:>12.3f}{unit:<2} {new:>8.3f}{unit:<2} {change:>+7.0%} {flag}")
+    return regressions
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """
+    The replayed code prints timings of every step, they are hidden unless verbose
+    """
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def recorded_net(net, cache_size):
+    """
+    Load the net a camera path was recorded on
+    :param net: NCameraPath.net, NNet.describe() of the recording viewer
+    :param cache_size: tiles cache size in bytes
+    """
+    if net is None:
+        raise ValueError("Camera path was recorded without the net, record it again to replay it")
+    source = net.get("source")
+    if net.get("layout") not in LAYOUTS:
+        raise ValueError(f"Unsupported layout of the recorded net: {net.get('layout')}")
+    n_net = NNet(None, None, pyramid_levels=net["pyramid_levels"], aggregation=net["aggregation"],
+                 layout=LAYOUTS[net["layout"]]())
+    if source == "synthetic":
+        n_net.init_from_synthetic(net["config"], net["seed"], cache_size=cache_size)
+    elif source == "safetensors":
+        n_net.init_from_safetensors(net["paths"])
+    elif source == "tile_store":
+        n_net.init_from_tile_store(net["paths"], cache_size=cache_size)
+    elif source == "diff":
+        n_net.init_from_diff(net["base"], net["tuned"], net["mode"], cache_size=cache_size)
+    else:
+        raise ValueError(f"Recorded net source can not be loaded again: {source}")
+    if (n_net.grid_columns_count, n_net.grid_rows_count) != (net["grid_columns"], net["grid_rows"]):
+        raise ValueError(f"Grid {n_net.grid_columns_count}x{n_net.grid_rows_count} differs from the recorded "
+                         f"grid {net['grid_columns']}x{net['grid_rows']}")
+    return n_net
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="tinyllama-1b", choices=list(CONFIGS),
+                        help="synthetic model of the scripted paths, --path loads its recorded net")
+    parser.add_argument("--levels", type=int, default=12, help="pyramid levels of the --model net")
+    parser.add_argument("--cache", type=int, default=512, help="tiles cache size in MB")
+    parser.add_argument("--paths", nargs="+", default=SCRIPTED_PATHS, choices=SCRIPTED_PATHS)
+    parser.add_argument("--path", help="recorded camera path, replayed instead of the scripted paths")
+    parser.add_argument("--frames", type=int, default=200, help="frames of every scripted path")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--save", help="write the results to a JSON baseline")
+    parser.add_argument("--compare", help="compare the results with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 increase reported as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.5, help="p95 increase in ms ignored as noise")
+    parser.add_argument("--trace", help="write the profiler spans of the replay as a Chrome trace")
+    parser.add_argument("--alloc", action="store_true", help="track the allocations of the stages")
+    parser.add_argument("--budget", type=float, default=256, help="transient MB of a stage call reported with --alloc")
+    parser.add_argument("--verbose", action="store_true", help="keep the prints of the replayed code")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if args.path:
+        camera_path = NCameraPath.load(args.path)
+        model = camera_path.net.get("config", camera_path.net.get("source")) if camera_path.net else None
+        try:
+            with quiet(args.verbose):
+                n_net = recorded_net(camera_path.net, args.cache * 1024 ** 2)
+        except ValueError as error:
+            parser.error(f"{args.path}: {error}")
+    else:
+        model = args.model
+        with quiet(args.verbose):
+            n_net = NNet(None, None, pyramid_levels=args.levels, layout=ShelfLayout())
+            n_net.init_from_synthetic(args.model, cache_size=args.cache * 1024 ** 2)
+    print(f"{model}: net initialized {(time.perf_counter() - start_time) * 1000:.0f} ms, "
+          f"grid {n_net.grid_columns_count}x{n_net.grid_rows_count}")
+
+    if args.path:
+        paths = {os.path.basename(args.path): camera_path.frames}
+    else:
+        with quiet(args.verbose):
+            paths = {name: scripted_path(name, n_net, args.width, args.height, args.frames) for name in args.paths}
+
+    if args.trace:
+        profiler.start()
+    if args.alloc:
+        alloc_tracker.default_budget = args.budget * MB
+        alloc_tracker.start()
+    results = {}
+    for name, frames in paths.items():
+        if len(frames) == 0:
+            print(f"{name}: no frames")
+            continue
+        with quiet(args.verbose):
+            timings, produced = replay(n_net, frames)
+        results[name] = summarize(timings, produced)
+        print_summary(name, results[name])
+
+    if args.alloc:
+        alloc_tracker.stop()
+        alloc_tracker.print_report()
+    if args.trace:
+        profiler.stop()
+        profiler.print_summary()
+        profiler.export_chrome_trace(args.trace)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"model": model, "width": args.width, "height": args.height, "frames": args.frames,
+                       "paths": results}, file, indent=2)
+        print("Baseline saved", args.save)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("model") != model:
+            print("Baseline model", baseline.get("model"), "differs from", model)
+        if baseline.get("frames") != args.frames:
+            print("Baseline frames", baseline.get("frames"), "differ from", args.frames)
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if len(regressions) > 0:
+            print("Regressions:", len(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Per token overhead of NActivationCapture on TinyLlama 1.1B
+Generates --tokens tokens for a prompt without hooks and with the decoder blocks hooked,
+reports the generation time per token, the time spent in the hooks and the memory of the capture buffers
+
+Requires torch and transformers, the model is downloaded from the hugging face hub. --random builds the model
+from the TinyLlama configuration with random weights and --layers decoder blocks, for machines without the hub
+or the memory for the full model, the prompt is then random token ids
+Usage: python -m app.draw.gl.benchmark.bench_capture [--tokens 64] [--downsample 1] [--capacity 4]
+       [--random] [--layers 22]
+"""
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, LlamaConfig, LlamaForCausalLM
+
+from app.draw.gl.n_capture import NActivationCapture
+
+MODEL_NAME = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
+PROMPT = "The quick brown fox jumps over the lazy dog. Explain why this sentence is used so often."
+# TinyLlama 1.1B configuration used by --random
+TINY_LLAMA_CONFIG = dict(vocab_size=32000, hidden_size=2048, intermediate_size=5632, num_hidden_layers=22,
+                         num_attention_heads=32, num_key_value_heads=4, max_position_embeddings=2048)
+PROMPT_TOKENS = 24
+
+
+def load_model(random_weights, layers):
+    """
+    :return: model and the generate inputs of the prompt
+    """
+    if random_weights:
+        torch.manual_seed(0)
+        config = LlamaConfig(**dict(TINY_LLAMA_CONFIG, num_hidden_layers=layers))
+        model = LlamaForCausalLM(config)
+        input_ids = torch.randint(0, config.vocab_size, (1, PROMPT_TOKENS))
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, torch_dtype=torch.float32)
+        inputs = tokenizer(PROMPT, return_tensors="pt")
+    model.eval()
+    return model, inputs
+
+
+def generate(model, inputs, tokens):
+    start_time = time.perf_counter()
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=tokens, min_new_tokens=tokens, do_sample=False)
+    return (time.perf_counter() - start_time) / tokens * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--downsample", type=int, default=1)
+    parser.add_argument("--capacity", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--random", action="store_true", help="random weights instead of the hub checkpoint")
+    parser.add_argument("--layers", type=int, default=22, help="decoder blocks of the --random model")
+    args = parser.parse_args()
+
+    model, inputs = load_model(args.random, args.layers)
+
+    generate(model, inputs, 4)  # warm up
+    baseline = generate(model, inputs, args.tokens)
+
+    capture = NActivationCapture(model, capacity=args.capacity, max_tokens=args.max_tokens,
+                                 downsample=args.downsample)
+    generate(model, inputs, 4)  # allocates the buffers
+    capture.reset_timing()
+    captured = generate(model, inputs, args.tokens)
+    hooks_per_token = capture.hooks_time / args.tokens * 1000
+    capture.remove()
+
+    print(f"tokens: {args.tokens}, hooked modules: {len(capture.rings)}, downsample: {args.downsample}")
+    print(f"without capture: {baseline:8.2f} ms/token")
+    print(f"with capture:    {captured:8.2f} ms/token  overhead: {100 * (captured / baseline - 1):.1f}%")
+    print(f"hooks:           {hooks_per_token:8.3f} ms/token  calls: {capture.hooks_calls}")
+    print(f"capture buffers: {capture.nbytes() / (1024 * 1024):8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Chunk extraction time of a zoomed out viewport with the Grid worker threads
+The net has the tensor shapes of TinyLlama 1.1B filled with random bf16 values (about 2.2 GB resident)
+The whole net is visible and down sampled to about 1920x1080 cells, as in the first frame after loading
+
+Usage: python -m app.draw.gl.benchmark.bench_chunks_workers [--blocks 22] [--workers 1 2 4 8 16] [--factor 8]
+Threads pay off only with free cores, run it on a machine with 8 to 16 cores
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from app.draw.gl.n_net import NNet, Layer
+
+REPEATS = 10
+TARGET_WIDTH = 1920
+TARGET_HEIGHT = 1080
+
+# TinyLlama 1.1B: hidden 2048, intermediate 5632, 4 key value heads of 64, vocabulary 32000
+HIDDEN = 2048
+INTERMEDIATE = 5632
+KV = 256
+VOCABULARY = 32000
+
+
+def tinyllama_shapes(blocks):
+    shapes = [("model.embed_tokens.weight", (VOCABULARY, HIDDEN))]
+    for block in range(blocks):
+        prefix = f"model.layers.{block}."
+        shapes += [
+            (prefix + "self_attn.q_proj.weight", (HIDDEN, HIDDEN)),
+            (prefix + "self_attn.k_proj.weight", (KV, HIDDEN)),
+            (prefix + "self_attn.v_proj.weight", (KV, HIDDEN)),
+            (prefix + "self_attn.o_proj.weight", (HIDDEN, HIDDEN)),
+            (prefix + "mlp.gate_proj.weight", (INTERMEDIATE, HIDDEN)),
+            (prefix + "mlp.up_proj.weight", (INTERMEDIATE, HIDDEN)),
+            (prefix + "mlp.down_proj.weight", (HIDDEN, INTERMEDIATE)),
+            (prefix + "input_layernorm.weight", (HIDDEN,)),
+            (prefix + "post_attention_layernorm.weight", (HIDDEN,)),
+        ]
+    shapes += [("model.norm.weight", (HIDDEN,)), ("lm_head.weight", (VOCABULARY, HIDDEN))]
+    return shapes
+
+
+def random_bfloat16(generator, shape):
+    values = generator.standard_normal(shape, dtype=np.float32) * 0.02
+    return (values.view(np.uint32) >> 16).astype(np.uint16)
+
+
+def create_net(blocks):
+    n_net = NNet(None, None)
+    generator = np.random.default_rng(0)
+    for name, shape in tinyllama_shapes(blocks):
+        n_net.layers.append(Layer(random_bfloat16(generator, shape), name=name, dtype="bfloat16"))
+    n_net.init_grid()
+    return n_net
+
+
+def measure(func):
+    func()  # warm up
+    times = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    return np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=22)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--factor", type=int, default=None, help="down sampling factor, fits the window by default")
+    args = parser.parse_args()
+
+    n_net = create_net(args.blocks)
+    grid = n_net.grid
+    x1, y1, x2, y2 = 0, 0, n_net.grid_columns_count, n_net.grid_rows_count
+    factor = math.ceil(min(x2 / TARGET_WIDTH, y2 / TARGET_HEIGHT))
+    factor = args.factor or 2 ** math.ceil(math.log2(factor))
+    grid.get_visible_layers(x1, y1, x2, y2)
+    print("cores:", os.cpu_count(), "visible layers:", len(grid.visible_layers), "factor:", factor)
+
+    results = []
+    for workers in args.workers:
+        grid.set_workers(workers)
+        chunks_ms = measure(lambda: grid.get_visible_data_chunks(x1, y1, x2, y2, factor, factor, True))
+        positions_ms = measure(lambda: grid.get_visible_data_positions_and_values(x1, y1, x2, y2, factor, factor))
+        results.append((workers, chunks_ms, positions_ms))
+    grid.set_workers(None)
+
+    print("")
+    print(f"{'workers':>8} {'chunks ms':>10} {'speedup':>8} {'positions ms':>13} {'speedup':>8}")
+    base_chunks, base_positions = results[0][1], results[0][2]
+    cores = os.cpu_count() or 1
+    for workers, chunks_ms, positions_ms in results:
+        # More threads than cores measure only the threads overhead
+        note = " more workers than cores" if workers > cores else ""
+        print(f"{workers:>8} {chunks_ms:>10.2f} {base_chunks / chunks_ms:>7.2f}x "
+              f"{positions_ms:>13.2f} {base_positions / positions_ms:>7.2f}x{note}")
+    if cores < 8:
+        print(f"Only {cores} cores, the Grid threads stay off by default until measured on 8 to 16 cores")
+
+
+if __name__ == "__main__":
+    main()
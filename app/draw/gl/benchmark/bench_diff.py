@@ -0,0 +1,64 @@
+"""
+Lazy checkpoint diff levels (n_diff) against the NPyramid of the dense difference
+Base and tuned tensors are random 2D and 1D float32 arrays. Every level of the TiledArray pyramid is read whole
+and compared with the level built by NPyramid. Then the time of one tile is reported, computed down from
+level 0 (cold cache) and read from the cache (warm).
+
+Usage: python -m app.draw.gl.benchmark.bench_diff [--mode delta] [--aggregation mean]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.draw.gl.n_diff import DIFF_MODES, RELATIVE_EPSILON, diff_levels
+from app.draw.gl.n_pyramid import AGGREGATIONS, NPyramid
+from app.draw.gl.n_tiles import NLruCache
+
+SHAPES = [(3000, 2500), (300000,), (5000,)]
+LEVELS = 6
+
+
+def dense_difference(base, tuned, mode):
+    difference = tuned - base
+    if mode == "relative":
+        difference /= np.abs(base) + RELATIVE_EPSILON
+    return difference
+
+
+def read_level(level):
+    return level[:] if level.ndim == 1 else level[:, :]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="delta", choices=DIFF_MODES)
+    parser.add_argument("--aggregation", default="mean", choices=list(AGGREGATIONS))
+    args = parser.parse_args()
+
+    generator = np.random.default_rng(0)
+    print(f"{'shape':>14} {'levels':>7} {'cold tile ms':>13} {'warm tile ms':>13}")
+    for index, shape in enumerate(SHAPES):
+        base = generator.standard_normal(shape, dtype=np.float32)
+        tuned = base + generator.standard_normal(shape, dtype=np.float32) * 0.01
+        reference = NPyramid(LEVELS, args.aggregation)
+        reference.build(dense_difference(base, tuned, args.mode))
+
+        cache = NLruCache(1024 ** 3)
+        levels = diff_levels(f"tensor {index}", base, tuned, "float32", "float32", cache, LEVELS, args.aggregation,
+                             args.mode)
+        start_time = time.perf_counter()
+        levels[-1].get_tile(0)
+        cold = (time.perf_counter() - start_time) * 1000
+        start_time = time.perf_counter()
+        levels[-1].get_tile(0)
+        warm = (time.perf_counter() - start_time) * 1000
+
+        assert len(levels) == len(reference.levels), (shape, len(levels), len(reference.levels))
+        for level, expected in zip(levels, reference.levels):
+            assert np.allclose(read_level(level), expected, rtol=1e-5, atol=1e-6), (shape, level.shape)
+        print(f"{str(shape):>14} {len(levels):>7} {cold:>13.2f} {warm:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+World size of the TinyLlama 1.1B layers placed by the row and the shelf layouts
+Only the tensor shapes are used, no data is generated
+Reports the grid size, the part of the grid covered by layers, the factor needed to fit the whole net
+into a 1920x1080 window (the minimum zoom) and the texture values uploaded for that screen,
+with the values falling into empty grid area. The uploaded values are also reported at the row layout factor,
+the same down sampling for both layouts
+
+Usage: python -m app.draw.gl.benchmark.bench_layout
+"""
+import math
+
+import numpy as np
+
+from app.draw.gl.benchmark.bench_chunks_workers import tinyllama_shapes
+from app.draw.gl.n_layout import RowLayout, ShelfLayout
+from app.draw.gl.n_tile_store import layer_shape
+
+TARGET_WIDTH = 1920
+TARGET_HEIGHT = 1080
+
+
+def measure(layout, shapes):
+    grid_shapes = []
+    for shape in shapes:
+        shape = layout.fold_shape(shape) or layer_shape(shape)
+        grid_shapes.append(shape if len(shape) == 2 else (shape[0], 1))
+    grid_shapes = np.array(grid_shapes, dtype=np.int64)
+    offsets, columns, rows = layout.place(grid_shapes)
+    size = int(np.prod(grid_shapes, axis=1).sum())
+    # Whole net on screen, the factor is rounded to the pyramid levels like NSceneV2 does
+    factor = 2 ** math.ceil(math.log2(max(columns / TARGET_WIDTH, rows / TARGET_HEIGHT, 1)))
+    uploaded = math.ceil(columns / factor) * math.ceil(rows / factor)
+    empty = uploaded - size / (factor * factor)
+    return columns, rows, size / (columns * rows), factor, uploaded, empty
+
+
+def main():
+    shapes = [shape for _, shape in tinyllama_shapes(22)]
+    print(f"{'layout':>8} {'columns':>9} {'rows':>7} {'filled':>7} {'min zoom factor':>16} {'uploaded values':>16} "
+          f"{'empty values':>13} {'uploaded at row factor':>23}")
+    row_factor = None
+    for name, layout in [("row", RowLayout()), ("shelf", ShelfLayout())]:
+        columns, rows, filled, factor, uploaded, empty = measure(layout, shapes)
+        row_factor = row_factor or factor
+        uploaded_row_factor = math.ceil(columns / row_factor) * math.ceil(rows / row_factor)
+        print(f"{name:>8} {columns:>9} {rows:>7} {100 * filled:>6.1f}% {factor:>16} {uploaded:>16} "
+              f"{int(empty):>13} {uploaded_row_factor:>23}")
+
+
+if __name__ == "__main__":
+    main()
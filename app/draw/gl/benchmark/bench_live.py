@@ -0,0 +1,75 @@
+"""
+Training step overhead of NLivePublisher
+Trains a stack of --layers linear layers of --hidden features with Adam on random batches, without the publisher,
+with the publisher at its default rate limit and publishing on every step (--min-interval 0),
+reports the step time, the overhead and the time of the publishes
+
+Requires torch
+Usage: python -m app.draw.gl.benchmark.bench_live [--hidden 1024] [--layers 8] [--steps 200] [--batch 64]
+"""
+import argparse
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+from app.draw.gl.n_live import NLivePublisher
+
+
+def create_model(hidden, layers):
+    torch.manual_seed(0)
+    return nn.Sequential(*[nn.Sequential(nn.Linear(hidden, hidden), nn.ReLU()) for _ in range(layers)])
+
+
+def train(model, steps, batch, publisher=None):
+    """
+    :return: ms per step, ms spent in publish, publishes with regions
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    hidden = model[0][0].in_features
+    publish_time = 0
+    publishes = 0
+    start_time = time.perf_counter()
+    for step in range(steps):
+        x = torch.randn(batch, hidden)
+        # Random targets keep the gradients of every layer non zero
+        loss = (model(x) - torch.randn(batch, hidden)).pow(2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if publisher is not None:
+            publish_start = time.perf_counter()
+            publishes += publisher.publish(step) > 0
+            publish_time += time.perf_counter() - publish_start
+    return (time.perf_counter() - start_time) * 1000 / steps, publish_time * 1000, publishes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=64)
+    args = parser.parse_args()
+
+    model = create_model(args.hidden, args.layers)
+    parameters = sum(p.numel() for p in model.parameters())
+    train(model, 10, args.batch)  # warm up
+    baseline, _, _ = train(model, args.steps, args.batch)
+    print(f"parameters: {parameters}, steps: {args.steps}, batch: {args.batch}")
+    print(f"{'publisher':>16} {'step':>10} {'overhead':>9} {'publish':>10} {'publishes':>10}")
+    print(f"{'none':>16} {baseline:>8.2f}ms")
+    for min_interval in [0.2, 0]:
+        publisher = NLivePublisher(model.named_parameters(), name=f"tensorgrid_bench_{os.getpid()}",
+                                   min_interval=min_interval)
+        try:
+            step_time, publish_time, publishes = train(model, args.steps, args.batch, publisher)
+        finally:
+            publisher.close()
+        print(f"{f'interval {min_interval}s':>16} {step_time:>8.2f}ms {100 * (step_time / baseline - 1):>8.1f}% "
+              f"{publish_time / max(publishes, 1):>8.2f}ms {publishes:>10}")
+
+
+if __name__ == "__main__":
+    main()
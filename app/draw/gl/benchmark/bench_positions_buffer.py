@@ -0,0 +1,94 @@
+"""
+Time and peak memory of the points and nodes data path, NNet.get_positions_and_values_array
+Compares the previous implementation (per layer index arrays, astype copies, concatenate and column_stack)
+with the counted fill of the reusable (N, 3) buffer. Peak memory is the tracemalloc peak of one call,
+the reusable buffer is allocated by a warm up call and is not part of the measured peak.
+
+Usage: python -m app.draw.gl.benchmark.bench_positions_buffer
+"""
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.draw.gl.n_net import NNet
+
+LAYERS_SHAPES = [(2048, 2048), (256, 2048), (256, 2048), (2048, 2048), (5632, 2048), (5632, 2048), (2048, 5632),
+                 (2048,), (2048,)]
+FACTORS = [1, 2, 4]
+REPEATS = 5
+
+
+def positions_with_concatenate(n_net, x1, y1, x2, y2, factor):
+    """
+    Previous implementation, kept as the reference
+    """
+    grid = n_net.grid
+    col_min, row_min, col_max, row_max = n_net.world_to_grid_position(x1, y1, x2, y2)
+    rows_list = []
+    columns_list = []
+    values_list = []
+    for sublayer in grid.visible_layers:
+        result = grid.slice_layer(sublayer, col_min, row_min, col_max, row_max, factor, factor)
+        if result is None:
+            continue
+        chunk, chunk_col_min, chunk_row_min = result
+        if chunk.ndim == 1:
+            chunk_indices = np.where(chunk != grid.default_value)
+            chunk_rows = chunk_indices[0]
+            chunk_columns = np.zeros(chunk_rows.size, dtype=chunk_rows.dtype)
+        else:
+            chunk_indices = np.where(chunk != grid.default_value)
+            chunk_rows, chunk_columns = chunk_indices
+        chunk_values = chunk[chunk_indices]
+        chunk_columns = (chunk_columns * factor) + chunk_col_min
+        chunk_rows = (chunk_rows * factor) + chunk_row_min
+        rows_list.append(chunk_rows.astype(np.float32, copy=False))
+        columns_list.append(chunk_columns.astype(np.float32, copy=False))
+        values_list.append(chunk_values.astype(np.float32, copy=False))
+    rows = np.concatenate(rows_list)
+    columns = np.concatenate(columns_list)
+    values = np.concatenate(values_list)
+    return np.column_stack((columns * n_net.node_gap_x, rows * n_net.node_gap_y, values))
+
+
+def measure(func):
+    func()  # warm up, allocates the reusable buffer
+    times = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.median(times) * 1000, peak / (1024 * 1024)
+
+
+def main():
+    n_net = NNet(None, None)
+    generator = np.random.default_rng(0)
+    n_net.create_layers([(generator.standard_normal(shape, dtype=np.float32) * 0.02) for shape in LAYERS_SHAPES])
+    n_net.init_grid()
+    x1, y1, x2, y2 = 0, 0, n_net.total_width, n_net.total_height
+    col_min, row_min, col_max, row_max = n_net.world_to_grid_position(x1, y1, x2, y2)
+    n_net.grid.get_visible_layers(col_min, row_min, col_max, row_max)
+
+    results = []
+    for factor in FACTORS:
+        reference = positions_with_concatenate(n_net, x1, y1, x2, y2, factor)
+        assert np.array_equal(reference, n_net.get_positions_and_values_array(x1, y1, x2, y2, factor))
+        before = measure(lambda: positions_with_concatenate(n_net, x1, y1, x2, y2, factor))
+        after = measure(lambda: n_net.get_positions_and_values_array(x1, y1, x2, y2, factor))
+        results.append((factor, len(reference), before, after))
+
+    print("")
+    print(f"{'factor':>6} {'points':>10} {'before ms':>10} {'after ms':>9} {'before peak MB':>15} "
+          f"{'after peak MB':>14}")
+    for factor, points, (before_ms, before_peak), (after_ms, after_peak) in results:
+        print(f"{factor:>6} {points:>10} {before_ms:>10.1f} {after_ms:>9.1f} {before_peak:>15.1f} {after_peak:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
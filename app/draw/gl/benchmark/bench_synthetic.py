@@ -0,0 +1,97 @@
+"""
+Scaling of the viewer CPU path with synthetic LLaMA shaped models from 1B to 405B parameters
+No model files are needed, values are generated per tile on demand (n_synthetic)
+For every model: net initialization, then three frames of a 1920x1080 window going through NTree.update_viewport,
+NNet.update_viewport and NNet.get_region_chunks as NSceneV2 does:
+overview - whole net on screen, zoom - one value per pixel in the middle of the net, pan - zoom frame moved by 10%
+Reports the time of every step, the tiles generated and the peak resident memory
+
+Usage: python -m app.draw.gl.benchmark.bench_synthetic [--models tinyllama-1b llama-7b llama-70b llama-405b]
+"""
+import argparse
+import math
+import resource
+import time
+
+from app.draw.gl.n_layout import ShelfLayout
+from app.draw.gl.n_net import NNet
+from app.draw.gl.n_region import region_difference
+from app.draw.gl.n_synthetic import CONFIGS, parameters_count
+from app.draw.gl.n_tree import NTree
+
+TARGET_WIDTH = 1920
+TARGET_HEIGHT = 1080
+
+
+def frame(n_net, n_tree, cells, factor, previous=None):
+    """
+    :param cells: region x1, y1, x2, y2 in cells of the factor
+    :return: tree ms, visible layers ms, chunks ms, uploaded values
+    """
+    x1, y1, x2, y2 = cells
+    viewport = (x1 * factor * n_net.node_gap_x, y1 * factor * n_net.node_gap_y,
+                (x2 - x1) * factor * n_net.node_gap_x, (y2 - y1) * factor * n_net.node_gap_y, 1.0)
+    start_time = time.perf_counter()
+    n_tree.update_viewport(viewport)
+    tree_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    n_net.update_viewport(viewport)
+    visible_time = time.perf_counter() - start_time
+
+    strips = [cells] if previous is None else region_difference(cells, previous)
+    start_time = time.perf_counter()
+    uploaded = 0
+    for sx1, sy1, sx2, sy2 in strips:
+        if sx2 <= sx1 or sy2 <= sy1:
+            continue
+        chunks, dimensions = n_net.get_region_chunks(sx1, sy1, sx2, sy2, factor)
+        uploaded += sum(chunk.size for chunk in chunks)
+    chunks_time = time.perf_counter() - start_time
+    return tree_time * 1000, visible_time * 1000, chunks_time * 1000, uploaded
+
+
+def peak_memory_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["tinyllama-1b", "llama-7b", "llama-70b", "llama-405b"],
+                        choices=list(CONFIGS))
+    parser.add_argument("--levels", type=int, default=12, help="pyramid levels, synthetic levels cost nothing")
+    parser.add_argument("--cache", type=int, default=512, help="tiles cache size in MB")
+    args = parser.parse_args()
+
+    print(f"{'model':>13} {'params':>8} {'init':>8} {'frame':>9} {'factor':>6} {'tree':>8} {'layers':>8} "
+          f"{'chunks':>9} {'values':>9} {'tiles':>7} {'peak rss':>9}")
+    for model in args.models:
+        start_time = time.perf_counter()
+        n_net = NNet(None, None, pyramid_levels=args.levels, layout=ShelfLayout())
+        n_net.init_from_synthetic(model, cache_size=args.cache * 1024 ** 2)
+        init_time = (time.perf_counter() - start_time) * 1000
+        n_tree = NTree(0)
+        n_tree.set_size(n_net.total_width, n_net.total_height)
+
+        columns = n_net.grid_columns_count
+        rows = n_net.grid_rows_count
+        overview_factor = 2 ** math.ceil(math.log2(max(columns / TARGET_WIDTH, rows / TARGET_HEIGHT, 1)))
+        zoom_x = columns // 2 - TARGET_WIDTH // 2
+        zoom_y = rows // 2 - TARGET_HEIGHT // 2
+        zoom = (zoom_x, zoom_y, zoom_x + TARGET_WIDTH, zoom_y + TARGET_HEIGHT)
+        pan_dx = TARGET_WIDTH // 10
+        frames = [
+            ("overview", (0, 0, -(-columns // overview_factor), -(-rows // overview_factor)), overview_factor, None),
+            ("zoom", zoom, 1, None),
+            ("pan", (zoom[0] + pan_dx, zoom[1], zoom[2] + pan_dx, zoom[3]), 1, zoom)
+        ]
+        for name, cells, factor, previous in frames:
+            misses = n_net.tiles_cache.misses
+            tree_time, visible_time, chunks_time, uploaded = frame(n_net, n_tree, cells, factor, previous)
+            print(f"{model:>13} {parameters_count(model) / 1e9:>7.1f}B {init_time:>6.0f}ms {name:>9} {factor:>6} "
+                  f"{tree_time:>6.1f}ms {visible_time:>6.1f}ms {chunks_time:>7.1f}ms {uploaded:>9} "
+                  f"{n_net.tiles_cache.misses - misses:>7} {peak_memory_mb():>7.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
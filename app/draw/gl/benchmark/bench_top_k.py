@@ -0,0 +1,81 @@
+"""
+Top k magnitude search of NNet.find_top_k against a full numpy scan
+The net has the tensor shapes of TinyLlama 1.1B filled with random bf16 values, a few outlier channels
+(columns scaled by --outlier-scale) are injected in every block like the outlier features of trained models.
+Tile statistics are computed once before the search, as the background pass of NStatsIndex does at load time.
+
+Usage: python -m app.draw.gl.benchmark.bench_top_k [--blocks 4] [--k 100] [--workers 4]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.draw.gl.benchmark.bench_chunks_workers import random_bfloat16, tinyllama_shapes
+from app.draw.gl.n_dtypes import decode_bfloat16
+from app.draw.gl.n_net import NNet, Layer
+from app.draw.gl.n_stats import NStatsIndex
+
+OUTLIER_CHANNELS = 4
+
+
+def create_net(blocks, outlier_scale, workers):
+    n_net = NNet(None, None, pyramid_levels=0, workers=workers)
+    generator = np.random.default_rng(0)
+    for name, shape in tinyllama_shapes(blocks):
+        data = random_bfloat16(generator, shape)
+        if len(shape) == 2 and "layers." in name:
+            values = decode_bfloat16(data)
+            channels = generator.integers(0, shape[1], OUTLIER_CHANNELS)
+            values[:, channels] *= outlier_scale
+            data = (values.view(np.uint32) >> 16).astype(np.uint16)
+        n_net.layers.append(Layer(data, name=name, dtype="bfloat16"))
+    n_net.init_grid()
+    return n_net
+
+
+def full_scan(n_net, k):
+    """
+    Reference, every value of every layer is decoded
+    """
+    scores = []
+    for grid_layer in n_net.layers:
+        values = np.abs(grid_layer.decode(grid_layer.layer_grid)).reshape(-1)
+        scores.append(values[np.argpartition(-values, min(k, values.size) - 1)[:k]])
+    scores = np.concatenate(scores)
+    return np.sort(scores)[::-1][:k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=4)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--outlier-scale", type=float, default=20.0)
+    args = parser.parse_args()
+
+    n_net = create_net(args.blocks, args.outlier_scale, args.workers)
+
+    start_time = time.perf_counter()
+    stats_index = NStatsIndex(n_net.layers)
+    stats_index.run()
+    stats_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    expected = full_scan(n_net, args.k)
+    scan_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    results = n_net.find_top_k(args.k, metric="abs")
+    search_time = time.perf_counter() - start_time
+
+    found = np.array([abs(value) for _, _, value, _, _ in results])
+    assert np.array_equal(found, expected), "top k values differ from the full scan"
+    print(f"values: {n_net.total_size}, k: {args.k}, workers: {args.workers}")
+    print(f"tile statistics (once, background): {stats_time * 1000:9.1f} ms")
+    print(f"full numpy scan:                    {scan_time * 1000:9.1f} ms")
+    print(f"pruned search:                      {search_time * 1000:9.1f} ms  {scan_time / search_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Memory of the lazily generated BSP tree (NTree(implicit=False)) over a scripted camera tour
+The tour repeats zooming into a random point of the world down to a random depth, panning there and zooming out,
+one viewport update per frame at --fps. Every --checkpoint minutes of the tour the leaves of the tree and the
+memory retained by the tree (tracemalloc) are printed. With pruning the leaves not visited for prune_age frames
+are collapsed, the memory stays flat. --compare runs the same tour without pruning.
+
+Usage: python -m app.draw.gl.benchmark.bench_tree_prune [--minutes 60] [--fps 60] [--checkpoint 5]
+       [--age 600] [--max-leaves 100000] [--compare]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from app.draw.gl.n_tree import NTree
+
+# Size of the grid of a 405B parameters model in world coordinates, 0.2 per value
+WORLD_WIDTH = 150000 * 0.2
+WORLD_HEIGHT = 180000 * 0.2
+# Aspect of the window
+VIEWPORT_ASPECT = 1080 / 1920
+
+
+def camera_tour(frames, seed=0):
+    """
+    Viewports of the tour, one per frame
+    """
+    rnd = random.Random(seed)
+    frame = 0
+    while frame < frames:
+        # Zoom in, pan, zoom out over a few seconds
+        cx = rnd.uniform(0, WORLD_WIDTH)
+        cy = rnd.uniform(0, WORLD_HEIGHT)
+        depth = rnd.uniform(4, 30)
+        zoom_frames = rnd.randint(60, 300)
+        pan_frames = rnd.randint(60, 600)
+        pan_x = rnd.uniform(-1, 1)
+        pan_y = rnd.uniform(-1, 1)
+        for step in range(zoom_frames * 2 + pan_frames):
+            if step < zoom_frames:
+                scale = 2 ** (depth * step / zoom_frames / 2)
+            elif step < zoom_frames + pan_frames:
+                scale = 2 ** (depth / 2)
+            else:
+                scale = 2 ** (depth * (zoom_frames * 2 + pan_frames - step) / zoom_frames / 2)
+            w = WORLD_WIDTH / scale
+            h = w * VIEWPORT_ASPECT
+            # A tenth of the viewport per frame while panning
+            pan = min(max(step - zoom_frames, 0), pan_frames)
+            x = cx + pan_x * pan * w / 10 - w / 2
+            y = cy + pan_y * pan * h / 10 - h / 2
+            yield x, y, w, h, 1.0
+            frame += 1
+            if frame >= frames:
+                return
+
+
+def run(frames, checkpoint_frames, fps, prune, age, max_leaves):
+    gc.collect()
+    tracemalloc.start()
+    n_tree = NTree(0, implicit=False)
+    n_tree.set_size(WORLD_WIDTH, WORLD_HEIGHT)
+    if prune:
+        n_tree.prune_age = age
+        n_tree.max_leaves = max_leaves
+    else:
+        n_tree.prune_interval = 0
+    start_time = time.perf_counter()
+    for frame, viewport in enumerate(camera_tour(frames), start=1):
+        n_tree.update_viewport(viewport)
+        if frame % checkpoint_frames == 0:
+            gc.collect()
+            retained, peak = tracemalloc.get_traced_memory()
+            print(f"{frame / fps / 60:>8.1f}min {n_tree.count():>10} {retained / 1024 / 1024:>10.2f}MB "
+                  f"{peak / 1024 / 1024:>10.2f}MB {time.perf_counter() - start_time:>8.1f}s")
+    tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--checkpoint", type=float, default=5, help="minutes between the reports")
+    parser.add_argument("--age", type=int, default=600, help="frames a leaf is kept after the last visit")
+    parser.add_argument("--max-leaves", type=int, default=100000)
+    parser.add_argument("--compare", action="store_true", help="run the tour without pruning as well")
+    args = parser.parse_args()
+
+    frames = int(args.minutes * 60 * args.fps)
+    checkpoint_frames = max(1, int(args.checkpoint * 60 * args.fps))
+    for prune in [True, False] if args.compare else [True]:
+        print(f"prune: {prune}")
+        print(f"{'tour':>11} {'leaves':>10} {'retained':>12} {'peak':>12} {'elapsed':>9}")
+        run(frames, checkpoint_frames, args.fps, prune, args.age, args.max_leaves)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Traversal of the BSPLeaf object tree (NTree(implicit=False)) against the visible tiles of the ImplicitTree computed
+per level (NTree(implicit=True)) at deep levels
+For every depth a viewport with visible nodes around the depth is panned across the world in small steps,
+both trees answer the same viewports.
+Reports the time per update_viewport, the deepest visible level, the objects kept by the BSP tree
+(lazily generated leaves are never freed) and the memory retained after the tour
+
+Usage: python -m app.draw.gl.benchmark.bench_tree_traverse [--depths 10 20 30 40] [--frames 200]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from app.draw.gl.n_tree import NTree
+
+# Size of the grid of a 405B parameters model in world coordinates, 0.2 per value
+WORLD_WIDTH = 150000 * 0.2
+WORLD_HEIGHT = 180000 * 0.2
+
+
+def tour(n_tree, depth, frames):
+    """
+    Pan of the viewport along the world diagonal, viewport is sized so the visible nodes end around the depth
+    The pan wraps around to stay inside the world, frames without visible nodes are not counted in the deepest level
+    :return: ms per update, deepest visible level
+    """
+    # Every level halves one side, a viewport 4 times larger than the nodes of the depth stops there
+    scale = 2 ** (depth / 2)
+    w = WORLD_WIDTH / scale * 4
+    h = WORLD_HEIGHT / scale * 4
+    deepest = 0
+    start_time = time.perf_counter()
+    for frame in range(frames):
+        # A tenth of the viewport per frame, starting in the middle of the world
+        x = (WORLD_WIDTH / 3 + frame * w / 10) % max(WORLD_WIDTH - w, 1)
+        y = (WORLD_HEIGHT / 3 + frame * h / 10) % max(WORLD_HEIGHT - h, 1)
+        n_tree.update_viewport((x, y, w, h, 1.0))
+        if n_tree.mega_leaf is not None:
+            deepest = max(deepest, n_tree.mega_leaf.level)
+    return (time.perf_counter() - start_time) * 1000 / frames, deepest
+
+
+def create_tree(implicit):
+    n_tree = NTree(0, implicit=implicit)
+    n_tree.set_size(WORLD_WIDTH, WORLD_HEIGHT)
+    return n_tree
+
+
+def measure(implicit, depth, frames):
+    # Timed without tracemalloc, it slows down every allocation
+    update_time, deepest = tour(create_tree(implicit), depth, frames)
+    gc.collect()
+    tracemalloc.start()
+    n_tree = create_tree(implicit)
+    tour(n_tree, depth, frames)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # BSP tree count() walks all generated leaves
+    nodes = 0 if implicit else n_tree.count()
+    return update_time, deepest, nodes, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depths", nargs="+", type=int, default=[10, 20, 30, 40])
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'depth':>6} {'tree':>9} {'update':>10} {'deepest':>8} {'bsp leaves':>11} {'retained':>10} {'peak':>10}")
+    for depth in args.depths:
+        for name, implicit in [("bsp", False), ("implicit", True)]:
+            update_time, deepest, nodes, retained, peak = measure(implicit, depth, args.frames)
+            print(f"{depth:>6} {name:>9} {update_time:>8.3f}ms {deepest:>8} {nodes:>11} "
+                  f"{retained / 1024:>8.0f}KB {peak / 1024:>8.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
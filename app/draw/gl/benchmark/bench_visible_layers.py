@@ -0,0 +1,62 @@
+"""
+Per viewport event cost of finding visible layers
+Compares the interval index used by Grid.get_visible_layers with the linear scan over all layers
+Every event pans a fixed size viewport to a random position, like a mouse drag does
+
+Usage: python -m app.draw.gl.benchmark.bench_visible_layers
+"""
+import random
+import time
+
+from app.draw.gl.n_net import NNet
+
+LAYERS_COUNTS = [200, 800, 3200, 12800]
+LAYER_SIZE = 4096
+EVENTS_COUNT = 2000
+VIEWPORT_WIDTH = 200.0  # world units, a few layers wide
+
+
+def create_net(layers_count):
+    n_net = NNet(None, None, pyramid_levels=0)
+    n_net.init_from_size([LAYER_SIZE] * layers_count)
+    return n_net
+
+
+def create_viewports(n_net):
+    random.seed(0)
+    viewports = []
+    for _ in range(EVENTS_COUNT):
+        x = random.uniform(0, n_net.total_width - VIEWPORT_WIDTH)
+        viewports.append((x, 0.0, VIEWPORT_WIDTH, n_net.total_height, 1.0))
+    return viewports
+
+
+def measure(n_net, viewports, find_func):
+    start_time = time.perf_counter()
+    visible_count = 0
+    for viewport in viewports:
+        x, y, w, h, zoom = viewport
+        col_min, row_min, col_max, row_max = n_net.world_to_grid_position(x, y, x + w, y + h)
+        visible_count += len(find_func(col_min, row_min, col_max, row_max))
+    elapsed = time.perf_counter() - start_time
+    return elapsed / len(viewports) * 1000000, visible_count / len(viewports)
+
+
+def main():
+    results = []
+    for layers_count in LAYERS_COUNTS:
+        n_net = create_net(layers_count)
+        viewports = create_viewports(n_net)
+        scan_us, scan_visible = measure(n_net, viewports, n_net.grid.scan_visible_layers)
+        index_us, index_visible = measure(n_net, viewports, n_net.grid.get_visible_layers)
+        assert scan_visible == index_visible
+        results.append((layers_count, scan_visible, scan_us, index_us))
+
+    print("")
+    print(f"{'layers':>8} {'visible':>8} {'scan us/event':>14} {'index us/event':>15} {'speedup':>8}")
+    for layers_count, visible, scan_us, index_us in results:
+        print(f"{layers_count:>8} {visible:>8.1f} {scan_us:>14.1f} {index_us:>15.1f} {scan_us / index_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
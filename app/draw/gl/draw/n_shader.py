@@ -44,12 +44,13 @@ points_from_buffer_vertex_shader_source = """
 
 layout(location = 0) in vec3 position_and_value; // x, y for position, z for color scaling
 uniform mat4 projection_matrix;
-float color_multiplier = 50;
+uniform float color_multiplier = 50;
+uniform float color_offset = 0.0;
 out float color_value;
 
 void main() {
     gl_Position = projection_matrix * vec4(position_and_value.xy, 0.0, 1.0);
-    float intensified_color_value = clamp(position_and_value.z  * color_multiplier, 0, 1);
+    float intensified_color_value = clamp(position_and_value.z * color_multiplier + color_offset, 0, 1);
     color_value = intensified_color_value; // Pass the color scaling value to the fragment shader
 
 }
@@ -80,12 +81,13 @@ layout(location = 1) in vec3 positions_and_value;
 
 out float color_value;
 uniform mat4 projection_matrix;
-float color_multiplier = 50;
+uniform float color_multiplier = 50;
+uniform float color_offset = 0.0;
 
 void main()
 {
     gl_Position = projection_matrix * vec4(position + positions_and_value.xy, 0.0, 1.0);
-    float intensified_color_value = clamp(positions_and_value.z  * color_multiplier, 0, 1);
+    float intensified_color_value = clamp(positions_and_value.z * color_multiplier + color_offset, 0, 1);
     color_value = intensified_color_value; 
 }
 """
@@ -123,7 +125,10 @@ uniform int factor =1;
 uniform vec2 position_offset = vec2(0.0, 0.0); 
 uniform mat4 projection_matrix;
 float node_gap = 0.2;
-float color_multiplier = 50;
+uniform float color_multiplier = 50;
+uniform float color_offset = 0.0;
+uniform float value_scale = 1.0;
+uniform float value_offset = 0.0;
 
 out vec4 color_value;
 
@@ -131,13 +136,13 @@ void main()
 {
     float x = gl_InstanceID % texture_width;
     float y = gl_InstanceID / texture_width;
-    float value = texelFetch(tex1, ivec2(x, y), 0).r;
+    float value = texelFetch(tex1, ivec2(x, y), 0).r * value_scale + value_offset;
     float entity_factor =  factor;
     float scaled_x = x * entity_factor;
     float scaled_y = y * entity_factor;
     
     vec2 instance_position = vec2(scaled_x * node_gap, scaled_y * node_gap);
-    float intensified_color_value = clamp(value  * color_multiplier, 0, 1);
+    float intensified_color_value = clamp(value * color_multiplier + color_offset, 0, 1);
     
     gl_Position = projection_matrix * vec4(position.xy + instance_position + position_offset, 0.0, 1.0);
     color_value = texture(color_map, intensified_color_value);
@@ -196,11 +201,14 @@ in vec2 frag_tex_coord;
 in vec2 frag_tex_coord2;
 
 out vec4 fragColor;
-float color_multiplier = 50;
+uniform float color_multiplier = 50;
+uniform float color_offset = 0.0;
+uniform float value_scale = 1.0;
+uniform float value_offset = 0.0;
 
 void main() {
-    float value = texture(tex1, frag_tex_coord).r; 
-    float intensified_color_value = clamp(value  * color_multiplier, 0, 1);
+    float value = texture(tex1, frag_tex_coord).r * value_scale + value_offset;
+    float intensified_color_value = clamp(value * color_multiplier + color_offset, 0, 1);
     vec3 color = texture(color_map, intensified_color_value).rgb;
     fragColor = vec4(color, 1.0 * fading_factor);
 }
@@ -270,6 +278,10 @@ uniform mat4 projection_matrix;
 uniform sampler1D color_map;
 uniform sampler2D tex1;
 uniform int factor =1;
+uniform int texture_width;
+uniform int texture_height;
+// Texel of the first region cell, the texture is addressed toroidally (GL_REPEAT)
+uniform vec2 texture_offset = vec2(0.0, 0.0);
 
 float node_gap = 0.2;
 out vec2 frag_tex_coord;
@@ -285,7 +297,7 @@ void main()
 
     vec2 instance_position = vec2(scaled_x, scaled_y);
     gl_Position =  projection_matrix * vec4(instance_position  + position_offset, 0.0, 1.0);
-    frag_tex_coord = tex_coord;
+    frag_tex_coord = (position + texture_offset) / vec2(texture_width, texture_height);
 
 }
 """
@@ -300,11 +312,14 @@ uniform float fading_factor = 1.0;
 in vec2 frag_tex_coord;
 
 out vec4 fragColor;
-float color_multiplier = 50;
+uniform float color_multiplier = 50;
+uniform float color_offset = 0.0;
+uniform float value_scale = 1.0;
+uniform float value_offset = 0.0;
 
 void main() {
-    float value = texture(tex1, frag_tex_coord).r; 
-    float intensified_color_value = clamp(value  * color_multiplier, 0, 1);
+    float value = texture(tex1, frag_tex_coord).r * value_scale + value_offset;
+    float intensified_color_value = clamp(value * color_multiplier + color_offset, 0, 1);
     vec3 color = texture(color_map, intensified_color_value).rgb;
     fragColor =  vec4(color, 1.0 * fading_factor);
 }
@@ -326,9 +341,14 @@ uniform int target_height;
 uniform vec2 position_offset = vec2(0.0, 0.0); 
 uniform mat4 projection_matrix;
 uniform int factor =1;
+// Texel of the first region cell, the texture is addressed toroidally
+uniform vec2 texture_offset = vec2(0.0, 0.0);
 
 float node_gap = 0.2;
-float color_multiplier = 50;
+uniform float color_multiplier = 50;
+uniform float color_offset = 0.0;
+uniform float value_scale = 1.0;
+uniform float value_offset = 0.0;
 
 out vec4 color_value;
 
@@ -340,13 +360,14 @@ void main()
 
     float x = gl_InstanceID % selected_width;
     float y = gl_InstanceID / selected_width;
-    float value = texelFetch(tex1, ivec2(x, y), 0).r;
+    ivec2 texel = ivec2(mod(vec2(x, y) + texture_offset, vec2(texture_width, texture_height)));
+    float value = texelFetch(tex1, texel, 0).r * value_scale + value_offset;
     float entity_factor =  factor;
     float scaled_x = x * entity_factor;
     float scaled_y = y * entity_factor;
 
     vec2 instance_position = vec2(scaled_x * node_gap, scaled_y * node_gap);
-    float intensified_color_value = clamp(value  * color_multiplier, 0, 1);
+    float intensified_color_value = clamp(value * color_multiplier + color_offset, 0, 1);
 
     gl_Position = projection_matrix * vec4(position.xy + instance_position + position_offset, 0.0, 1.0);
     color_value = texture(color_map, intensified_color_value);
@@ -432,6 +453,28 @@ class NShader:
         factor = gl.glGetUniformLocation(self.shader_program, "factor")
         gl.glUniform1i(factor, details_factor)
 
+    def update_value_scale(self, scale, offset):
+        """
+        Texels are float32, float16 or normalized 8 bit values, value = texel * scale + offset
+        """
+        value_scale = gl.glGetUniformLocation(self.shader_program, "value_scale")
+        gl.glUniform1f(value_scale, scale)
+        value_offset = gl.glGetUniformLocation(self.shader_program, "value_offset")
+        gl.glUniform1f(value_offset, offset)
+
+    def update_color_transfer(self, multiplier, offset):
+        """
+        Color map position of a value, clamp(value * multiplier + offset, 0, 1)
+        """
+        color_multiplier = gl.glGetUniformLocation(self.shader_program, "color_multiplier")
+        gl.glUniform1f(color_multiplier, multiplier)
+        color_offset = gl.glGetUniformLocation(self.shader_program, "color_offset")
+        gl.glUniform1f(color_offset, offset)
+
+    def update_texture_offset(self, x, y):
+        texture_offset = gl.glGetUniformLocation(self.shader_program, "texture_offset")
+        gl.glUniform2f(texture_offset, x, y)
+
     def update_position_offset(self, x1, y1):
         position_offset = gl.glGetUniformLocation(self.shader_program, "position_offset")
         gl.glUniform2f(position_offset, x1, y1)
@@ -7,6 +7,19 @@ from PIL import Image
 from app.draw.gl.n_net import unpack_shape
 
 
+def texture_formats(dtype):
+    """
+    :param dtype: type of the uploaded data
+    :return: internal format and pixel type of a single channel texture
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.float16:
+        return gl.GL_R16F, gl.GL_HALF_FLOAT
+    if dtype == np.uint8:
+        return gl.GL_R8, gl.GL_UNSIGNED_BYTE
+    return gl.GL_R32F, gl.GL_FLOAT
+
+
 class NTexture:
     def __init__(self):
         self.material = None
@@ -189,6 +202,7 @@ class Material:
 
     def from_floats_grid(self, grid):
         height, width = unpack_shape(grid)
+        internal_format, pixel_type = texture_formats(grid.dtype)
         self.texture = gl.glGenTextures(1)
         self.pbo = self.create_pbo(grid)
 
@@ -202,7 +216,8 @@ class Material:
         # Bind the PBO to load texture data
         gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, self.pbo)
         # Load texture data from PBO
-        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R32F, width, height, 0, gl.GL_RED, gl.GL_FLOAT, None)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, gl.GL_RED, pixel_type, None)
         # Unbind the PBO
         gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
 
@@ -212,17 +227,19 @@ class Material:
         return self
 
     def from_floats_grid_chunks(self, width, height, chunks, dimensions):
+        internal_format, pixel_type = texture_formats(chunks[0].dtype if len(chunks) > 0 else np.float32)
         self.texture = gl.glGenTextures(1)
         gl.glActiveTexture(gl.GL_TEXTURE1)
         gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
-        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R32F, width, height, 0, gl.GL_RED, gl.GL_FLOAT, None)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, gl.GL_RED, pixel_type, None)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
         for c, d in zip(chunks, dimensions):
             cx1, cy1, cx2, cy2 = d
-            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, cx1, cy1, cx2 - cx1, cy2 - cy1, gl.GL_RED, gl.GL_FLOAT, c)
+            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, cx1, cy1, cx2 - cx1, cy2 - cy1, gl.GL_RED, pixel_type, c)
 
         gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
 
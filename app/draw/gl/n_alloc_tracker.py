@@ -0,0 +1,186 @@
+import functools
+import threading
+import tracemalloc
+
+MB = 1024 ** 2
+# Transient bytes of a single call of any stage above which a warning is printed
+DEFAULT_BUDGET = 256 * MB
+# Frames of the allocations traceback kept by tracemalloc in the detailed mode
+DETAIL_FRAMES = 8
+
+
+class NStageAllocations:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        # Bytes still allocated when the stage returned
+        self.retained = 0
+        # Highest memory above the stage start during a single call
+        self.transient_max = 0
+        self.transient_total = 0
+        self.over_budget = 0
+
+
+class NStageFrame:
+    """
+    Stage of the stack of running stages
+    """
+
+    def __init__(self, name, start, snapshot):
+        self.name = name
+        self.start = start
+        self.peak = start
+        self.snapshot = snapshot
+
+
+class NAllocTracker:
+    """
+    Allocation tracking of the frame stages (grid slice, chunk encode, texture upload, frame) with tracemalloc
+    For every stage call the retained bytes (allocated when the stage returns) and the transient bytes
+    (peak above the memory at the stage start) are attributed to the stage, a warning is printed
+    when the transient bytes exceed the stage budget.
+    Stages may be nested, the peak of an inner stage counts to the outer stages as well.
+    Allocations of the workers threads are attributed to the running stage, stages are entered from
+    the thread which started the tracker only.
+    In the detailed mode every stage takes a tracemalloc snapshot and a stage over the budget prints
+    the lines with the largest allocations, this is slow and meant for finding the source of a spike.
+    """
+
+    def __init__(self, budgets=None, default_budget=DEFAULT_BUDGET):
+        """
+        :param budgets: dictionary of stage name to transient bytes budget
+        :param default_budget: budget of the stages not in budgets, None for no budget
+        """
+        self.budgets = budgets if budgets is not None else {}
+        self.default_budget = default_budget
+        self.enabled = False
+        self.detailed = False
+        self.thread = None
+        # tracemalloc is stopped on stop only when it was started by the tracker
+        self.started_tracing = False
+        self.stack = []
+        self.stages = {}
+
+    def start(self, detailed=False):
+        self.stages = {}
+        self.stack = []
+        self.detailed = detailed
+        self.thread = threading.get_ident()
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(DETAIL_FRAMES if detailed else 1)
+        self.enabled = True
+        print("Allocation tracking started", "detailed:", detailed)
+
+    def stop(self):
+        self.enabled = False
+        self.stack = []
+        if self.started_tracing:
+            tracemalloc.stop()
+        print("Allocation tracking stopped")
+
+    def stage(self, name):
+        """
+        Usage: with alloc_tracker.stage("texture upload"): ...
+        """
+        return NStage(self, name)
+
+    def enter(self, name):
+        if not self.enabled or threading.get_ident() != self.thread:
+            return False
+        # Taken first, the snapshot itself is then part of the memory at the stage start
+        snapshot = tracemalloc.take_snapshot() if self.detailed else None
+        current, peak = tracemalloc.get_traced_memory()
+        if len(self.stack) > 0:
+            self.stack[-1].peak = max(self.stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+        self.stack.append(NStageFrame(name, current, snapshot))
+        return True
+
+    def exit(self):
+        if len(self.stack) == 0:
+            # Stopped while the stage was running
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        frame = self.stack.pop()
+        frame.peak = max(frame.peak, peak)
+        if len(self.stack) > 0:
+            self.stack[-1].peak = max(self.stack[-1].peak, frame.peak)
+        tracemalloc.reset_peak()
+
+        stage = self.stages.get(frame.name)
+        if stage is None:
+            stage = self.stages[frame.name] = NStageAllocations(frame.name)
+        transient = frame.peak - frame.start
+        stage.calls += 1
+        stage.retained += current - frame.start
+        stage.transient_max = max(stage.transient_max, transient)
+        stage.transient_total += transient
+        budget = self.budgets.get(frame.name, self.default_budget)
+        if budget is not None and transient > budget:
+            stage.over_budget += 1
+            print(f"Allocation budget exceeded: {frame.name} transient {transient / MB:.1f} MB, "
+                  f"budget {budget / MB:.1f} MB, retained {(current - frame.start) / MB:.1f} MB")
+            if frame.snapshot is not None:
+                self.print_top_allocations(frame.snapshot)
+
+    def print_top_allocations(self, snapshot, limit=5):
+        """
+        Lines which allocated the most since the snapshot
+        """
+        for statistic in tracemalloc.take_snapshot().compare_to(snapshot, "lineno")[:limit]:
+            print("   ", statistic)
+
+    def report(self):
+        """
+        :return: list of NStageAllocations ordered by the highest transient bytes
+        """
+        return sorted(self.stages.values(), key=lambda stage: -stage.transient_max)
+
+    def print_report(self):
+        print(f"{'stage':>20} {'calls':>7} {'retained':>11} {'transient max':>14} {'transient mean':>15} "
+              f"{'over budget':>12}")
+        for stage in self.report():
+            print(f"{stage.name:>20} {stage.calls:>7} {stage.retained / MB:>8.1f} MB "
+                  f"{stage.transient_max / MB:>11.1f} MB {stage.transient_total / stage.calls / MB:>12.2f} MB "
+                  f"{stage.over_budget:>12}")
+
+
+class NStage:
+    __slots__ = ["tracker", "name", "entered"]
+
+    def __init__(self, tracker, name):
+        self.tracker = tracker
+        self.name = name
+        self.entered = False
+
+    def __enter__(self):
+        self.entered = self.tracker.enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.entered:
+            self.tracker.exit()
+        return False
+
+
+# Shared by the viewer modules, toggled with the M key in n_opengl
+alloc_tracker = NAllocTracker()
+
+
+def tracked(name):
+    """
+    Decorator attributing the allocations of every call of the function to the stage of the shared tracker
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not alloc_tracker.enabled:
+                return function(*args, **kwargs)
+            with NStage(alloc_tracker, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
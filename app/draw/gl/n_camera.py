@@ -0,0 +1,70 @@
+import json
+import time
+
+import numpy as np
+
+
+def projection_viewport(projection, zoom_factor):
+    """
+    :return: viewport (x, y, w, h, zoom) of the projection in world coordinates
+    """
+    # Window bottom left
+    x1, y1 = projection.window_to_world_point(-1, -1)
+    # Window top right
+    x2, y2 = projection.window_to_world_point(1, 1)
+    w, h = x2 - x1, y2 - y1
+    return (x1, y1, w, h, zoom_factor)
+
+
+class NCameraPath:
+    """
+    Camera frames of a viewer session, every frame is the projection matrix, the zoom factor and the window size
+    Recorded by NWindow on every viewport update and replayed by benchmark/bench_camera_replay without a window
+    The frames are only meaningful for the net they were recorded on, net is its NNet.describe()
+    """
+
+    def __init__(self, frames=None, net=None):
+        self.frames = frames if frames is not None else []
+        self.net = net
+        self.recording = False
+        self.start_time = 0
+
+    def start(self):
+        self.frames = []
+        self.recording = True
+        self.start_time = time.time()
+        print("Camera recording started")
+
+    def stop(self):
+        self.recording = False
+        print("Camera recording stopped, frames:", len(self.frames))
+
+    def record(self, projection, zoom_factor, width, height):
+        if not self.recording:
+            return
+        self.frames.append({
+            "time": time.time() - self.start_time,
+            "matrix": projection.matrix.tolist(),
+            "zoom": float(zoom_factor),
+            "width": width,
+            "height": height
+        })
+
+    def apply(self, frame, projection):
+        """
+        Set the projection to the recorded frame
+        :return: zoom factor, window width and height of the frame
+        """
+        projection.matrix = np.array(frame["matrix"])
+        return frame["zoom"], frame["width"], frame["height"]
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"net": self.net, "frames": self.frames}, file)
+        print("Camera path saved", path, "frames:", len(self.frames))
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            data = json.load(file)
+        return NCameraPath(data["frames"], data.get("net"))
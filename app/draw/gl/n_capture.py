@@ -0,0 +1,168 @@
+import re
+import time
+
+import numpy as np
+
+# Decoder blocks of transformers models, for example model.layers.0 of LLaMA
+DEFAULT_PATTERN = r"layers\.\d+$"
+
+
+def first_tensor(value):
+    """
+    Modules may return tuples (hidden states, attention weights, cache), the first tensor is captured
+    """
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            tensor = first_tensor(item)
+            if tensor is not None:
+                return tensor
+        return None
+    return value if hasattr(value, "detach") else None
+
+
+class NCaptureRing:
+    """
+    Preallocated ring of capacity buffers for the captures of one module
+    Buffers are allocated on the first capture, when the features count is known, and again when a capture
+    has more features
+    """
+
+    def __init__(self, name, capacity, max_rows, downsample):
+        self.name = name
+        self.capacity = capacity
+        self.max_rows = max_rows
+        self.downsample = downsample
+        self.buffers = []
+        # Torch tensors sharing the memory of the buffers, captures are copied into them
+        self.targets = []
+        self.shapes = [None] * capacity
+        self.count = 0
+
+    def allocate(self, columns):
+        import torch
+
+        if len(self.buffers) > 0:
+            print(f"Capture {self.name}: features changed from {self.buffers[0].shape[1]} to {columns}, "
+                  f"buffers are allocated again and previous captures dropped")
+        self.buffers = [np.zeros((self.max_rows, columns), dtype=np.float32) for _ in range(self.capacity)]
+        self.targets = [torch.from_numpy(buffer) for buffer in self.buffers]
+        self.shapes = [None] * self.capacity
+        self.count = 0
+
+    def write(self, tensor):
+        """
+        :param tensor: torch tensor (..., features), flattened to (tokens, features) and down sampled
+        by taking every downsample-th token and feature, only the last max_rows tokens are kept
+        The tensor is copied into the buffer with the type conversion and device transfer in one copy,
+        no temporary array is made
+        """
+        tensor = tensor.detach()
+        tensor = tensor.reshape(-1, tensor.shape[-1]) if tensor.dim() > 1 else tensor.reshape(1, -1)
+        if self.downsample > 1:
+            tensor = tensor[::self.downsample, ::self.downsample]
+        if tensor.shape[0] > self.max_rows:
+            tensor = tensor[-self.max_rows:]
+        rows, columns = tensor.shape
+        if len(self.buffers) == 0 or columns > self.buffers[0].shape[1]:
+            self.allocate(columns)
+        index = self.count % self.capacity
+        self.targets[index][:rows, :columns].copy_(tensor)
+        self.shapes[index] = (rows, columns)
+        self.count += 1
+
+    def latest(self):
+        """
+        :return: view of the last capture or None
+        """
+        if self.count == 0:
+            return None
+        index = (self.count - 1) % self.capacity
+        rows, columns = self.shapes[index]
+        return self.buffers[index][:rows, :columns]
+
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers)
+
+
+class NActivationCapture:
+    """
+    Captures activations (and optionally gradients) of a torch model with forward and backward hooks
+    Every hooked module writes into its own ring of preallocated numpy buffers, so memory is bounded by
+    modules * capacity * max_tokens * features no matter how many tokens are run.
+    Captures are exposed as layers with NNet.add_capture.
+    """
+
+    def __init__(self, model, pattern=DEFAULT_PATTERN, capacity=4, max_tokens=512, downsample=1, gradients=False):
+        """
+        :param pattern: regular expression matched against the modules names
+        :param capacity: captures kept per module, one capture is written every forward call (every generated token)
+        :param max_tokens: tokens kept per capture
+        :param downsample: keep every n-th token and feature at capture time
+        :param gradients: capture the gradients of the modules outputs with backward hooks as well
+        """
+        self.rings = []
+        self.handles = []
+        self.enabled = True
+        # Time spent in the hooks, used to measure the capture overhead
+        self.hooks_time = 0.0
+        self.hooks_calls = 0
+        max_rows = -(-max_tokens // downsample)
+        for name, module in model.named_modules():
+            if not re.search(pattern, name):
+                continue
+            ring = NCaptureRing(f"{name}.activation", capacity, max_rows, downsample)
+            self.rings.append(ring)
+            self.handles.append(module.register_forward_hook(self.forward_hook(ring)))
+            if gradients:
+                gradient_ring = NCaptureRing(f"{name}.gradient", capacity, max_rows, downsample)
+                self.rings.append(gradient_ring)
+                self.handles.append(module.register_full_backward_hook(self.backward_hook(gradient_ring)))
+        print("Activation capture", "modules:", len(self.handles), "pattern:", pattern)
+
+    def forward_hook(self, ring):
+        def hook(module, inputs, output):
+            self.capture(ring, output)
+
+        return hook
+
+    def backward_hook(self, ring):
+        def hook(module, grad_input, grad_output):
+            self.capture(ring, grad_output)
+
+        return hook
+
+    def capture(self, ring, value):
+        if not self.enabled:
+            return
+        start_time = time.perf_counter()
+        tensor = first_tensor(value)
+        if tensor is not None:
+            ring.write(tensor)
+        self.hooks_time += time.perf_counter() - start_time
+        self.hooks_calls += 1
+
+    def latest(self):
+        """
+        :return: list of (name, array) of the last capture of every module, arrays are views of the ring buffers
+        """
+        captures = []
+        for ring in self.rings:
+            data = ring.latest()
+            if data is not None:
+                captures.append((ring.name, data))
+        return captures
+
+    def nbytes(self):
+        return sum(ring.nbytes() for ring in self.rings)
+
+    def reset_timing(self):
+        self.hooks_time = 0.0
+        self.hooks_calls = 0
+
+    def remove(self):
+        """
+        Remove the hooks, captured buffers are kept
+        """
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
@@ -0,0 +1,81 @@
+import numpy as np
+
+from app.draw.gl.n_dtypes import decode
+from app.draw.gl.n_pyramid import NPyramid
+from app.draw.gl.n_tile_store import layer_shape
+from app.draw.gl.n_tiles import TILE_SIZE, TiledArray
+
+# delta: tuned - base, relative: (tuned - base) / |base|
+DIFF_MODES = ["delta", "relative"]
+RELATIVE_EPSILON = 1e-6
+
+
+def tile_key(ndim, tile_row, tile_column, tile_size):
+    """
+    Index of the tile in the layer data, 1D tiles hold tile_size * tile_size values like TiledArray
+    """
+    if ndim == 1:
+        length = tile_size * tile_size
+        return slice(tile_row * length, (tile_row + 1) * length)
+    return (slice(tile_row * tile_size, (tile_row + 1) * tile_size),
+            slice(tile_column * tile_size, (tile_column + 1) * tile_size))
+
+
+def diff_tile_loader(base, tuned, base_dtype, tuned_dtype, mode, tile_size):
+    """
+    Tiles of the difference, only the requested tile of both memory mapped tensors is read
+    """
+
+    def load_tile(tile_row, tile_column):
+        key = tile_key(base.ndim, tile_row, tile_column, tile_size)
+        base_values = decode(base[key], base_dtype)
+        difference = decode(tuned[key], tuned_dtype) - base_values
+        if mode == "relative":
+            difference /= np.abs(base_values) + RELATIVE_EPSILON
+        return np.ascontiguousarray(difference, dtype=np.float32)
+
+    return load_tile
+
+
+def level_tile_loader(below, pyramid, tile_size):
+    """
+    Tiles of a pyramid level reduced from the 2x2 tiles (2 tiles for 1D data) of the level below, the lower tiles
+    come from the cache or are computed on demand as well
+    """
+
+    def load_tile(tile_row, tile_column):
+        if below.ndim == 1:
+            # A 1D tile holds tile_size * tile_size values reduced from twice as many values below
+            length = tile_size * tile_size
+            return pyramid.reduce(below[2 * tile_row * length:2 * (tile_row + 1) * length])
+        return pyramid.reduce(below[tile_key(below.ndim, tile_row, tile_column, 2 * tile_size)])
+
+    return load_tile
+
+
+def diff_levels(name, base, tuned, base_dtype, tuned_dtype, cache, levels_count, aggregation, mode="delta",
+                tile_size=TILE_SIZE):
+    """
+    Lazy pyramid of the difference of two tensors, nothing is computed until a tile is sliced
+    Tiles of every level are kept in the shared cache
+    :param base: memory mapped base tensor
+    :param tuned: memory mapped fine tuned tensor of the same shape
+    :return: TiledArray for every pyramid level
+    """
+    if mode not in DIFF_MODES:
+        raise ValueError(f"Unsupported diff mode: {mode}, expected one of {DIFF_MODES}")
+    shape = layer_shape(base.shape)
+    base = base.reshape(shape)
+    tuned = tuned.reshape(shape)
+    levels = [TiledArray(shape, np.float32, diff_tile_loader(base, tuned, base_dtype, tuned_dtype, mode, tile_size),
+                         cache, (name, 0), tile_size)]
+    # Used for its reduction only, levels are TiledArrays
+    pyramid = NPyramid(levels_count, aggregation)
+    for level in range(1, levels_count + 1):
+        below = levels[-1]
+        if max(below.shape) <= 1:
+            break
+        shape = tuple(-(-dim // 2) for dim in below.shape)
+        levels.append(TiledArray(shape, np.float32, level_tile_loader(below, pyramid, tile_size), cache,
+                                 (name, level), tile_size))
+    return levels
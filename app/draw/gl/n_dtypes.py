@@ -0,0 +1,57 @@
+import numpy as np
+
+# numpy has no bfloat16, bf16 data is kept as its raw uint16 payload (upper half of the float32 bits)
+BFLOAT16 = "bfloat16"
+
+
+def decode_bfloat16(payload):
+    return (payload.astype(np.uint32) << 16).view(np.float32)
+
+
+def encode_bfloat16(values):
+    """
+    Round float32 values to the nearest bfloat16 (ties to even)
+    :return: uint16 payload
+    """
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    rounded = (bits + (0x7FFF + ((bits >> 16) & 1))) >> 16
+    payload = rounded.astype(np.uint16)
+    # Rounding must not turn NaN into infinity
+    payload[np.isnan(values)] = 0x7FC0
+    return payload
+
+
+def decode(chunk, dtype_name, dtype=np.float32):
+    """
+    Convert a chunk of the stored data to floats
+    :param dtype_name: storage type of the layer, "bfloat16" chunks are uint16 payload
+    :param dtype: type of the result
+    """
+    if dtype_name == BFLOAT16 and chunk.dtype == np.uint16:
+        chunk = decode_bfloat16(chunk)
+    return chunk.astype(dtype, copy=False)
+
+
+def encode(values, dtype_name):
+    """
+    Convert float values back to the 16 bit storage type of the layer, other types are returned unchanged
+    """
+    if dtype_name == BFLOAT16:
+        return encode_bfloat16(values)
+    if dtype_name == "float16":
+        return values.astype(np.float16)
+    return values
+
+
+def from_torch(tensor):
+    """
+    View of the tensor data as numpy array, 16 bit tensors are not upcast to float32
+    :return: array, storage type name
+    """
+    import torch
+
+    tensor = tensor.detach().cpu()
+    if tensor.dtype == torch.bfloat16:
+        return tensor.view(torch.int16).numpy().view(np.uint16), BFLOAT16
+    data = tensor.numpy()
+    return data, data.dtype.name
@@ -0,0 +1,126 @@
+import math
+from abc import abstractmethod
+
+import numpy as np
+
+
+class BaseLayout:
+    """
+    Simple interface for placing layers on the grid
+    Override this to implement a placement algorithm
+    For example:
+    RowLayout - layers side by side in a single row, vertically centered
+    ShelfLayout - layers packed on shelves into a near square world
+    """
+
+    @abstractmethod
+    def fold_shape(self, shape):
+        """
+        Shape used to display 1D data as a 2D block
+        :param shape: layer data shape
+        :return: (rows, columns) or None to keep the layer as it is
+        """
+        pass
+
+    @abstractmethod
+    def place(self, shapes):
+        """
+        :param shapes: (n, 2) array of layers rows and columns counts
+        :return: (n, 2) int64 array of layers column and row offsets, grid columns count, grid rows count
+        """
+        pass
+
+
+def fold_columns(size, max_aspect=4):
+    """
+    Columns count of a near square block holding size values
+    A divisor of the size is preferred, the data is then folded by a reshape without padding
+    """
+    columns = math.isqrt(size)
+    for candidate in range(columns, max(1, math.ceil(columns / math.sqrt(max_aspect))) - 1, -1):
+        if size % candidate == 0:
+            return candidate
+    return math.ceil(math.sqrt(size))
+
+
+class RowLayout(BaseLayout):
+    """
+    Layers side by side with a fixed gap, vertically centered against the tallest layer
+    """
+
+    def __init__(self, gap=200):
+        self.gap = gap
+
+    def fold_shape(self, shape):
+        return None
+
+    def place(self, shapes):
+        rows = shapes[:, 0]
+        columns = shapes[:, 1]
+        offsets = np.zeros((len(shapes), 2), dtype=np.int64)
+        offsets[1:, 0] = np.cumsum(columns)[:-1]
+        offsets[:, 0] += np.arange(len(shapes)) * self.gap
+        max_rows = int(rows.max())
+        offsets[:, 1] = (max_rows - rows) // 2
+        return offsets, int(columns.sum()) + self.gap * len(shapes), max_rows
+
+
+class ShelfLayout(BaseLayout):
+    """
+    Shelf packing into a near square world
+    Layers are sorted by height and placed left to right, a new shelf starts when the shelf is full.
+    Layers shorter than the shelf are stacked in columns, so the space under them is used as well.
+    1D tensors longer than fold_min_size are folded into near square blocks
+    For TinyLlama 1.1B (benchmark/bench_layout) the world is near square instead of 438581x32000 and 7.8% filled,
+    at the same factor it uploads 22400 values against 214250. The smaller world fits the window at a lower
+    factor, so the min zoom screen shows more detail and uploads 357376 values, fewer of them empty.
+    Layout of the viewer (n_opengl)
+    """
+
+    def __init__(self, gap=64, fold_min_size=64):
+        self.gap = gap
+        self.fold_min_size = fold_min_size
+
+    def fold_shape(self, shape):
+        if len(shape) != 1 or shape[0] < self.fold_min_size:
+            return None
+        columns = fold_columns(shape[0])
+        return -(-shape[0] // columns), columns
+
+    def place(self, shapes):
+        rows = shapes[:, 0]
+        columns = shapes[:, 1]
+        area = int(((rows + self.gap) * (columns + self.gap)).sum())
+        shelf_width = max(int(columns.max()), math.isqrt(area))
+        offsets = np.zeros((len(shapes), 2), dtype=np.int64)
+        shelf_y = 0
+        shelf_height = 0
+        # Column of stacked layers: left edge, width and bottom of the last layer
+        stack_x = 0
+        stack_width = 0
+        stack_bottom = 0
+        width = 0
+        # Stable sort keeps the model order among layers of the same height
+        for index in np.argsort(-rows, kind="stable"):
+            layer_rows = int(rows[index])
+            layer_columns = int(columns[index])
+            if shelf_height > 0 and layer_columns <= stack_width and \
+                    stack_bottom + self.gap + layer_rows <= shelf_y + shelf_height:
+                # Under the previous layer of the stack
+                offsets[index] = (stack_x, stack_bottom + self.gap)
+                stack_bottom += self.gap + layer_rows
+                continue
+            x = stack_x + stack_width + self.gap if shelf_height > 0 else 0
+            if shelf_height > 0 and x + layer_columns > shelf_width:
+                shelf_y += shelf_height + self.gap
+                shelf_height = 0
+                x = 0
+            if shelf_height == 0:
+                # Layers are sorted, the first layer of the shelf is the tallest one
+                shelf_height = layer_rows
+            offsets[index] = (x, shelf_y)
+            stack_x = x
+            stack_width = layer_columns
+            stack_bottom = shelf_y + layer_rows
+            width = max(width, x + layer_columns)
+        return offsets, width, shelf_y + shelf_height
@@ -0,0 +1,207 @@
+import json
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from app.draw.gl.n_dtypes import decode, from_torch
+from app.draw.gl.n_tile_store import layer_shape
+from app.draw.gl.n_tiles import TILE_SIZE
+
+DEFAULT_NAME = "tensorgrid_live"
+MAGIC = 0x5447_4C49_5645  # "TGLIVE"
+# Shared memory layout: header, json manifest, ring of dirty regions, float32 data of every tensor
+HEADER_FIELDS = 8
+MAGIC_FIELD, MANIFEST_FIELD, CAPACITY_FIELD, HEAD_FIELD, STEP_FIELD, RING_FIELD = range(6)
+# Ring entry: layer index, row start, row end, column start, column end, training step
+ENTRY_FIELDS = 6
+
+
+def to_values(tensor):
+    """
+    float32 numpy copy of a torch tensor or numpy array
+    """
+    if isinstance(tensor, np.ndarray):
+        return tensor.astype(np.float32, copy=False)
+    data, dtype_name = from_torch(tensor)
+    return decode(data, dtype_name)
+
+
+def changed_regions(values, published, tile_size):
+    """
+    Regions of the tensor which differ from the published copy, one region per band of tile rows
+    :return: list of (row start, row end, column start, column end)
+    """
+    regions = []
+    if values.ndim == 1:
+        length = tile_size * tile_size
+        for start in range(0, values.shape[0], length):
+            if not np.array_equal(values[start:start + length], published[start:start + length]):
+                regions.append((start, min(start + length, values.shape[0]), 0, 1))
+        return regions
+    for start in range(0, values.shape[0], tile_size):
+        changed = values[start:start + tile_size] != published[start:start + tile_size]
+        columns = np.flatnonzero(changed.any(axis=0))
+        if len(columns) == 0:
+            continue
+        column_start = columns[0] // tile_size * tile_size
+        column_end = min(-(-(columns[-1] + 1) // tile_size) * tile_size, values.shape[1])
+        regions.append((start, min(start + tile_size, values.shape[0]), int(column_start), int(column_end)))
+    return regions
+
+
+def layout_memory(manifest_bytes, capacity, shapes):
+    """
+    :return: ring offset, data offsets of the tensors, total size in bytes
+    """
+    ring_offset = HEADER_FIELDS * 8 + -(-manifest_bytes // 8) * 8
+    offset = ring_offset + capacity * ENTRY_FIELDS * 8
+    offsets = []
+    for shape in shapes:
+        offsets.append(offset)
+        offset += int(np.prod(shape)) * 4
+    return ring_offset, offsets, offset
+
+
+def unlink_stale(name):
+    """
+    Remove the block left by a publisher which crashed or was interrupted before close
+    """
+    try:
+        stale = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    stale.close()
+    stale.unlink()
+    print("Removed stale live block", name)
+
+
+class NLivePublisher:
+    """
+    Publishes the parameters of a training model into shared memory
+    Every publish copies only the changed tiles and appends their regions to a ring of dirty regions,
+    the viewer (NNet.init_from_live) reads the ring and reloads only those regions.
+    Publishing is rate limited, so a training loop can call it on every step.
+    """
+
+    def __init__(self, named_parameters, name=DEFAULT_NAME, min_interval=0.2, capacity=4096, tile_size=TILE_SIZE):
+        """
+        :param named_parameters: (name, tensor) pairs, for example model.named_parameters()
+        :param min_interval: minimum seconds between two publishes
+        :param capacity: ring entries, a viewer falling behind by more entries reloads everything
+        """
+        self.names = []
+        self.tensors = []
+        for tensor_name, tensor in named_parameters:
+            self.names.append(tensor_name)
+            self.tensors.append(tensor)
+        self.shapes = [layer_shape(tuple(tensor.shape)) for tensor in self.tensors]
+        self.min_interval = min_interval
+        self.capacity = capacity
+        self.tile_size = tile_size
+        self.last_publish_time = 0
+
+        manifest = json.dumps({"names": self.names, "shapes": self.shapes, "tile_size": tile_size}).encode()
+        ring_offset, offsets, size = layout_memory(len(manifest), capacity, self.shapes)
+        unlink_stale(name)
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self.memory.buf)
+        self.memory.buf[HEADER_FIELDS * 8:HEADER_FIELDS * 8 + len(manifest)] = manifest
+        self.ring = np.ndarray((capacity, ENTRY_FIELDS), dtype=np.int64, buffer=self.memory.buf, offset=ring_offset)
+        self.views = [np.ndarray(shape, dtype=np.float32, buffer=self.memory.buf, offset=offset)
+                      for shape, offset in zip(self.shapes, offsets)]
+        for view, tensor, shape in zip(self.views, self.tensors, self.shapes):
+            view[...] = to_values(tensor).reshape(shape)
+        self.header[MANIFEST_FIELD] = len(manifest)
+        self.header[CAPACITY_FIELD] = capacity
+        self.header[RING_FIELD] = ring_offset
+        self.header[HEAD_FIELD] = 0
+        self.header[STEP_FIELD] = 0
+        # Written last, the viewer attaches only to a complete block
+        self.header[MAGIC_FIELD] = MAGIC
+        print("Live publisher started", name, "tensors:", len(self.tensors), f"size: {size / (1024 * 1024):.2f} MB")
+
+    def publish(self, step, force=False):
+        """
+        Copy the changed regions of the parameters and append them to the ring
+        :return: count of published regions, 0 when skipped by the rate limit
+        """
+        now = time.time()
+        if not force and now - self.last_publish_time < self.min_interval:
+            return 0
+        self.last_publish_time = now
+        head = int(self.header[HEAD_FIELD])
+        for index, (tensor, view, shape) in enumerate(zip(self.tensors, self.views, self.shapes)):
+            values = to_values(tensor).reshape(shape)
+            for row_start, row_end, column_start, column_end in changed_regions(values, view, self.tile_size):
+                if view.ndim == 1:
+                    view[row_start:row_end] = values[row_start:row_end]
+                else:
+                    view[row_start:row_end, column_start:column_end] = values[row_start:row_end, column_start:column_end]
+                self.ring[head % self.capacity] = (index, row_start, row_end, column_start, column_end, step)
+                head += 1
+        self.header[STEP_FIELD] = step
+        published = head - int(self.header[HEAD_FIELD])
+        # Entries are complete before the head moves
+        self.header[HEAD_FIELD] = head
+        return published
+
+    def close(self):
+        self.header = None
+        self.ring = None
+        self.views = []
+        self.memory.close()
+        self.memory.unlink()
+
+
+class NLiveSubscriber:
+    """
+    Viewer side of NLivePublisher, tensors are views of the shared memory
+    """
+
+    def __init__(self, name=DEFAULT_NAME):
+        self.memory = shared_memory.SharedMemory(name=name)
+        # The block belongs to the publisher, it must not be unlinked when the viewer exits
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self.header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self.memory.buf)
+        if self.header[MAGIC_FIELD] != MAGIC:
+            raise ValueError(f"Shared memory {name} is not a TensorGrid live block")
+        manifest_bytes = int(self.header[MANIFEST_FIELD])
+        manifest = json.loads(bytes(self.memory.buf[HEADER_FIELDS * 8:HEADER_FIELDS * 8 + manifest_bytes]))
+        self.names = manifest["names"]
+        self.shapes = [tuple(shape) for shape in manifest["shapes"]]
+        self.capacity = int(self.header[CAPACITY_FIELD])
+        ring_offset, offsets, size = layout_memory(manifest_bytes, self.capacity, self.shapes)
+        self.ring = np.ndarray((self.capacity, ENTRY_FIELDS), dtype=np.int64, buffer=self.memory.buf,
+                               offset=ring_offset)
+        self.views = [np.ndarray(shape, dtype=np.float32, buffer=self.memory.buf, offset=offset)
+                      for shape, offset in zip(self.shapes, offsets)]
+        self.last_head = int(self.header[HEAD_FIELD])
+
+    def step(self):
+        return int(self.header[STEP_FIELD])
+
+    def read_updates(self):
+        """
+        :return: list of (layer index, row start, row end, column start, column end) changed since the last read,
+        every tensor as a whole when the ring was overwritten before it was read
+        """
+        head = int(self.header[HEAD_FIELD])
+        if head == self.last_head:
+            return []
+        entries = []
+        if head - self.last_head <= self.capacity:
+            entries = [tuple(self.ring[index % self.capacity, :5].tolist()) for index in range(self.last_head, head)]
+        # The publisher may have overwritten the entries while they were read
+        overflow = int(self.header[HEAD_FIELD]) - self.last_head > self.capacity
+        if head - self.last_head > self.capacity or overflow:
+            entries = [(index, 0, shape[0], 0, shape[1] if len(shape) > 1 else 1)
+                       for index, shape in enumerate(self.shapes)]
+        self.last_head = head
+        return entries
+
+    def close(self):
+        self.header = None
+        self.ring = None
+        self.views = []
+        self.memory.close()
@@ -1,9 +1,29 @@
 import math
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from memory_profiler import profile
 
+from app.draw.gl.n_alloc_tracker import tracked
+from app.draw.gl.n_diff import diff_levels
+from app.draw.gl.n_dtypes import decode, encode, from_torch
+from app.draw.gl.n_layout import RowLayout
+from app.draw.gl.n_live import DEFAULT_NAME, NLiveSubscriber
+from app.draw.gl.n_profiler import profiled
+from app.draw.gl.n_pyramid import NPyramid
+from app.draw.gl.n_quantize import STORAGES, is_quantizable, quantize
+from app.draw.gl.n_safetensors import checkpoint_fingerprint, index_safetensors
+from app.draw.gl.n_search import NTopKSearch
+from app.draw.gl.n_stats import STATS_FILE, NStatsIndex
+from app.draw.gl.n_synthetic import model_shapes, synthetic_levels
+from app.draw.gl.n_tile_store import DEFAULT_CACHE_DIR, layer_shape, open_store
+from app.draw.gl.n_tiles import TILE_SIZE, NLruCache, TiledArray
+
+NORMALIZATIONS = [None, "layer"]
+
 
 def unpack_shape(array):
     shape = array.shape
@@ -12,14 +32,78 @@ def unpack_shape(array):
     return shape
 
 
+class IntervalIndex:
+    """
+    Sorted index over [start, end] intervals
+    Intervals are sorted by start, the running maximum of ends is monotonic as well,
+    so the candidates overlapping a query range form one continuous run found by two bisections
+    """
+
+    def __init__(self, starts, ends):
+        self.order = np.argsort(starts, kind="stable")
+        self.sorted_starts = starts[self.order]
+        self.max_ends = np.maximum.accumulate(ends[self.order]) if len(ends) > 0 else ends
+
+    def query(self, low, high):
+        """
+        :return: range [first, last) of self.order with intervals possibly overlapping [low, high]
+        """
+        last = np.searchsorted(self.sorted_starts, high, side="right")
+        first = np.searchsorted(self.max_ends, low, side="left")
+        return first, max(first, last)
+
+
 class Grid:
-    def __init__(self):
+    def __init__(self, workers=None):
+        """
+        :param workers: threads extracting the chunks of visible layers in parallel,
+        numpy slicing and conversions release the GIL. None or 1 extracts sequentially.
+        Off by default: the speedup is not measured on 8-16 cores yet, on a single core 2 workers run at 0.5x.
+        Enable it only where benchmark/bench_chunks_workers shows a speedup
+        """
         self.layers = []
         self.default_value = -2
         self.visible_layers = []
+        # Type of the data chunks, float16 when layers are stored as fp16
+        self.chunks_dtype = np.float32
+
+        self.columns_start = None
+        self.columns_end = None
+        self.rows_start = None
+        self.rows_end = None
+        self.columns_index = None
+        self.rows_index = None
+        self.workers = None
+        self.executor = None
+        self.positions_buffer = None
+        self.set_workers(workers)
+
+    def set_workers(self, workers):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+
+    def map_layers(self, func, layers):
+        """
+        Apply the function to every layer, in the worker threads if the grid has them
+        :return: results in the layers order
+        """
+        if self.executor is None or len(layers) < 2:
+            return [func(sublayer) for sublayer in layers]
+        return list(self.executor.map(func, layers))
 
     def add_layers(self, layers):
         self.layers = layers
+        self.build_index()
+
+    def build_index(self):
+        self.columns_start = np.array([l.column_offset for l in self.layers], dtype=np.int64)
+        self.columns_end = self.columns_start + np.array([l.columns_count for l in self.layers], dtype=np.int64)
+        self.rows_start = np.array([l.row_offset for l in self.layers], dtype=np.int64)
+        self.rows_end = self.rows_start + np.array([l.rows_count for l in self.layers], dtype=np.int64)
+        self.columns_index = IntervalIndex(self.columns_start, self.columns_end)
+        self.rows_index = IntervalIndex(self.rows_start, self.rows_end)
 
     def rectangles_intersect(self, x1, y1, x2, y2, grid_x1, grid_y1, grid_x2, grid_y2):
         # Check if one rectangle is on left side of other
@@ -31,6 +115,79 @@ class Grid:
         return True
 
     def get_visible_layers(self, x1, y1, x2, y2):
+        """
+        Find layers intersecting the region and store them as the visible layers
+        """
+        if self.columns_index is None:
+            return self.scan_visible_layers(x1, y1, x2, y2)
+        visible_layers = self.find_layers(x1, y1, x2, y2)
+        self.visible_layers = visible_layers
+        return visible_layers
+
+    def find_layers(self, x1, y1, x2, y2):
+        """
+        Find layers intersecting the region using the columns and rows interval index
+        """
+        return [self.layers[i] for i in self.find_layer_indices(x1, y1, x2, y2)]
+
+    def find_layer_indices(self, x1, y1, x2, y2):
+        """
+        Indices of the layers intersecting the region, sorted
+        The axis giving the shorter run of candidates is used, the other axis is checked on the candidates only
+        """
+        column_first, column_last = self.columns_index.query(x1, x2)
+        row_first, row_last = self.rows_index.query(y1, y2)
+        if column_last - column_first <= row_last - row_first:
+            candidates = self.columns_index.order[column_first:column_last]
+        else:
+            candidates = self.rows_index.order[row_first:row_last]
+        mask = ((self.columns_start[candidates] <= x2) & (self.columns_end[candidates] >= x1) &
+                (self.rows_start[candidates] <= y2) & (self.rows_end[candidates] >= y1))
+        return np.sort(candidates[mask])
+
+    def find_layer_at(self, column, row):
+        """
+        Point lookup in the interval index, layers never overlap so at most one layer holds the cell
+        :return: index of the layer holding the grid cell or -1
+        """
+        column_first, column_last = self.columns_index.query(column, column)
+        row_first, row_last = self.rows_index.query(row, row)
+        if column_last - column_first <= row_last - row_first:
+            candidates = self.columns_index.order[column_first:column_last]
+        else:
+            candidates = self.rows_index.order[row_first:row_last]
+        mask = ((self.columns_start[candidates] <= column) & (self.columns_end[candidates] > column) &
+                (self.rows_start[candidates] <= row) & (self.rows_end[candidates] > row))
+        found = candidates[mask]
+        return int(found[0]) if len(found) > 0 else -1
+
+    def find_layers_at(self, columns, rows):
+        """
+        Point lookup of many cells at once: the layers overlapping the cells bounding box are found in the
+        interval index, the cells of every candidate layer are found with searchsorted on the sorted columns
+        :param columns: int64 array of grid columns, rows of the same length
+        :return: int64 array of the layer index holding every cell or -1
+        """
+        found = np.full(len(columns), -1, dtype=np.int64)
+        if len(columns) == 0:
+            return found
+        order = np.argsort(columns, kind="stable")
+        sorted_columns = columns[order]
+        candidates = self.find_layer_indices(sorted_columns[0], rows.min(), sorted_columns[-1], rows.max())
+        firsts = np.searchsorted(sorted_columns, self.columns_start[candidates], side="left")
+        lasts = np.searchsorted(sorted_columns, self.columns_end[candidates], side="left")
+        for layer_index, first, last in zip(candidates.tolist(), firsts.tolist(), lasts.tolist()):
+            if first == last:
+                continue
+            points = order[first:last]
+            inside = (rows[points] >= self.rows_start[layer_index]) & (rows[points] < self.rows_end[layer_index])
+            found[points[inside]] = layer_index
+        return found
+
+    def scan_visible_layers(self, x1, y1, x2, y2):
+        """
+        Reference linear scan over all layers
+        """
         visible_layers = []
         for sublayer in self.layers:
             grid_x1 = sublayer.column_offset
@@ -42,109 +199,448 @@ class Grid:
         self.visible_layers = visible_layers
         return visible_layers
 
-    def get_visible_data_chunks(self, x1, y1, x2, y2, width_factor, height_factor, grid_space=False):
+    @profiled("layer slice")
+    def slice_layer(self, sublayer, x1, y1, x2, y2, width_factor, height_factor, dtype=np.float32, cleared=None):
+        """
+        Slice the part of the layer overlapping x1,y1,x2,y2 down sampled by width and height factors
+        Samples are aligned to multiples of the factor relative to the layer origin,
+        so the same grid cell always maps to the same value and a pyramid level can be sliced directly
+        :param dtype: type of the returned chunk
+        :param cleared: function (value) returning True when a chunk of the constant value needs no upload,
+        checked for the regions the layer statistics report as constant
+        :return: chunk, grid column and grid row of the first sample or None if no sample falls into the region
+        """
+        grid_x1 = sublayer.column_offset
+        grid_y1 = sublayer.row_offset
+        grid_x2 = grid_x1 + sublayer.columns_count
+        grid_y2 = grid_y1 + sublayer.rows_count
+
+        if not self.rectangles_intersect(x1, y1, x2, y2, grid_x1, grid_y1, grid_x2, grid_y2):
+            return None
+        # Overlap area in the layer local coordinates
+        local_x1 = max(x1, grid_x1) - grid_x1
+        local_y1 = max(y1, grid_y1) - grid_y1
+        local_x2 = min(x2, grid_x2) - grid_x1
+        local_y2 = min(y2, grid_y2) - grid_y1
+        # First sample aligned to the factor
+        start_x = -(-local_x1 // width_factor) * width_factor
+        start_y = -(-local_y1 // height_factor) * height_factor
+        if start_y >= local_y2 or (sublayer.ndim > 1 and start_x >= local_x2):
+            return None
+
+        level_data, level_factor = sublayer.get_level_data(math.gcd(width_factor, height_factor))
+        row_slice = slice(start_y // level_factor,
+                          -(-local_y2 // level_factor),
+                          height_factor // level_factor)
+        column_slice = slice(start_x // level_factor,
+                             -(-local_x2 // level_factor),
+                             width_factor // level_factor)
+        if level_data.ndim == 1:
+            start_x = 0
+            column_slice = slice(0, 1, 1)
+        # Level 0 area aggregated by the samples, constant tiles are not sliced
+        constant = None
+        if sublayer.stats is not None:
+            constant = sublayer.stats.constant_value(start_y, min(row_slice.stop * level_factor, sublayer.rows_count),
+                                                     start_x,
+                                                     min(column_slice.stop * level_factor, sublayer.columns_count))
+        if constant is not None:
+            if cleared is not None:
+                value = constant
+                if sublayer.normalization is not None:
+                    scale, offset = sublayer.normalization
+                    value = constant * scale + offset
+                if cleared(value):
+                    return None
+            shape = (len(range(row_slice.start, row_slice.stop, row_slice.step)),)
+            if level_data.ndim > 1:
+                shape += (len(range(column_slice.start, column_slice.stop, column_slice.step)),)
+            chunk = np.full(shape, constant, dtype=np.float32)
+        elif level_data.ndim == 1:
+            chunk = level_data[row_slice]
+        else:
+            chunk = level_data[row_slice, column_slice]
+        if sublayer.normalization is not None:
+            scale, offset = sublayer.normalization
+            values = sublayer.decode(chunk)
+            chunk = values * scale + offset
+            if sublayer.fill_value is not None:
+                # Padding of folded layers stays recognizable
+                chunk[values == sublayer.fill_value] = sublayer.fill_value
+        return sublayer.decode(chunk, dtype), grid_x1 + start_x, grid_y1 + start_y
+
+    @tracked("grid slice")
+    def get_visible_data_chunks(self, x1, y1, x2, y2, width_factor, height_factor, grid_space=False, layers=None,
+                                cleared=None):
+        """
+        :param layers: layers to slice, visible layers by default
+        :param cleared: constant chunks skipped, see slice_layer
+        """
+        layers = self.visible_layers if layers is None else layers
+        results = self.map_layers(
+            lambda sublayer: self.slice_layer(sublayer, x1, y1, x2, y2, width_factor, height_factor,
+                                              self.chunks_dtype, cleared),
+            layers)
         result_chunks = []
         result_dimensions = []
-        # Iterate over each subgrid to check for intersections
-        for sublayer in self.visible_layers:
-            grid_x1 = sublayer.column_offset
-            grid_y1 = sublayer.row_offset
-            grid_x2 = grid_x1 + sublayer.columns_count
-            grid_y2 = grid_y1 + sublayer.rows_count
-
-            if self.rectangles_intersect(x1, y1, x2, y2, grid_x1, grid_y1, grid_x2, grid_y2):
-                # Calculate the overlap area
-                overlap_x1 = max(x1, grid_x1)
-                overlap_y1 = max(y1, grid_y1)
-                overlap_x2 = min(x2, grid_x2)
-                overlap_y2 = min(y2, grid_y2)
-                if sublayer.layer_grid.ndim == 1:
-                    # Direct slicing and subsampling in one step
-                    subgrid_slice = sublayer.layer_grid[overlap_y1 - grid_y1:overlap_y2 - grid_y1:height_factor]
-                else:
-                    # For 2D arrays, perform slicing and subsampling for both dimensions in one step
-                    subgrid_slice = sublayer.layer_grid[
-                                    overlap_y1 - grid_y1:overlap_y2 - grid_y1:height_factor,
-                                    overlap_x1 - grid_x1:overlap_x2 - grid_x1:width_factor]
-                result_chunks.append(subgrid_slice)
-                if grid_space:
-                    h, w = unpack_shape(subgrid_slice)
-                    dx1 = int((overlap_x1 - x1) / width_factor)
-                    dy1 = int((overlap_y1 - y1) / height_factor)
-                    result_dimensions.append(
-                        (
-                            dx1,
-                            dy1,
-                            dx1 + w,
-                            dy1 + h
-                        )
+        for sublayer, result in zip(layers, results):
+            if result is None:
+                continue
+            subgrid_slice, column, row = result
+            result_chunks.append(subgrid_slice)
+            if grid_space:
+                h, w = unpack_shape(subgrid_slice)
+                dx1 = (column - x1) // width_factor
+                dy1 = (row - y1) // height_factor
+                result_dimensions.append(
+                    (
+                        dx1,
+                        dy1,
+                        dx1 + w,
+                        dy1 + h
                     )
-                else:
-                    result_dimensions.append(
-                        (overlap_x1,
-                         overlap_y1,
-                         overlap_x2,
-                         overlap_y2))
+                )
+            else:
+                grid_x1 = sublayer.column_offset
+                grid_y1 = sublayer.row_offset
+                result_dimensions.append(
+                    (max(x1, grid_x1),
+                     max(y1, grid_y1),
+                     min(x2, grid_x1 + sublayer.columns_count),
+                     min(y2, grid_y1 + sublayer.rows_count)))
         return result_chunks, result_dimensions
 
     def get_visible_data_positions_and_values(self, x1, y1, x2, y2, width_factor, height_factor):
+        """
+        Compatibility wrapper of fill_positions_and_values, the hot path uses the buffer directly
+        :return: rows, columns and values of the samples, copies owned by the caller
+        """
+        positions = self.fill_positions_and_values(x1, y1, x2, y2, width_factor, height_factor)
+        return positions[:, 1].copy(), positions[:, 0].copy(), positions[:, 2].copy()
 
-        rows_list = []
-        columns_list = []
-        values_list = []
+    @tracked("positions fill")
+    def fill_positions_and_values(self, x1, y1, x2, y2, width_factor, height_factor, column_scale=1.0,
+                                  row_scale=1.0):
+        """
+        Samples of the visible layers as (N, 3) float32 rows of column * column_scale, row * row_scale and value
+        Output size is counted first and the samples are written straight into one reusable buffer,
+        no index arrays or per layer copies are made unless a chunk contains the default value.
+        Both passes run in the worker threads if the grid has them.
+        :return: view of the buffer, valid until the next call
+        """
 
-        # Iterate over each subgrid to check for intersections
-        for sublayer in self.visible_layers:
-            grid_x1 = sublayer.column_offset
-            grid_y1 = sublayer.row_offset
-            grid_x2 = grid_x1 + sublayer.columns_count
-            grid_y2 = grid_y1 + sublayer.rows_count
+        def count_samples(sublayer):
+            result = self.slice_layer(sublayer, x1, y1, x2, y2, width_factor, height_factor)
+            if result is None:
+                return None
+            chunk, chunk_col_min, chunk_row_min = result
+            if chunk.size == 0 or chunk.min() > self.default_value or chunk.max() < self.default_value:
+                return chunk, chunk_col_min, chunk_row_min, chunk.size
+            return chunk, chunk_col_min, chunk_row_min, chunk.size - np.count_nonzero(chunk == self.default_value)
 
-            if self.rectangles_intersect(x1, y1, x2, y2, grid_x1, grid_y1, grid_x2, grid_y2):
-                # Calculate the overlap area
-                overlap_x1 = max(x1, grid_x1)
-                overlap_y1 = max(y1, grid_y1)
-                overlap_x2 = min(x2, grid_x2)
-                overlap_y2 = min(y2, grid_y2)
-
-                if sublayer.layer_grid.ndim == 1:
-                    chunk = sublayer.layer_grid[overlap_y1 - grid_y1:overlap_y2 - grid_y1:height_factor]
-                    chunk_indices = np.where(chunk != self.default_value)
-                    chunk_rows = chunk_indices[0]
-                    chunk_columns = np.full(chunk_rows.size, 1)
-                else:
-                    chunk = sublayer.layer_grid[
-                            overlap_y1 - grid_y1:overlap_y2 - grid_y1:height_factor,
-                            overlap_x1 - grid_x1:overlap_x2 - grid_x1:width_factor]
-                    chunk_indices = np.where(chunk != self.default_value)
-                    chunk_rows, chunk_columns = chunk_indices
-
-                chunk_col_min, chunk_row_min = (overlap_x1, overlap_y1)
-                chunk_values = chunk[chunk_indices]
-                chunk_columns = (chunk_columns * width_factor) + chunk_col_min
-                chunk_rows = (chunk_rows * height_factor) + chunk_row_min
-                rows_list.append(chunk_rows.astype(np.float32, copy=False))
-                columns_list.append(chunk_columns.astype(np.float32, copy=False))
-                values_list.append(chunk_values.astype(np.float32, copy=False))
-
-        if len(values_list) == 0:
-            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
-
-        rows = np.concatenate(rows_list)
-        columns = np.concatenate(columns_list)
-        values = np.concatenate(values_list)
-
-        return rows, columns, values
+        samples = [s for s in self.map_layers(count_samples, self.visible_layers) if s is not None]
+        counts = [count for _, _, _, count in samples]
+        offsets = np.cumsum([0] + counts)
+        positions = self.get_positions_buffer(int(offsets[-1]))
+
+        def write_samples(index):
+            chunk, chunk_col_min, chunk_row_min, count = samples[index]
+            output = positions[offsets[index]:offsets[index + 1]]
+            rows_count, columns_count = unpack_shape(chunk)
+            columns = (np.arange(columns_count, dtype=np.float32) * width_factor + chunk_col_min) * column_scale
+            rows = (np.arange(rows_count, dtype=np.float32) * height_factor + chunk_row_min) * row_scale
+            if count == chunk.size:
+                # Every sample is drawn, positions are broadcast from the chunk axes
+                cells = output.reshape(rows_count, columns_count, 3)
+                cells[:, :, 0] = columns
+                cells[:, :, 1] = rows[:, None]
+                cells[:, :, 2] = chunk.reshape(rows_count, columns_count)
+            else:
+                chunk = chunk.reshape(rows_count, columns_count)
+                chunk_rows, chunk_columns = np.nonzero(chunk != self.default_value)
+                output[:, 0] = columns[chunk_columns]
+                output[:, 1] = rows[chunk_rows]
+                output[:, 2] = chunk[chunk_rows, chunk_columns]
+
+        self.map_layers(write_samples, range(len(samples)))
+        return positions
+
+    def get_positions_buffer(self, count):
+        """
+        Reusable (N, 3) float32 output of fill_positions_and_values, it grows and is never shrunk
+        """
+        if self.positions_buffer is None or len(self.positions_buffer) < count:
+            self.positions_buffer = np.empty((count + count // 4, 3), dtype=np.float32)
+        return self.positions_buffer[:count]
 
 
 class Layer:
-    def __init__(self, layer_grid):
+    def __init__(self, layer_grid=None, name=None, dtype=None, loader=None, shape=None, source=None):
+        """
+        :param layer_grid: layer data array
+        :param loader: function returning the layer data, used instead of layer_grid to load data lazily
+        :param shape: shape of the data returned by the loader
+        :param source: memory mapped view of the loader data, single pass readers slice it tile by tile
+        instead of loading the layer, see tiles_reader
+        """
         self.column_offset = 0
         self.row_offset = 0
-        self.layer_grid = layer_grid
-        self.rows_count, self.columns_count = unpack_shape(self.layer_grid)
-        self.size = self.layer_grid.size
+        self.loader = loader
+        self.source = source
+        self.cache = None  # NLruCache of materialized layers, set by NNet
+        self.lock = threading.Lock()
+        self.data = None
+        if layer_grid is not None:
+            shape = layer_shape(layer_grid.shape)
+            self.data = layer_grid if tuple(layer_grid.shape) == shape else layer_grid.reshape(shape)
+            dtype = dtype if dtype is not None else layer_grid.dtype.name
+        self.shape = layer_shape(shape)
+        self.ndim = len(self.shape)
+        self.rows_count, self.columns_count = unpack_shape(self)
+        self.size = int(np.prod(self.shape))
         self.id = None
+        self.name = name
+        # Storage type of the data, "bfloat16" data is kept as raw uint16 payload
+        # Pyramid levels are stored in the same 16 bit type, floats exist only for the sliced chunks
+        self.dtype = dtype
+        self.pyramid = None
+        # Quantized storage of in memory data: None, "fp16" or "int8", set by NNet
+        self.storage = None
+        # Value padding the last row of folded 1D data
+        self.fill_value = None
+        # NTileStats of the layer, set by the NStatsIndex background job
+        self.stats = None
+        # Scale and offset mapping the layer values to the color range, set from the statistics
+        self.normalization = None
+
+    @property
+    def layer_grid(self):
+        if self.data is None:
+            self.materialize()
+        return self.data
+
+    def materialize(self):
+        """
+        Load the data of a lazy layer and mark it as recently used
+        Layers evicted from the cache by this load are released
+        """
+        if self.loader is None:
+            return
+        if self.data is not None:
+            if self.cache is not None:
+                self.cache.get(self)
+            return
+        with self.lock:
+            if self.data is None:
+                data = self.loader()
+                self.data = self.fold_data(data) if self.fill_value is not None else data.reshape(self.shape)
+                self.apply_storage()
+                if self.cache is not None:
+                    self.cache.misses += 1
+                    self.release_evicted(self.cache.put(self, self, self.nbytes()))
+
+    def read_data(self):
+        """
+        Layer data for a single pass, data of lazy layers which are not resident is loaded without being cached
+        """
+        if self.data is not None or self.loader is None:
+            return self.layer_grid
+        data = self.loader()
+        return self.fold_data(data) if self.fill_value is not None else data.reshape(self.shape)
+
+    def tiles_reader(self):
+        """
+        Reader of blocks of the layer data for a single pass, a lazy layer is not loaded:
+        resident and tiled data is sliced, memory mapped source is sliced and only the padded last row of folded
+        data is copied. A lazy layer without a source is read once for the pass.
+        :return: function (row_start, row_end, column_start, column_end) returning the raw block,
+        columns are ignored for 1D data
+        """
+        if self.data is not None or self.loader is None:
+            data = self.layer_grid
+        elif self.source is None:
+            data = self.read_data()
+        elif self.fill_value is not None:
+            return self.folded_reader(self.source)
+        else:
+            data = self.source.reshape(self.shape)
+        if data.ndim == 1:
+            return lambda row_start, row_end, column_start, column_end: data[row_start:row_end]
+        return lambda row_start, row_end, column_start, column_end: data[row_start:row_end, column_start:column_end]
+
+    def folded_reader(self, source):
+        """
+        Blocks of the folded 1D source, full rows are a view of it, the last row is padded with the fill value
+        """
+        flat = source.reshape(-1)
+        full_rows = flat.shape[0] // self.columns_count
+        rows = flat[:full_rows * self.columns_count].reshape(full_rows, self.columns_count)
+        last = None
+        if full_rows < self.rows_count:
+            remainder = flat[full_rows * self.columns_count:]
+            padding = self.columns_count - remainder.shape[0]
+            fill = self.encode(np.full(padding, self.fill_value, dtype=np.float32)).astype(flat.dtype)
+            last = np.concatenate((remainder, fill)).reshape(1, self.columns_count)
+
+        def read(row_start, row_end, column_start, column_end):
+            block = rows[row_start:min(row_end, full_rows), column_start:column_end]
+            if last is not None and row_end > full_rows:
+                block = np.concatenate((block, last[:, column_start:column_end]))
+            return block
+
+        return read
+
+    def tensor_index(self, row, column):
+        """
+        Index in the original tensor of the layer cell, folded 1D data is mapped back to the flat index
+        :return: index tuple or None for the padding of folded layers
+        """
+        if self.fill_value is not None:
+            flat = row * self.columns_count + column
+            return (flat,) if flat < self.size else None
+        if self.ndim == 1:
+            return (row,)
+        return row, column
+
+    def read_values(self, rows, columns):
+        """
+        Read the values of many cells, array data is read with one fancy indexing, tiled data one element at a time
+        :return: float64 array or None when the data of a lazy layer is not resident
+        """
+        data = self.data
+        if data is None:
+            return None
+        if not isinstance(data, np.ndarray):
+            return np.array([self.read_value(row, column) for row, column in zip(rows.tolist(), columns.tolist())])
+        values = data[rows] if data.ndim == 1 else data[rows, columns]
+        return self.decode(values).astype(np.float64)
+
+    def read_value(self, row, column):
+        """
+        Read a single value, only the element (or its tile for tiled data) is accessed
+        :return: float value or None when the data of a lazy layer is not resident
+        """
+        data = self.data
+        if data is None:
+            return None
+        value = data[row] if data.ndim == 1 else data[row, column]
+        return float(self.decode(np.asarray(value)))
+
+    def update_region(self, row_start, row_end, column_start=0, column_end=1):
+        """
+        Level 0 data of the region was changed in place, reduce the pyramid levels covering it again
+        Statistics of the tiles overlapping the region are computed again
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.update(self.tiles_reader(), self.decode, row_start, row_end, column_start, column_end,
+                         self.fill_value)
+        if self.pyramid is not None and len(self.pyramid.levels) > 1:
+            self.pyramid.update(row_start, row_end, column_start, column_end, self.decode, self.encode)
+
+    def can_fold(self):
+        """
+        Only 1D data held in memory or loaded lazily can be folded, tiled data has its levels already stored
+        """
+        if self.ndim != 1 or self.pyramid is not None:
+            return False
+        return self.loader is not None or isinstance(self.data, np.ndarray)
+
+    def fold(self, rows_count, columns_count, fill_value):
+        """
+        Display 1D data as a rows_count x columns_count block, the last row is padded with the fill value
+        """
+        self.fill_value = fill_value
+        self.shape = (rows_count, columns_count)
+        self.ndim = 2
+        self.rows_count, self.columns_count = self.shape
+        if self.data is not None:
+            self.data = self.fold_data(self.data)
+
+    def fold_data(self, data):
+        data = data.reshape(-1)
+        padding = self.rows_count * self.columns_count - data.shape[0]
+        if padding > 0:
+            fill = self.encode(np.full(padding, self.fill_value, dtype=np.float32)).astype(data.dtype)
+            data = np.concatenate((data, fill))
+        return data.reshape(self.shape)
+
+    def release(self):
+        """
+        Drop the data and pyramid of a lazy layer, they are loaded again on the next use
+        """
+        if self.loader is None:
+            return
+        self.data = None
+        if self.pyramid is not None:
+            self.pyramid.levels = []
+
+    def release_evicted(self, evicted):
+        for key, layer in evicted:
+            layer.release()
+
+    def nbytes(self):
+        if self.data is None or isinstance(self.data, TiledArray):
+            # Tiles are accounted in the tiles cache
+            return 0
+        pyramid_bytes = self.pyramid.nbytes() if self.pyramid is not None and len(self.pyramid.levels) > 0 else 0
+        return self.data.nbytes + pyramid_bytes
+
+    def decode(self, chunk, dtype=np.float32):
+        """
+        Convert raw chunk of layer data to floats, only the sliced chunk is converted
+        """
+        return decode(chunk, self.dtype, dtype)
+
+    def encode(self, values):
+        """
+        Convert float values (pyramid levels) to the 16 bit storage type of the layer
+        """
+        return encode(values, self.dtype)
+
+    def apply_storage(self):
+        """
+        Replace in memory data and pyramid levels with fp16 or int8 quantized storage
+        """
+        if self.storage is None:
+            return
+        if self.data is not None and is_quantizable(self.data, self.storage):
+            self.data = quantize(self.data, self.storage, self.decode)
+        if self.pyramid is not None and len(self.pyramid.levels) > 0:
+            self.pyramid.levels[0] = self.data
+            for index, level in enumerate(self.pyramid.levels):
+                if is_quantizable(level, self.storage):
+                    self.pyramid.levels[index] = quantize(level, self.storage, self.decode)
+
+    def configure_pyramid(self, levels_count, aggregation):
+        # Padding of folded layers is left out of the aggregated values
+        self.pyramid = NPyramid(levels_count, aggregation, self.fill_value)
+
+    def build_pyramid(self):
+        self.pyramid.build(self.layer_grid, self.decode, encode=self.encode)
+
+    def get_level_data(self, factor):
+        """
+        Pyramid is built on the first request if it was not built at load time
+        :param factor: requested down sampling factor
+        :return: pyramid level data best matching the factor and the level reduction factor (power of two)
+        """
+        if self.pyramid is None or factor <= 1:
+            return self.layer_grid, 1
+        levels = self.pyramid.levels
+        if len(levels) == 0:
+            data = self.layer_grid
+            with self.lock:
+                if len(self.pyramid.levels) == 0:
+                    self.pyramid.build(data, self.decode, encode=self.encode)
+                    self.apply_storage()
+                levels = self.pyramid.levels
+            if self.loader is not None and self.cache is not None:
+                # Account the pyramid in the memory budget
+                self.release_evicted(self.cache.put(self, self, self.nbytes()))
+        # Local reference, the levels may be released by another thread evicting this layer
+        level = min(self.pyramid.select_level(factor), len(levels) - 1)
+        return levels[level], 2 ** level
 
     def define_layer_offset(self, column_offset, row_offset):
         self.column_offset = column_offset
@@ -153,7 +649,8 @@ class Layer:
 
 
 class NNet:
-    def __init__(self, n_window, color_theme):
+    def __init__(self, n_window, color_theme, pyramid_levels=6, aggregation="mean", memory_budget=None,
+                 storage=None, workers=None, layout=None, tile_stats=False, normalization=None):
         self.n_window = n_window
         self.color_theme = color_theme
         self.layers = []
@@ -165,36 +662,245 @@ class NNet:
         # self.grid = None
         self.node_gap_x = 0.2  # 100 / self.n_window.width * 2.0
         self.node_gap_y = 0.2  # 100 / self.n_window.width * 2.0
-        self.grid = Grid()
+        # Placement of the layers on the grid, see n_layout
+        self.layout = layout if layout is not None else RowLayout()
+        # (layers count, 2) table of layers column and row offsets
+        self.layers_offsets = None
+        # Threads extracting chunks of visible layers, sequential by default, see Grid
+        self.grid = Grid(workers)
+        # Down sampled data levels (factors 2, 4, ... 2^pyramid_levels) built once when the grid is initialized
+        # aggregation: mean, max_abs, min or max
+        self.pyramid_levels = pyramid_levels
+        self.aggregation = aggregation
+        # Build pyramids on the first use instead of load time, used for memory mapped data
+        self.lazy_pyramids = False
+        self.tile_store = None
+        # Tiles computed on demand (checkpoints diff), bounded by the cache size
+        self.tiles_cache = None
+        # Shared memory of a training run publishing its parameters, see n_live
+        self.live = None
+        # Grid regions (col_min, row_min, col_max, row_max) changed since the last frame
+        self.dirty_regions = []
+        # Bytes budget of lazily loaded layers, layers are materialized when visible
+        # and the least recently used are evicted when the budget is exceeded
+        self.memory_budget = memory_budget
+        self.layer_cache = NLruCache(memory_budget) if memory_budget is not None else None
+        # Visualization storage of layers data
+        # None: float32, "fp16": float16 data and GL_R16F textures,
+        # "int8": 8 bit codes with scale and offset per tile and GL_R8 textures
+        if storage not in STORAGES:
+            raise ValueError(f"Unsupported storage: {storage}, expected one of {STORAGES}")
+        self.storage = storage
+        self.grid.chunks_dtype = np.float16 if storage == "fp16" else np.float32
+        # Color transfer used by the shaders: clamp(value * color_multiplier + color_offset, 0, 1)
+        self.color_multiplier = 50
+        self.color_offset = 0
+        # Per tile statistics computed in the background when the grid is initialized, see n_stats
+        # Constant regions are not sliced and empty chunks are not uploaded once the statistics are ready
+        self.tile_stats = tile_stats
+        self.stats_index = None
+        self.stats_path = None
+        # Checkpoint fingerprint saved with the statistics, statistics of a replaced checkpoint are not loaded
+        self.stats_fingerprint = None
+        # Values normalization: None or "layer", every layer mean +- 3 std mapped to the color range
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f"Unsupported normalization: {normalization}, expected one of {NORMALIZATIONS}")
+        self.normalization = normalization
+        # Incremented when the extracted values change, uploaded textures have to be reloaded
+        self.values_version = 0
+        # Source the net was initialized from, saved with recorded camera paths, see describe
+        self.identity = None
 
         self.visible_layers = []
 
     def init_from_size(self, all_layers_sizes):
         print("Init net from sizes")
+        self.identity = {"source": "size"}
         layers = []
         print("Generating layers data")
-        for size in all_layers_sizes:
+        for index, size in enumerate(all_layers_sizes):
             size_x = math.ceil(math.sqrt(size))
             size_y = size_x
             calculated_size = [size_x, size_y]
             rows_count, columns_count = calculated_size[0], calculated_size[1]
+            if self.layer_cache is not None:
+                self.add_lazy_layer(None, (rows_count, columns_count), "float32",
+                                    self.random_loader(index, rows_count, columns_count))
+                continue
             layer_grid = np.random.uniform(0, 1, (rows_count, columns_count)).astype(np.float32)
             layers.append(layer_grid)
         print("Creating layers")
         self.create_layers(layers)
         self.init_grid()
 
+    def random_loader(self, index, rows_count, columns_count):
+        def load():
+            generator = np.random.default_rng(index)
+            return generator.uniform(0, 1, (rows_count, columns_count)).astype(np.float32)
+
+        return load
+
+    def init_from_safetensors(self, paths):
+        """
+        Init net from memory mapped safetensors checkpoint
+        Only the headers are read, layers are views of the mapped files and no data page is touched
+        until the layer is sliced. Pyramids are built lazily on first use.
+        :param paths: safetensors files (shards of one checkpoint) or a directory containing them
+        """
+        print("Init net from safetensors")
+        self.identity = {"source": "safetensors", "paths": paths}
+        start_time = time.time()
+        tensors = index_safetensors(paths)
+        print("Safetensors indexed", (time.time() - start_time) * 1000, "ms", "tensors:", len(tensors))
+        for tensor in tensors:
+            if self.layer_cache is not None:
+                # Read into memory on first visibility, resident layers are bounded by the memory budget
+                self.add_lazy_layer(tensor.name, tensor.shape, tensor.dtype_name(), tensor.read, tensor.data)
+            else:
+                self.layers.append(Layer(tensor.data, tensor.name, tensor.dtype_name()))
+        self.lazy_pyramids = True
+        self.stats_path = os.path.join(os.path.dirname(tensors[0].path), STATS_FILE) if tensors else None
+        self.stats_fingerprint = checkpoint_fingerprint(paths) if tensors else None
+        self.init_grid()
+
+    def init_from_tile_store(self, paths, cache_size=2 * 1024 ** 3, compression=None, workers=None,
+                             cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Init net from the out of core tile store of a safetensors checkpoint
+        Checkpoint is converted on the first launch only, the store is keyed by the checkpoint hash
+        :param cache_size: tiles cache size in bytes, bounds the resident memory used by layers data
+        """
+        print("Init net from tile store")
+        self.identity = {"source": "tile_store", "paths": paths}
+        store = open_store(paths, cache_dir, cache_size, TILE_SIZE, self.pyramid_levels, self.aggregation,
+                           compression, workers)
+        for index, layer_info in enumerate(store.index["layers"]):
+            levels = store.get_levels(index)
+            layer = Layer(levels[0], layer_info["name"], layer_info["dtype"])
+            layer.configure_pyramid(len(levels) - 1, store.aggregation)
+            layer.pyramid.levels = levels
+            self.layers.append(layer)
+        self.tile_store = store
+        self.stats_path = os.path.join(store.path, STATS_FILE)
+        self.stats_fingerprint = checkpoint_fingerprint(paths)
+        self.init_grid()
+
+    def init_from_diff(self, base, tuned, mode="delta", cache_size=2 * 1024 ** 3):
+        """
+        Init net from the difference of two safetensors checkpoints, for example a fine tuned model and its base
+        Both checkpoints are memory mapped, the difference is computed per tile only for the tiles
+        which are sliced and the tiles are kept in a LRU cache
+        :param mode: "delta" tuned - base or "relative" (tuned - base) / |base|
+        :param cache_size: tiles cache size in bytes
+        """
+        print("Init net from diff")
+        self.identity = {"source": "diff", "base": base, "tuned": tuned, "mode": mode}
+        base_tensors = {tensor.name: tensor for tensor in index_safetensors(base)}
+        self.tiles_cache = NLruCache(cache_size)
+        for tensor in index_safetensors(tuned):
+            base_tensor = base_tensors.get(tensor.name)
+            if base_tensor is None or base_tensor.shape != tensor.shape:
+                print("Skipping tensor without base of the same shape", tensor)
+                continue
+            levels = diff_levels(tensor.name, base_tensor.data, tensor.data, base_tensor.dtype_name(),
+                                 tensor.dtype_name(), self.tiles_cache, self.pyramid_levels, self.aggregation, mode)
+            layer = Layer(levels[0], tensor.name, "float32")
+            layer.configure_pyramid(len(levels) - 1, self.aggregation)
+            layer.pyramid.levels = levels
+            self.layers.append(layer)
+        self.init_grid()
+
+    def init_from_synthetic(self, config, seed=0, cache_size=1024 ** 3):
+        """
+        Init net with the tensors of a LLaMA or Mistral shaped model filled with synthetic values
+        Values are generated per tile on demand, no memory is used for data outside of the tiles cache,
+        so any model size can be displayed, only the mean aggregation is supported
+        :param config: name of n_synthetic.CONFIGS or dictionary with the same keys
+        :param cache_size: tiles cache size in bytes
+        """
+        print("Init net from synthetic model", config)
+        self.identity = {"source": "synthetic", "config": config, "seed": seed}
+        self.tiles_cache = NLruCache(cache_size)
+        for index, (name, shape) in enumerate(model_shapes(config)):
+            levels = synthetic_levels(name, shape, index, self.tiles_cache, self.pyramid_levels, seed,
+                                      aggregation=self.aggregation)
+            layer = Layer(levels[0], name, "float32")
+            layer.configure_pyramid(len(levels) - 1, self.aggregation)
+            layer.pyramid.levels = levels
+            self.layers.append(layer)
+        self.init_grid()
+
+    def init_from_live(self, name=DEFAULT_NAME):
+        """
+        Init net from the parameters published by a running training loop (NLivePublisher)
+        Layers are views of the shared memory, poll_live applies the published changes
+        """
+        print("Init net from live training", name)
+        self.identity = {"source": "live", "name": name}
+        if self.storage is not None:
+            raise ValueError("Live layers are updated in place, storage must be None")
+        self.live = NLiveSubscriber(name)
+        for tensor_name, data in zip(self.live.names, self.live.views):
+            self.layers.append(Layer(data, tensor_name, "float32"))
+        self.init_grid()
+
+    @profiled("live poll")
+    def poll_live(self):
+        """
+        Read the regions changed by the training loop since the last poll, update their pyramid levels
+        and mark them dirty
+        :return: count of changed regions
+        """
+        if self.live is None:
+            return 0
+        updates = self.live.read_updates()
+        for layer_index, row_start, row_end, column_start, column_end in updates:
+            grid_layer = self.layers[layer_index]
+            if grid_layer.fill_value is not None:
+                # Padded folded data is a copy of the 1D view, the flat range is mapped to whole folded rows
+                grid_layer.data.reshape(-1)[row_start:row_end] = self.live.views[layer_index][row_start:row_end]
+                columns = grid_layer.columns_count
+                row_start, row_end, column_start, column_end = row_start // columns, -(-row_end // columns), 0, columns
+            grid_layer.update_region(row_start, row_end, column_start, column_end)
+            self.dirty_regions.append((grid_layer.column_offset + column_start,
+                                       grid_layer.row_offset + row_start,
+                                       grid_layer.column_offset + column_end,
+                                       grid_layer.row_offset + row_end))
+        return len(updates)
+
+    def pop_dirty_regions(self):
+        """
+        :return: grid regions changed since the last call
+        """
+        regions = self.dirty_regions
+        self.dirty_regions = []
+        return regions
+
+    def add_capture(self, capture):
+        """
+        Add the last activations (and gradients) captured by NActivationCapture as layers and place the grid again
+        Layers are views of the capture buffers, remove the hooks or disable the capture to keep them unchanged
+        """
+        captures = capture.latest()
+        print("Adding captured layers", len(captures), f"buffers: {capture.nbytes() / (1024 * 1024):.2f} MB")
+        for name, data in captures:
+            self.layers.append(Layer(data, name, "float32"))
+        # Captures change between runs, statistics of the checkpoint file would no longer match
+        self.stats_path = None
+        self.init_grid()
+
     def init_from_tensors(self, tensors):
         print("Init net from tensors")
+        self.identity = {"source": "tensors"}
         size = len(tensors)
-        layers = []
         print("")
         for index, tensor in enumerate(tensors):
             print(f"\rDetaching tensors: {int(100 * index / size)}%", end="")
-            layers.append(tensor.detach().numpy())
+            # bf16 and fp16 tensors keep their 16 bit payload, no float32 copy is made
+            data, dtype = from_torch(tensor)
+            self.layers.append(Layer(data, dtype=dtype))
         print(f"\rDetaching tensors: 100%", end="")
         print("")
-        self.create_layers(layers)
         self.init_grid()
 
     def create_layers(self, all_layers):
@@ -203,34 +909,251 @@ class NNet:
             grid_layer = Layer(layer_data)
             self.layers.append(grid_layer)
 
+    def add_lazy_layer(self, name, shape, dtype, loader, source=None):
+        """
+        Add layer which data is returned by the loader on first visibility
+        With memory budget the layer is evicted when it is the least recently used one
+        :param source: memory mapped view of the data, see Layer
+        """
+        grid_layer = Layer(name=name, dtype=dtype, loader=loader, shape=shape, source=source)
+        grid_layer.cache = self.layer_cache
+        self.layers.append(grid_layer)
+        self.lazy_pyramids = True
+        return grid_layer
+
+    def describe(self):
+        """
+        :return: dictionary of the net source, layout and grid size, JSON serializable
+        """
+        return dict(self.identity or {}, layout=type(self.layout).__name__, pyramid_levels=self.pyramid_levels,
+                    aggregation=self.aggregation, grid_columns=self.grid_columns_count,
+                    grid_rows=self.grid_rows_count)
+
+    def memory_stats(self):
+        """
+        :return: lazy layers cache counters (hits, misses, evictions, used and budget bytes)
+        """
+        if self.layer_cache is None:
+            return None
+        return self.layer_cache.stats()
+
     def init_grid(self):
         start_time = time.time()
         print(f"Init net, layers count:", len(self.layers))
-        max_row_count = max(l.rows_count for l in self.layers)
-        gap_between_layers = 200
         print("Loading offsets")
-        for index, grid_layer in enumerate(self.layers):
-            column_offset = sum([l.columns_count for l in self.layers[:index]])
-            layer_offset = index * gap_between_layers
-            current_row_count = grid_layer.rows_count
-            row_offset = 0
-            if current_row_count < max_row_count:
-                row_offset = int((max_row_count - current_row_count) / 2)
-            grid_layer.define_layer_offset(column_offset + layer_offset, row_offset)
-            print(f"\rLoading offsets: {int(100 * index / len(self.layers))}%", end="")
-        print(f"\rLoading offsets: 100%", end="")
-        print("")
-        self.grid_columns_count = sum([l.columns_count for l in self.layers]) + gap_between_layers * len(self.layers)
-        self.grid_rows_count = max([l.rows_count for l in self.layers])
+        for grid_layer in self.layers:
+            folded_shape = self.layout.fold_shape(grid_layer.shape) if grid_layer.can_fold() else None
+            if folded_shape is not None:
+                grid_layer.fold(*folded_shape, self.grid.default_value)
+        shapes = np.array([(l.rows_count, l.columns_count) for l in self.layers], dtype=np.int64)
+        self.layers_offsets, self.grid_columns_count, self.grid_rows_count = self.layout.place(shapes)
+        for grid_layer, (column_offset, row_offset) in zip(self.layers, self.layers_offsets.tolist()):
+            grid_layer.define_layer_offset(column_offset, row_offset)
         self.total_width = self.grid_columns_count * self.node_gap_x
         self.total_height = self.grid_rows_count * self.node_gap_y
         self.total_size = sum([l.size for l in self.layers])
-        print(f"Grid dimensions: {self.grid_rows_count}x{self.grid_columns_count}")
+        print(f"Grid dimensions: {self.grid_rows_count}x{self.grid_columns_count}",
+              f"filled: {100 * self.total_size / (self.grid_rows_count * self.grid_columns_count):.1f}%")
         self.grid.add_layers(self.layers)
+        self.build_pyramids()
+        if self.tile_stats:
+            self.start_stats()
         print("Net initialized", time.time() - start_time, "s",
               "total size: ", self.total_size,
               "node gaps: ", self.node_gap_x, self.node_gap_y)
 
+    def build_pyramids(self):
+        start_time = time.time()
+        for index, grid_layer in enumerate(self.layers):
+            grid_layer.storage = self.storage
+            if grid_layer.pyramid is not None:
+                # Levels provided by the data source
+                continue
+            if self.pyramid_levels > 0:
+                grid_layer.configure_pyramid(self.pyramid_levels, self.aggregation)
+            if grid_layer.loader is not None:
+                continue
+            if self.pyramid_levels > 0 and not self.lazy_pyramids:
+                grid_layer.build_pyramid()
+            grid_layer.apply_storage()
+            print(f"\rBuilding pyramids: {int(100 * index / len(self.layers))}%", end="")
+        print(f"\rBuilding pyramids: 100%", end="")
+        print("")
+        if self.lazy_pyramids:
+            print("Pyramids configured for lazy load. Levels will be built on first use")
+        data_bytes = sum([l.nbytes() for l in self.layers])
+        print("Pyramids built", time.time() - start_time, "s",
+              "aggregation:", self.aggregation,
+              "storage:", self.storage,
+              "resident size:", f"{data_bytes / (1024 * 1024):.2f} MB")
+
+    def start_stats(self):
+        """
+        Compute the tiles statistics in a background thread, or load them when saved by a previous launch
+        """
+        if self.stats_index is not None:
+            # Layers were added, the previous index is replaced
+            self.stats_index.stop()
+        self.stats_index = NStatsIndex(self.layers, self.stats_path, on_ready=self.on_stats_ready,
+                                       fingerprint=self.stats_fingerprint)
+        self.stats_index.start()
+
+    def on_stats_ready(self):
+        if self.normalization == "layer":
+            for grid_layer in self.layers:
+                grid_layer.normalization = grid_layer.stats.normalization()
+        self.values_version += 1
+
+    def get_color_transfer(self):
+        """
+        :return: color_multiplier, color_offset of the shaders color transfer
+        Normalized values are already in the color range
+        """
+        if self.values_version > 0 and self.normalization is not None:
+            return 1.0, 0.0
+        return self.color_multiplier, self.color_offset
+
+    def query(self, world_x, world_y):
+        """
+        Value under a world point
+        :return: (tensor name, tensor index, value) or None if no layer is under the point
+        value is None when the data of a lazy layer is not resident
+        """
+        column = math.floor(world_x / self.node_gap_x)
+        row = math.floor(world_y / self.node_gap_y)
+        if column < 0 or row < 0 or self.grid.columns_index is None:
+            return None
+        layer_index = self.grid.find_layer_at(column, row)
+        if layer_index < 0:
+            return None
+        grid_layer = self.layers[layer_index]
+        row -= grid_layer.row_offset
+        column -= grid_layer.column_offset
+        index = grid_layer.tensor_index(row, column)
+        if index is None:
+            return None
+        name = grid_layer.name if grid_layer.name is not None else f"layer {layer_index}"
+        return name, index, grid_layer.read_value(row, column)
+
+    def query_many(self, points):
+        """
+        Values under many world points, the layers are found for all points at once (Grid.find_layers_at)
+        and every layer is read once for its points
+        :param points: (N, 2) array of world x, world y
+        :return: list of query results, see query
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        results = [None] * len(points)
+        if self.grid.columns_index is None or len(points) == 0:
+            return results
+        columns = np.floor(points[:, 0] / self.node_gap_x).astype(np.int64)
+        rows = np.floor(points[:, 1] / self.node_gap_y).astype(np.int64)
+        layer_indices = self.grid.find_layers_at(columns, rows)
+        for layer_index in np.unique(layer_indices[layer_indices >= 0]).tolist():
+            grid_layer = self.layers[layer_index]
+            name = grid_layer.name if grid_layer.name is not None else f"layer {layer_index}"
+            selected = np.flatnonzero(layer_indices == layer_index)
+            layer_rows = rows[selected] - grid_layer.row_offset
+            layer_columns = columns[selected] - grid_layer.column_offset
+            if grid_layer.fill_value is not None:
+                # Padding of folded layers has no tensor index
+                valid = layer_rows * grid_layer.columns_count + layer_columns < grid_layer.size
+                selected, layer_rows, layer_columns = selected[valid], layer_rows[valid], layer_columns[valid]
+            values = grid_layer.read_values(layer_rows, layer_columns)
+            for position, (point, row, column) in enumerate(zip(selected.tolist(), layer_rows.tolist(),
+                                                                layer_columns.tolist())):
+                value = float(values[position]) if values is not None else None
+                results[point] = (name, grid_layer.tensor_index(row, column), value)
+        return results
+
+    def region_stats(self, x1, y1, x2, y2):
+        """
+        Statistics of all values inside the world rectangle, computed from the tiles summed area tables
+        Cost depends on the overlapped layers and border tiles, not on the area
+        :return: dictionary of count, mean, std, variance, min, max, histogram and edges,
+        None until the tiles statistics are ready
+        """
+        if self.stats_index is None or not self.stats_index.ready:
+            return None
+        start_time = time.time()
+        col_min = max(math.floor(min(x1, x2) / self.node_gap_x), 0)
+        row_min = max(math.floor(min(y1, y2) / self.node_gap_y), 0)
+        col_max = math.ceil(max(x1, x2) / self.node_gap_x)
+        row_max = math.ceil(max(y1, y2) / self.node_gap_y)
+        regions = []
+        for grid_layer in self.grid.find_layers(col_min, row_min, col_max - 1, row_max - 1):
+            row_start = max(row_min - grid_layer.row_offset, 0)
+            row_end = min(row_max - grid_layer.row_offset, grid_layer.rows_count)
+            column_start = max(col_min - grid_layer.column_offset, 0)
+            column_end = min(col_max - grid_layer.column_offset, grid_layer.columns_count)
+            if row_end > row_start and column_end > column_start:
+                regions.append((grid_layer, row_start, row_end, column_start, column_end))
+        result = self.stats_index.region_stats(regions)
+        result["layers"] = len(regions)
+        print("Region stats", (time.time() - start_time) * 1000, "ms", "layers:", len(regions))
+        return result
+
+    def find_top_k(self, k, metric="abs"):
+        """
+        Largest values of the whole net, pruned with the tiles statistics
+        :param metric: "abs" largest magnitudes, "max" largest values or "min" smallest values
+        :return: list of (tensor name, tensor index, value, world x, world y) best first,
+        world position is the center of the cell
+        """
+        start_time = time.time()
+        search = NTopKSearch(self.layers, k, metric, self.grid.map_layers)
+        results = []
+        for score, value, layer_index, row, column in search.search():
+            grid_layer = self.layers[layer_index]
+            name = grid_layer.name if grid_layer.name is not None else f"layer {layer_index}"
+            world_x = (grid_layer.column_offset + column + 0.5) * self.node_gap_x
+            world_y = (grid_layer.row_offset + row + 0.5) * self.node_gap_y
+            results.append((name, grid_layer.tensor_index(row, column), value, world_x, world_y))
+        print("Top k search", (time.time() - start_time) * 1000, "ms", "metric:", metric,
+              "tiles read:", search.tiles_read, "of", search.tiles_count)
+        return results
+
+    def upload_dtype(self):
+        """
+        :return: type of the chunks uploaded to textures
+        """
+        if self.storage == "int8":
+            return np.uint8
+        return self.grid.chunks_dtype
+
+    def get_value_scale(self):
+        """
+        Dequantization uniforms of the uploaded texture values, value = texel * scale + offset
+        GL_R8 texels are normalized to [0, 1] and store the color transfer result directly
+        """
+        if self.storage == "int8":
+            multiplier, offset = self.get_color_transfer()
+            return 1.0 / multiplier, -offset / multiplier
+        return 1.0, 0.0
+
+    @tracked("chunk encode")
+    def is_cleared_value(self, value):
+        """
+        Regions are cleared to zeros before the upload (NSceneV2), chunks of constant tiles which encode
+        to zero are not sliced
+        """
+        return not self.encode_chunks([np.array([value], dtype=self.grid.chunks_dtype)])[0].any()
+
+    def encode_chunks(self, chunks):
+        """
+        Encode chunks to the texture upload type
+        With int8 storage chunks become 8 bit color map indices, no precision visible on screen is lost
+        """
+        if self.storage != "int8":
+            return chunks
+        multiplier, offset = self.get_color_transfer()
+        encoded = []
+        for chunk in chunks:
+            values = chunk * (255.0 * multiplier) + (255.0 * offset + 0.5)
+            encoded.append(np.clip(values, 0, 255).astype(np.uint8))
+        return encoded
+
+    @profiled("visible layers")
     def update_viewport(self, viewport):
         x, y, w, h, zoom = viewport
         x1 = x
@@ -243,6 +1166,9 @@ class NNet:
 
         if visible != self.visible_layers:
             self.visible_layers = visible
+            if self.layer_cache is not None:
+                for grid_layer in visible:
+                    grid_layer.materialize()
 
     def world_to_grid_position(self, x1, y1, x2, y2):
         node_gap_x = self.node_gap_x
@@ -263,6 +1189,7 @@ class NNet:
                                                                 factor)
         dimensions = [(c1 * self.node_gap_y, r1 * self.node_gap_x, c2 * self.node_gap_y, r2 * self.node_gap_x) for
                       c1, r1, c2, r2 in dimensions]
+        chunks = self.encode_chunks(chunks)
         print("Get grid chunks", (time.time() - start_time) * 1000, "ms", "factor:", factor)
         return chunks, dimensions
 
@@ -275,22 +1202,54 @@ class NNet:
                                                                 factor,
                                                                 True)
 
+        chunks = self.encode_chunks(chunks)
         width = math.ceil((col_max - col_min) / factor)
         height = math.ceil((row_max - row_min) / factor)
         print("Get grid chunks", (time.time() - start_time) * 1000, "ms", "factor:", factor)
         return chunks, dimensions, width, height
 
-    def get_positions_and_values_array(self, x1, y1, x2, y2, factor):
+    @profiled("chunk slice")
+    @tracked("chunk slice")
+    def get_region_chunks(self, cell_x1, cell_y1, cell_x2, cell_y2, factor):
+        """
+        Chunks of the region given in cells, cell (x, y) covers grid columns [x * factor, (x + 1) * factor)
+        and rows [y * factor, (y + 1) * factor). Every cell holds at most one sample, so a cell keeps its value
+        no matter which region it is fetched with.
+        Layers are looked up in the index, the region does not have to be inside the viewport.
+        :return: chunks, dimensions (x1, y1, x2, y2) of the chunks in cells
+        """
+        start_time = time.time()
+        col_min = cell_x1 * factor
+        row_min = cell_y1 * factor
+        col_max = cell_x2 * factor
+        row_max = cell_y2 * factor
+        layers = self.grid.find_layers(col_min, row_min, col_max - 1, row_max - 1)
+        chunks, dimensions = self.grid.get_visible_data_chunks(col_min, row_min, col_max, row_max,
+                                                               factor,
+                                                               factor,
+                                                               True,
+                                                               layers,
+                                                               self.is_cleared_value)
+        dimensions = [(cell_x1 + x1, cell_y1 + y1, cell_x1 + x2, cell_y1 + y2) for x1, y1, x2, y2 in dimensions]
+        chunks = self.encode_chunks(chunks)
+        print("Get region chunks", (time.time() - start_time) * 1000, "ms", "factor:", factor,
+              "cells:", (cell_x2 - cell_x1) * (cell_y2 - cell_y1))
+        return chunks, dimensions
 
+    def get_positions_and_values_array(self, x1, y1, x2, y2, factor):
+        """
+        :return: (N, 3) float32 array of world x, world y and value, view of the grid positions buffer
+        valid until the next call
+        """
         start_time = time.time()
         col_min, row_min, col_max, row_max = self.world_to_grid_position(x1, y1, x2, y2)
-        rows, columns, values = self.grid.get_visible_data_positions_and_values(col_min,
-                                                                                row_min,
-                                                                                col_max,
-                                                                                row_max,
-                                                                                factor,
-                                                                                factor)
-
-        result_array = np.column_stack((columns * self.node_gap_x, rows * self.node_gap_y, values))
+        result_array = self.grid.fill_positions_and_values(col_min,
+                                                           row_min,
+                                                           col_max,
+                                                           row_max,
+                                                           factor,
+                                                           factor,
+                                                           self.node_gap_x,
+                                                           self.node_gap_y)
         print("Get grid positions", (time.time() - start_time) * 1000, "ms", "factor:", factor)
         return result_array
@@ -1,14 +1,19 @@
+import math
 import os
 import time
 
 import OpenGL.GL as gl
 import glfw
+import numpy as np
 import psutil
 from OpenGL.GL import *
-from transformers import AutoModelForCausalLM
+from huggingface_hub import snapshot_download
 
+from app.draw.gl.n_alloc_tracker import alloc_tracker, tracked
+from app.draw.gl.n_layout import ShelfLayout
 from app.draw.gl.n_lod import NLvlOfDetails, LodType
 from app.draw.gl.n_net import NNet
+from app.draw.gl.n_profiler import TRACE_FILE, profiled, profiler
 from app.draw.gl.n_scene import NScene
 from app.draw.gl.n_scene_v2 import NSceneV2
 from app.draw.gl.n_tree import NTree
@@ -24,7 +29,9 @@ color_theme = NColorTheme()
 textures_factory = ImageTextureFactory()
 rgb_textures_factory = RGBGridTextureFactory(color_theme)
 
-n_net = NNet(n_window, color_theme)
+# Near square world: at the same details factor ShelfLayout uploads ~10x fewer values than RowLayout,
+# see benchmark/bench_layout
+n_net = NNet(n_window, color_theme, layout=ShelfLayout(), tile_stats=True, normalization="layer")
 n_lod = NLvlOfDetails(n_net, n_window)
 n_tree = NTree(0)
 n_scene = NSceneV2(n_lod, n_tree, n_net, n_window, rgb_textures_factory)
@@ -45,6 +52,8 @@ def print_memory_usage():
         print(f"Memory usage: {memory_usage} GB (Resident Set Size)")
 
 
+@profiled("frame")
+@tracked("frame")
 def render():
     global frame_count, start_time
 
@@ -80,48 +89,149 @@ def render():
         n_window.n_instances_from_buffer_shader.use()
         n_window.n_instances_from_buffer_shader.update_projection(n_window.get_projection_matrix())
         n_window.n_instances_from_buffer_shader.update_color_map(color_theme.name, color_theme.color_array)
+        n_window.n_instances_from_buffer_shader.update_color_transfer(*n_net.get_color_transfer())
 
         n_window.n_points_shader.use()
         n_window.n_points_shader.update_projection(n_window.get_projection_matrix())
         n_window.n_points_shader.update_color_map(color_theme.name, color_theme.color_array)
+        n_window.n_points_shader.update_color_transfer(*n_net.get_color_transfer())
 
         n_window.n_static_texture_shader.use()
         n_window.n_static_texture_shader.update_projection(n_window.get_projection_matrix())
         n_window.n_static_texture_shader.update_color_map(color_theme.name, color_theme.color_array)
+        n_window.n_static_texture_shader.update_color_transfer(*n_net.get_color_transfer())
 
         n_window.n_color_map_texture_shader.use()
         n_window.n_color_map_texture_shader.update_projection(n_window.get_projection_matrix())
         n_window.n_color_map_texture_shader.update_color_map(color_theme.name, color_theme.color_array)
+        n_window.n_color_map_texture_shader.update_color_transfer(*n_net.get_color_transfer())
+        n_window.n_color_map_texture_shader.update_value_scale(*n_net.get_value_scale())
 
         n_window.n_color_map_v2_texture_shader.use()
         n_window.n_color_map_v2_texture_shader.update_projection(n_window.get_projection_matrix())
         n_window.n_color_map_v2_texture_shader.update_color_map(color_theme.name, color_theme.color_array)
+        n_window.n_color_map_v2_texture_shader.update_color_transfer(*n_net.get_color_transfer())
 
         n_window.n_instances_from_texture_shader.use()
         n_window.n_instances_from_texture_shader.update_projection(n_window.get_projection_matrix())
         n_window.n_instances_from_texture_shader.update_color_map(color_theme.name, color_theme.color_array)
+        n_window.n_instances_from_texture_shader.update_color_transfer(*n_net.get_color_transfer())
+        n_window.n_instances_from_texture_shader.update_value_scale(*n_net.get_value_scale())
 
+        n_net.poll_live()
         n_lod.load_current_level()
-        n_scene.draw_scene(
-            n_window.n_points_shader,
-            n_window.n_static_texture_shader,
-            n_window.n_color_map_texture_shader,
-            n_window.n_color_map_v2_texture_shader,
-            n_window.n_instances_from_buffer_shader,
-            n_window.n_instances_from_texture_shader
-        )
-
-    glfw.swap_buffers(n_window.window)
+        with profiler.span("draw"):
+            n_scene.draw_scene(
+                n_window.n_points_shader,
+                n_window.n_static_texture_shader,
+                n_window.n_color_map_texture_shader,
+                n_window.n_color_map_v2_texture_shader,
+                n_window.n_instances_from_buffer_shader,
+                n_window.n_instances_from_texture_shader
+            )
+
+    with profiler.span("swap buffers"):
+        glfw.swap_buffers(n_window.window)
     print_memory_usage()
 
 
+@profiled("viewport update")
+@tracked("viewport update")
 def on_viewport_updated():
     viewport = n_window.viewport_to_world_cords()
-    n_tree.update_viewport(viewport)
+    with profiler.span("tree traverse"):
+        n_tree.update_viewport(viewport)
     n_net.update_viewport(viewport)
     n_lod.update_viewport(viewport)
 
 
+def on_hover(world_x, world_y):
+    result = n_net.query(world_x, world_y)
+    if result is None:
+        title = "TensorGrid"
+    else:
+        name, index, value = result
+        value = "not loaded" if value is None else f"{value:.6g}"
+        title = f"{name} {list(index)} = {value}"
+    glfw.set_window_title(n_window.window, title)
+
+
+# Largest magnitude weights, T key moves the camera to the next one
+top_values = []
+top_values_position = 0
+
+
+def on_key(key):
+    global top_values, top_values_position
+    if key == glfw.KEY_R:
+        toggle_camera_recording()
+        return
+    if key == glfw.KEY_P:
+        toggle_profiler()
+        return
+    if key == glfw.KEY_M:
+        toggle_alloc_tracker()
+        return
+    if key != glfw.KEY_T:
+        return
+    if len(top_values) == 0:
+        top_values = n_net.find_top_k(100, metric="abs")
+        top_values_position = 0
+    if len(top_values) == 0:
+        return
+    name, index, value, world_x, world_y = top_values[top_values_position]
+    print(f"Top value {top_values_position + 1}/{len(top_values)}: {name} {list(index)} = {value}")
+    n_window.center_on(world_x, world_y)
+    top_values_position = (top_values_position + 1) % len(top_values)
+
+
+# R key starts and stops recording the camera, replayed with benchmark/bench_camera_replay --path
+CAMERA_PATH_FILE = "camera_path.json"
+
+
+def toggle_camera_recording():
+    camera_path = n_window.camera_path
+    if camera_path.recording:
+        camera_path.stop()
+        camera_path.net = n_net.describe()
+        camera_path.save(CAMERA_PATH_FILE)
+    else:
+        camera_path.start()
+
+
+# P key starts the profiler and on the second press writes the recorded spans as a Chrome trace
+def toggle_profiler():
+    if profiler.enabled:
+        profiler.stop()
+        profiler.print_summary()
+        profiler.export_chrome_trace(TRACE_FILE)
+    else:
+        profiler.start()
+
+
+# M key tracks the allocations of the frame stages, stages over the budget are printed while tracking
+def toggle_alloc_tracker():
+    if alloc_tracker.enabled:
+        alloc_tracker.stop()
+        alloc_tracker.print_report()
+    else:
+        alloc_tracker.start()
+
+
+def on_selection(x1, y1, x2, y2):
+    stats = n_net.region_stats(x1, y1, x2, y2)
+    if stats is None:
+        print("Region stats not ready")
+        return
+    print(f"Region: {stats['count']} values in {stats['layers']} layers, mean: {stats['mean']:.6g}, "
+          f"std: {stats['std']:.6g}, min: {stats['min']:.6g}, max: {stats['max']:.6g}")
+    histogram = stats["histogram"]
+    edges = stats["edges"]
+    peak = max(histogram.max(), 1)
+    for index in np.flatnonzero(histogram):
+        print(f"{edges[index]:>11.4g} {'#' * math.ceil(40 * histogram[index] / peak)} {histogram[index]}")
+
+
 def create_level_of_details():
     print("Creating level of details")
 
@@ -138,6 +248,9 @@ def main():
     n_window.create_window()
     n_window.set_render_func(render)
     n_window.set_viewport_updated_func(on_viewport_updated)
+    n_window.set_hover_func(on_hover)
+    n_window.set_key_func(on_key)
+    n_window.set_selection_func(on_selection)
     glEnable(GL_DEPTH_TEST)
     glDepthMask(GL_FALSE)
     gl.glEnable(gl.GL_BLEND)
@@ -158,12 +271,27 @@ def main():
     print_memory_usage()
 
     model_name = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
-    model =  AutoModelForCausalLM.from_pretrained(model_name)
-    all_layers_and_parameters = list(model.named_parameters())
-    tensors = [tensor for name, tensor in all_layers_and_parameters]
-    print_memory_usage()
-    n_net.init_from_tensors(tensors)
+    # Memory map the checkpoint files, only safetensors headers are read at startup
+    model_path = snapshot_download(model_name, allow_patterns=["*.safetensors", "*.json"])
+    n_net.init_from_safetensors(model_path)
+    # Models larger than RAM: tiles converted once, resident memory bounded by the tiles cache size
+    # n_net.init_from_tile_store(model_path, cache_size=4 * 1024 ** 3)
+    # Parameters of a running training loop publishing with NLivePublisher (see examples/self_attention)
+    # n_net.init_from_live()
+    # Fine tuned checkpoint against its base, only the visible tiles of the difference are computed
+    # n_net.init_from_diff(base_model_path, model_path, mode="delta")
+    # model = AutoModelForCausalLM.from_pretrained(model_name)
+    # tensors = [tensor for name, tensor in model.named_parameters()]
+    # n_net.init_from_tensors(tensors)
+    # Activations of the decoder blocks for a prompt, shown next to the weights
+    # capture = NActivationCapture(model, max_tokens=256)
+    # tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # model(**tokenizer("The quick brown fox", return_tensors="pt"))
+    # capture.remove()
+    # n_net.add_capture(capture)
     #n_net.init_from_size([1000000])
+    # Scale testing without model files, values are generated per tile
+    # n_net.init_from_synthetic("llama-70b")
     print_memory_usage()
     # update tree size and depth using grid size
     n_tree.set_size(n_net.total_width, n_net.total_height)
@@ -0,0 +1,180 @@
+import functools
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_CAPACITY = 65536
+TRACE_FILE = "tensorgrid_trace.json"
+
+
+class NullSpan:
+    """
+    Span returned while the profiler is off, entering it costs one method call
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class NSpan:
+    __slots__ = ["profiler", "name_id", "start"]
+
+    def __init__(self, profiler, name_id):
+        self.profiler = profiler
+        self.name_id = name_id
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name_id, self.start, time.perf_counter_ns())
+        return False
+
+
+class NProfiler:
+    """
+    Named spans of the frame stages (viewport update, tree traverse, chunk slice, texture upload, draw)
+    recorded into a preallocated ring, the oldest spans are overwritten when the ring is full.
+    Off by default, a span of a disabled profiler records nothing.
+    Recorded spans are exported as Chrome trace JSON, opened in chrome://tracing or ui.perfetto.dev
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.enabled = False
+        self.starts = [0] * capacity
+        self.ends = [0] * capacity
+        self.names = [0] * capacity
+        self.threads = [0] * capacity
+        # Span names are interned, the ring holds their ids
+        self.names_ids = {}
+        self.names_list = []
+        self.names_lock = threading.Lock()
+        # next() of itertools.count is atomic, spans of the workers threads get distinct slots
+        self.counter = itertools.count()
+        self.count = 0
+
+    def start(self):
+        self.clear()
+        self.enabled = True
+        print("Profiler started, capacity:", self.capacity, "spans")
+
+    def stop(self):
+        self.enabled = False
+        print("Profiler stopped, spans:", min(self.count, self.capacity), "recorded:", self.count)
+
+    def clear(self):
+        self.counter = itertools.count()
+        self.count = 0
+
+    def name_id(self, name):
+        name_id = self.names_ids.get(name)
+        if name_id is None:
+            with self.names_lock:
+                name_id = self.names_ids.setdefault(name, len(self.names_list))
+                if name_id == len(self.names_list):
+                    self.names_list.append(name)
+        return name_id
+
+    def span(self, name):
+        """
+        Usage: with profiler.span("tree traverse"): ...
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return NSpan(self, self.name_id(name))
+
+    def record(self, name_id, start, end):
+        """
+        :param start: time.perf_counter_ns() at the start of the span
+        """
+        index = next(self.counter)
+        slot = index % self.capacity
+        self.starts[slot] = start
+        self.ends[slot] = end
+        self.names[slot] = name_id
+        self.threads[slot] = threading.get_ident()
+        self.count = max(self.count, index + 1)
+
+    def spans(self):
+        """
+        :return: list of (name, start ns, end ns, thread id) ordered by the start time
+        """
+        count = min(self.count, self.capacity)
+        order = sorted(range(count), key=self.starts.__getitem__)
+        return [(self.names_list[self.names[index]], self.starts[index], self.ends[index], self.threads[index])
+                for index in order]
+
+    def summary(self):
+        """
+        :return: dictionary of span name to count, total, mean, p95 and max duration in ms
+        """
+        count = min(self.count, self.capacity)
+        durations = (np.array(self.ends[:count]) - np.array(self.starts[:count])) / 1e6
+        names = np.array(self.names[:count])
+        result = {}
+        for name_id in np.unique(names):
+            values = durations[names == name_id]
+            result[self.names_list[name_id]] = {"count": int(len(values)), "total": float(values.sum()),
+                                                "mean": float(values.mean()),
+                                                "p95": float(np.percentile(values, 95)),
+                                                "max": float(values.max())}
+        return result
+
+    def print_summary(self):
+        print(f"{'span':>20} {'count':>7} {'total':>11} {'mean':>9} {'p95':>9} {'max':>9}")
+        for name, values in sorted(self.summary().items(), key=lambda item: -item[1]["total"]):
+            print(f"{name:>20} {values['count']:>7} {values['total']:>9.1f}ms {values['mean']:>7.2f}ms "
+                  f"{values['p95']:>7.2f}ms {values['max']:>7.2f}ms")
+
+    def export_chrome_trace(self, path=TRACE_FILE):
+        """
+        Write the recorded spans as complete ("X") events of the Chrome trace event format
+        """
+        spans = self.spans()
+        origin = spans[0][1] if len(spans) > 0 else 0
+        threads = {}
+        events = []
+        for name, start, end, thread in spans:
+            tid = threads.setdefault(thread, len(threads))
+            events.append({"name": name, "ph": "X", "ts": (start - origin) / 1000, "dur": (end - start) / 1000,
+                           "pid": 0, "tid": tid})
+        for thread, tid in threads.items():
+            thread_name = "main" if thread == threading.main_thread().ident else f"worker {tid}"
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": thread_name}})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        print("Trace exported", path, "spans:", len(spans))
+
+
+# Shared by the viewer modules, toggled with the P key in n_opengl
+profiler = NProfiler()
+
+
+def profiled(name):
+    """
+    Decorator recording every call of the function as a span of the shared profiler
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with NSpan(profiler, profiler.name_id(name)):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
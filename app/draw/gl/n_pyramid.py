@@ -0,0 +1,143 @@
+import numpy as np
+
+
+def aggregate_mean(a, b):
+    return (a + b) * 0.5
+
+
+def aggregate_min(a, b):
+    return np.minimum(a, b)
+
+
+def aggregate_max(a, b):
+    return np.maximum(a, b)
+
+
+def aggregate_max_abs(a, b):
+    # Keep the signed value with the larger magnitude so outliers stay visible
+    return np.where(np.abs(b) > np.abs(a), b, a)
+
+
+AGGREGATIONS = {
+    "mean": aggregate_mean,
+    "max_abs": aggregate_max_abs,
+    "min": aggregate_min,
+    "max": aggregate_max
+}
+
+
+class NPyramid:
+    """
+    Multi resolution representation of the layer data
+    Level 0 is the layer data itself, level k holds one value for every 2^k x 2^k block of level 0
+    Every level is a contiguous array, so a down sampled region is a plain slice instead of a strided view
+    """
+
+    def __init__(self, levels_count=6, aggregation="mean", fill_value=None):
+        """
+        :param fill_value: value of the padding of folded data, it is not aggregated with the data values
+        """
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation: {aggregation}, expected one of {list(AGGREGATIONS)}")
+        self.levels_count = levels_count
+        self.aggregation = aggregation
+        self.aggregate = AGGREGATIONS[aggregation]
+        self.fill_value = fill_value
+        self.levels = []
+
+    def build(self, data, decode=None, band_rows=1024, encode=None):
+        """
+        :param data: level 0 data, it is not copied and may be a memory mapped view
+        :param decode: optional function converting raw chunks (for example bfloat16 payload) to floats
+        :param band_rows: levels are reduced in bands of rows, so the decoded copy of a level never exists as a whole
+        :param encode: optional function converting reduced floats back to the storage type of the data,
+        levels are then stored in the same type as level 0 and decoded when sliced
+        """
+        self.levels = [data]
+        if self.levels_count <= 0:
+            return
+        for _ in range(self.levels_count):
+            current = self.levels[-1]
+            if max(current.shape) <= 1:
+                break
+            level = self.reduce_bands(current, decode, band_rows)
+            if encode is not None:
+                level = encode(level)
+            self.levels.append(level)
+
+    def update(self, row_start, row_end, column_start=0, column_end=1, decode=None, encode=None):
+        """
+        Reduce again the levels covering a changed region of level 0, level 0 is already updated
+        The region is extended to even bounds on every level, so the merged pairs are the same as in build
+        """
+        for level in range(1, len(self.levels)):
+            below = self.levels[level - 1]
+            row_start -= row_start % 2
+            row_end = min(row_end + row_end % 2, below.shape[0])
+            if below.ndim == 1:
+                block = below[row_start:row_end]
+            else:
+                column_start -= column_start % 2
+                column_end = min(column_end + column_end % 2, below.shape[1])
+                block = below[row_start:row_end, column_start:column_end]
+            reduced = self.reduce(decode(block) if decode is not None else block)
+            if encode is not None:
+                reduced = encode(reduced)
+            row_start //= 2
+            row_end = row_start + reduced.shape[0]
+            if below.ndim == 1:
+                self.levels[level][row_start:row_end] = reduced
+            else:
+                column_start //= 2
+                column_end = column_start + reduced.shape[1]
+                self.levels[level][row_start:row_end, column_start:column_end] = reduced
+
+    def reduce_bands(self, data, decode, band_rows):
+        if data.shape[0] <= band_rows:
+            return self.reduce(decode(data) if decode is not None else data)
+        bands = []
+        for row in range(0, data.shape[0], band_rows):
+            band = data[row:row + band_rows]
+            if decode is not None:
+                band = decode(band)
+            bands.append(self.reduce(band))
+        return np.ascontiguousarray(np.concatenate(bands))
+
+    def reduce(self, data):
+        result = self.reduce_axis(data, 0)
+        if data.ndim > 1:
+            result = self.reduce_axis(result, 1)
+        return np.ascontiguousarray(result)
+
+    def reduce_axis(self, data, axis):
+        """
+        Merge every pair of neighbouring cells along the axis
+        With odd length the last cell is carried over unchanged
+        """
+        size = data.shape[axis]
+        if size < 2:
+            return data
+        even = np.take(data, np.arange(0, size - 1, 2), axis=axis)
+        odd = np.take(data, np.arange(1, size, 2), axis=axis)
+        merged = self.aggregate(even, odd)
+        if self.fill_value is not None:
+            # A cell merged with the padding keeps its value, two padding cells stay padding
+            merged = np.where(even == self.fill_value, odd, np.where(odd == self.fill_value, even, merged))
+        merged = merged.astype(data.dtype, copy=False)
+        if size % 2 == 1:
+            last = np.take(data, [size - 1], axis=axis)
+            merged = np.concatenate((merged, last), axis=axis)
+        return merged
+
+    def select_level(self, factor):
+        """
+        :param factor: down sampling factor
+        :return: the highest level which reduction (2^level) divides the factor
+        """
+        level = 0
+        while level + 1 < len(self.levels) and factor % (2 ** (level + 1)) == 0:
+            level += 1
+        return level
+
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels[1:])
@@ -0,0 +1,92 @@
+import numpy as np
+
+from app.draw.gl.n_tiles import TILE_SIZE, normalize_index, squeeze_result
+
+STORAGES = [None, "fp16", "int8"]
+
+
+class NQuantizedArray:
+    """
+    8 bit storage of float data with scale and offset per tile
+    value = code * scale + offset, scale and offset are computed from the tile min and max
+    Slicing returns dequantized float32 chunks, so it can be used wherever the layer data array is used
+    """
+
+    def __init__(self, codes, scales, offsets, tile_size=TILE_SIZE):
+        self.codes = codes
+        self.scales = scales
+        self.offsets = offsets
+        self.shape = codes.shape
+        self.ndim = codes.ndim
+        self.dtype = np.dtype(np.float32)
+        self.size = codes.size
+        self.nbytes = codes.nbytes + scales.nbytes + offsets.nbytes
+        self.tile_size = tile_size if self.ndim > 1 else tile_size * tile_size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        slices, squeeze = normalize_index(item, self.shape)
+        key = tuple(slice(*s) for s in slices)
+        codes = self.codes[key]
+        rows = np.arange(*slices[0]) // self.tile_size
+        if self.ndim == 1:
+            result = codes * self.scales[rows] + self.offsets[rows]
+        else:
+            columns = np.arange(*slices[1]) // self.tile_size
+            tiles = np.ix_(rows, columns)
+            result = codes * self.scales[tiles] + self.offsets[tiles]
+        return squeeze_result(result.astype(np.float32, copy=False), squeeze)
+
+
+def quantize_int8(data, decode, tile_size=TILE_SIZE):
+    """
+    Quantize the data tile by tile, only one decoded tile exists at a time
+    """
+    tile_length = tile_size if data.ndim > 1 else tile_size * tile_size
+    tiles_shape = tuple(-(-dim // tile_length) for dim in data.shape)
+    codes = np.empty(data.shape, dtype=np.uint8)
+    scales = np.ones(tiles_shape, dtype=np.float32)
+    offsets = np.zeros(tiles_shape, dtype=np.float32)
+    for tile_index in np.ndindex(*tiles_shape):
+        key = tuple(slice(i * tile_length, (i + 1) * tile_length) for i in tile_index)
+        tile = decode(data[key])
+        if tile.size == 0:
+            continue
+        low = float(tile.min())
+        high = float(tile.max())
+        scale = (high - low) / 255 if high > low else 1.0
+        codes[key] = np.rint((tile - low) / scale)
+        scales[tile_index] = scale
+        offsets[tile_index] = low
+    return NQuantizedArray(codes, scales, offsets, tile_size)
+
+
+def quantize_fp16(data, decode, band_rows=1024):
+    result = np.empty(data.shape, dtype=np.float16)
+    for row in range(0, data.shape[0], band_rows):
+        result[row:row + band_rows] = decode(data[row:row + band_rows])
+    return result
+
+
+def quantize(data, storage, decode):
+    """
+    :param data: layer data or pyramid level
+    :param storage: "fp16" or "int8"
+    :param decode: function converting raw chunks of the data to floats
+    """
+    if storage == "fp16":
+        return quantize_fp16(data, decode)
+    if storage == "int8":
+        return quantize_int8(data, decode)
+    raise ValueError(f"Unsupported storage: {storage}, expected one of {STORAGES}")
+
+
+def is_quantizable(data, storage):
+    """
+    Only plain in memory arrays are quantized, memory mapped and tiled data is left untouched
+    """
+    if type(data) is not np.ndarray:
+        return False
+    return not (storage == "fp16" and data.dtype == np.float16)
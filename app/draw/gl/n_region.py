@@ -0,0 +1,101 @@
+import math
+
+
+def wrap_ranges(start, length, size):
+    """
+    Split cells [start, start + length) into ranges of the toroidal texture axis of the given size
+    :return: list of (texel start, offset in the source, length)
+    """
+    ranges = []
+    offset = 0
+    while offset < length:
+        texel = (start + offset) % size
+        count = min(length - offset, size - texel)
+        ranges.append((texel, offset, count))
+        offset += count
+    return ranges
+
+
+def region_difference(region, resident):
+    """
+    Parts of the region not covered by the resident region
+    Full height column strips on the left and right, row strips above and below in between
+    :return: list of (x1, y1, x2, y2) rectangles
+    """
+    x1, y1, x2, y2 = region
+    rx1, ry1, rx2, ry2 = resident
+    if rx1 >= x2 or rx2 <= x1 or ry1 >= y2 or ry2 <= y1:
+        return [region]
+    strips = []
+    if x1 < rx1:
+        strips.append((x1, y1, rx1, y2))
+    if rx2 < x2:
+        strips.append((rx2, y1, x2, y2))
+    middle_x1 = max(x1, rx1)
+    middle_x2 = min(x2, rx2)
+    if y1 < ry1:
+        strips.append((middle_x1, y1, middle_x2, ry1))
+    if ry2 < y2:
+        strips.append((middle_x1, ry2, middle_x2, y2))
+    return strips
+
+
+def details_factor(n_net, viewport, target_width, target_height):
+    """
+    Calculate the down sample factor
+    Factor is used to reduce the vertices count or texture quality
+    If the zoom level is very small large amount of data could be visible inside small screen bounds
+    Rendering everything without down sampling will cause issues and very low fps
+
+    Compare screen space bounds with world grid bounds
+    Factor is always a power of two matching one of the NNet pyramid levels
+    :param viewport: (x, y, w, h, zoom) in world coordinates
+    :param target_width: window width in pixels
+    """
+    x, y, w, h, zoom = viewport
+    col_min, row_min, col_max, row_max = n_net.world_to_grid_position(x, y, x + w, y + h)
+    subgrid_width = col_max - col_min
+    subgrid_height = row_max - row_min
+
+    width_factor = max(subgrid_width / target_width, 0.1)
+    height_factor = max(subgrid_height / target_height, 0.1)
+    factor = math.ceil(min(width_factor, height_factor))
+    # Round up to the power of two, the chunks are then served from a single pyramid level without striding
+    return 2 ** math.ceil(math.log2(factor))
+
+
+def leaf_region(n_net, leaf, factor, max_width, max_height):
+    """
+    Cells covered by the leaf, the region is limited to the texture size
+    :return: (x1, y1, x2, y2) in cells of the factor
+    """
+    col_min, row_min, col_max, row_max = n_net.world_to_grid_position(leaf.x1, leaf.y1, leaf.x2, leaf.y2)
+    x1 = col_min // factor
+    y1 = row_min // factor
+    x2 = min(-(-col_max // factor), x1 + max_width)
+    y2 = min(-(-row_max // factor), y1 + max_height)
+    return x1, y1, x2, y2
+
+
+def resident_strips(region, factor, resident_region, resident_factor):
+    """
+    Cells of the region which are not resident yet, everything when the details factor changed
+    :return: list of (x1, y1, x2, y2) strips, some of them may be empty
+    """
+    if resident_region is None or factor != resident_factor:
+        return [region]
+    return region_difference(region, resident_region)
+
+
+def dirty_strips(regions, resident_region, factor):
+    """
+    Resident cells covering the changed grid regions
+    :param regions: list of (col_min, row_min, col_max, row_max) grid regions
+    :return: list of (x1, y1, x2, y2) strips, some of them may be empty
+    """
+    resident_x1, resident_y1, resident_x2, resident_y2 = resident_region
+    strips = []
+    for col_min, row_min, col_max, row_max in regions:
+        strips.append((max(col_min // factor, resident_x1), max(row_min // factor, resident_y1),
+                       min(-(-col_max // factor), resident_x2), min(-(-row_max // factor), resident_y2)))
+    return strips
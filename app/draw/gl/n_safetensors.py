@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# safetensors dtype -> numpy dtype used to view the raw bytes
+# numpy has no bfloat16, BF16 payload is viewed as uint16 and decoded after slicing
+DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "BF16": np.uint16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I16": np.int16,
+    "I8": np.int8,
+    "U8": np.uint8,
+    "BOOL": np.bool_
+}
+
+DTYPE_NAMES = {
+    "BF16": "bfloat16"
+}
+
+# Bytes of every sampled block of the checkpoint fingerprint
+FINGERPRINT_BLOCK = 4096
+
+
+class SafetensorsTensor:
+    def __init__(self, name, dtype, shape, path, offset, nbytes):
+        self.name = name
+        self.dtype = dtype
+        self.shape = shape
+        self.path = path
+        self.offset = offset  # absolute offset of the tensor data in the file
+        self.nbytes = nbytes
+        self.data = None  # memory mapped view, no page is read until sliced
+
+    def read(self):
+        """
+        Read the tensor data into memory, used by lazily loaded layers instead of the memory mapped view
+        """
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = np.fromfile(f, dtype=DTYPES[self.dtype], count=self.nbytes // np.dtype(DTYPES[self.dtype]).itemsize)
+        return data.reshape(self.shape)
+
+    def dtype_name(self):
+        return DTYPE_NAMES.get(self.dtype, np.dtype(DTYPES[self.dtype]).name)
+
+    def __repr__(self):
+        return f"{self.name} {self.dtype} {self.shape}"
+
+
+def natural_key(name):
+    # model.layers.2 before model.layers.10
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def read_header(path):
+    """
+    Read only the json header of a safetensors file
+    File layout: 8 bytes little endian header size, json header, tensors data
+    :return: list of SafetensorsTensor
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    data_start = 8 + header_size
+    tensors = []
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = info["dtype"]
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported safetensors dtype {dtype} of tensor {name} in {path}")
+        begin, end = info["data_offsets"]
+        tensors.append(SafetensorsTensor(name, dtype, tuple(info["shape"]), path, data_start + begin, end - begin))
+    return tensors
+
+
+def map_file(path):
+    """
+    Index a single safetensors file and attach memory mapped views to its tensors
+    """
+    tensors = read_header(path)
+    if len(tensors) == 0:
+        return tensors
+    file_map = np.memmap(path, dtype=np.uint8, mode="r")
+    for tensor in tensors:
+        raw = file_map[tensor.offset:tensor.offset + tensor.nbytes]
+        tensor.data = raw.view(DTYPES[tensor.dtype]).reshape(tensor.shape)
+    return tensors
+
+
+def list_files(paths):
+    """
+    :param paths: safetensors file path, directory or list of them
+    :return: sorted safetensors file paths
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, f) for f in os.listdir(path) if f.endswith(".safetensors")]
+        else:
+            files.append(path)
+    if len(files) == 0:
+        raise ValueError(f"No safetensors files found in {paths}")
+    return sorted(files)
+
+
+def checkpoint_fingerprint(paths):
+    """
+    Content key of a checkpoint, identifies the data derived from it (tile store, tile statistics)
+    Covers the files absolute paths, sizes, modification times, headers and sampled blocks of every tensor
+    (start, middle and end), a few KB are read per tensor instead of the whole checkpoint
+    """
+    digest = hashlib.sha256()
+    for path in list_files(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        tensors = read_header(path)
+        with open(path, "rb") as f:
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            digest.update(f.read(header_size))
+            for tensor in tensors:
+                middle = tensor.offset + tensor.nbytes // 2
+                end = tensor.offset + tensor.nbytes
+                for start in [tensor.offset, middle, end - FINGERPRINT_BLOCK]:
+                    start = max(start, tensor.offset)
+                    f.seek(start)
+                    digest.update(f.read(min(FINGERPRINT_BLOCK, end - start)))
+    return digest.hexdigest()[:32]
+
+
+def index_safetensors(paths, workers=8):
+    """
+    Index safetensors checkpoint, sharded checkpoints (model-0000x-of-0000y) are indexed in parallel
+    :param paths: safetensors file paths or a directory containing them
+    :return: memory mapped tensors sorted by name
+    """
+    files = list_files(paths)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files)))) as executor:
+        tensors = [t for file_tensors in executor.map(map_file, files) for t in file_tensors]
+    tensors.sort(key=lambda t: natural_key(t.name))
+    return tensors
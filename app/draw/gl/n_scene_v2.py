@@ -6,7 +6,11 @@ import numpy as np
 from memory_profiler import profile
 
 from app.draw.gl.draw.n_entity import NEntity
+from app.draw.gl.draw.n_texture import texture_formats
+from app.draw.gl.n_alloc_tracker import alloc_tracker
 from app.draw.gl.n_lod import LodType
+from app.draw.gl.n_profiler import profiled, profiler
+from app.draw.gl.n_region import details_factor, dirty_strips, leaf_region, resident_strips, wrap_ranges
 import OpenGL.GL as gl
 
 
@@ -101,6 +105,8 @@ class EntityV2:
 
         self.empty_img = None
         self.created = False
+        self.internal_format = gl.GL_R32F
+        self.pixel_type = gl.GL_FLOAT
 
         self.width = 0
         self.height = 0
@@ -108,18 +114,24 @@ class EntityV2:
         self.radius = 0.06
         self.num_segments = 20
 
-    def create_data_container_texture(self, width, height):
+    def create_data_container_texture(self, width, height, dtype=np.float32):
         self.texture = gl.glGenTextures(1)
         self.width = width
         self.height = height
-        self.empty_img = np.empty((self.width, self.height), dtype=np.float32)
+        self.internal_format, self.pixel_type = texture_formats(dtype)
+        # Flat, so a zeroed block of any size is a contiguous prefix
+        self.empty_img = np.zeros(self.width * self.height, dtype=dtype)
         self.num_instances = self.width * self.height
 
         gl.glActiveTexture(gl.GL_TEXTURE1)
         gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
-        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R32F, self.width, self.height, 0, gl.GL_RED, gl.GL_FLOAT, None)
-        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        # Rows of float16 and 8 bit chunks are not 4 bytes aligned
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, self.internal_format, self.width, self.height, 0, gl.GL_RED,
+                        self.pixel_type, None)
+        # Cell (x, y) is stored in texel (x mod width, y mod height), the quad samples across the texture edges
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_REPEAT)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_REPEAT)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
         error = gl.glGetError()
@@ -155,18 +167,38 @@ class EntityV2:
 
         self.created = True
 
-    def update_data(self, chunks, dimensions):
+    def clear_cells(self, x1, y1, x2, y2):
+        """
+        Zero the texels of the cells, previous content of the wrapped texels belongs to cells out of the region
+        """
         if not self.created:
             return
-        start_time = time.time()
-        # print("update texture data", self.width, self.height, self.num_instances, width, height)
-        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, self.width, self.height, gl.GL_RED, gl.GL_FLOAT, self.empty_img)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        for texel_y, _, rows in wrap_ranges(y1, y2 - y1, self.height):
+            for texel_x, _, columns in wrap_ranges(x1, x2 - x1, self.width):
+                gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, texel_x, texel_y, columns, rows, gl.GL_RED, self.pixel_type,
+                                   self.empty_img[:rows * columns])
+
+    def upload_cells(self, chunks, dimensions):
+        """
+        Upload chunks to the texels of their cells, chunks crossing the texture edge are split
+        :param dimensions: (x1, y1, x2, y2) of the chunks in cells
+        :return: count of uploaded values
+        """
+        if not self.created:
+            return 0
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        uploaded = 0
         for c, d in zip(chunks, dimensions):
             cx1, cy1, cx2, cy2 = d
-            # print(d)
-            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, cx1, cy1, cx2 - cx1, cy2 - cy1, gl.GL_RED, gl.GL_FLOAT, c)
-
-        # print("Texture updated", time.time() - start_time)
+            c = c.reshape(cy2 - cy1, cx2 - cx1)
+            for texel_y, source_y, rows in wrap_ranges(cy1, cy2 - cy1, self.height):
+                for texel_x, source_x, columns in wrap_ranges(cx1, cx2 - cx1, self.width):
+                    piece = c[source_y:source_y + rows, source_x:source_x + columns]
+                    gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, texel_x, texel_y, columns, rows, gl.GL_RED,
+                                       self.pixel_type, np.ascontiguousarray(piece))
+            uploaded += c.size
+        return uploaded
 
     def draw_points(self, count):
         if not self.created:
@@ -207,34 +239,20 @@ class NSceneV2:
         self.quad = Quad()
         self.texture = EntityV2()
         self.current_size = 0
+        # Cells (x1, y1, x2, y2) resident in the texture and their details factor
+        self.resident_region = None
+        self.resident_factor = None
+        # NNet values version of the resident cells
+        self.values_version = 0
 
     def get_details_factor(self):
         """
-        Calculate the down sample factor
-        Factor is used to reduce the vertices count or texture quality
-        If the zoom level is very small large amount of data could be visible inside small screen bounds
-        Rendering everything without down sampling will cause issues and very low fps
-
-        Compare screen space bounds with world grid bounds
+        Down sample factor of the current viewport, see n_region.details_factor
         """
-        x, y, w, h, zoom = self.n_window.viewport_to_world_cords()
-        col_min, row_min, col_max, row_max = self.n_net.world_to_grid_position(x, y, x + w, y + h)
-        subgrid_width = col_max - col_min
-        subgrid_height = row_max - row_min
-
-        target_width = self.n_window.width
-        target_height = self.n_window.height
-
-        width_factor = max(subgrid_width / target_width, 0.1)
-        height_factor = max(subgrid_height / target_height, 0.1)
-        # print("dw", subgrid_width, "dh", subgrid_height)
-        # print("tw", target_width, "th", target_height)
-        # print("factor", width_factor, height_factor)
-        # # print("total count", int(target_height*target_width))
-        factor = min(width_factor, height_factor)
-        return math.ceil(factor)
-
-    # @profile
+        return details_factor(self.n_net, self.n_window.viewport_to_world_cords(), self.n_window.width,
+                              self.n_window.height)
+
+    @profiled("scene update")
     def update_scene_entities(self):
 
         if self.n_tree.mega_leaf is None:
@@ -250,23 +268,78 @@ class NSceneV2:
             self.current_details_level = details_level
             should_update = True
 
+        if self.n_net.values_version != self.values_version:
+            # Values changed (normalization applied), resident cells are stale
+            self.values_version = self.n_net.values_version
+            self.resident_region = None
+            should_update = True
+
+        # Regions changed by a live training run, a full update reloads them anyway
+        dirty_regions = self.n_net.pop_dirty_regions()
         if should_update:
             self.current_size = int(self.mega_leaf.w * self.mega_leaf.h)
-            chunks, dimensions, width, height = self.n_net.get_subgrid_chunks_grid_dimensions(
-                self.mega_leaf.x1,
-                self.mega_leaf.y1,
-                self.mega_leaf.x2,
-                self.mega_leaf.y2,
-                self.current_details_level)
-            self.quad.update_quad_position(
-                0,
-                0,
-                self.current_width,
-                self.current_height,
-            )
-            self.texture.update_data(
-                chunks,
-                dimensions)
+            self.update_resident_region(self.get_region(self.mega_leaf, self.current_details_level),
+                                        self.current_details_level)
+        elif len(dirty_regions) > 0 and self.resident_region is not None:
+            self.update_dirty_regions(dirty_regions)
+
+    def get_region(self, leaf, factor):
+        """
+        Cells covered by the leaf, the region is limited to the texture size
+        """
+        return leaf_region(self.n_net, leaf, factor, self.texture.width, self.texture.height)
+
+    def update_resident_region(self, region, factor):
+        """
+        Upload only the cells of the region which are not resident yet
+        Texture is addressed toroidally, so cells kept from the previous region stay in their texels
+        and a pan costs uploads proportional to the pan distance
+        """
+        start_time = time.time()
+        strips = resident_strips(region, factor, self.resident_region, self.resident_factor)
+        uploaded = self.upload_strips(strips, factor)
+        self.resident_region = region
+        self.resident_factor = factor
+        x1, y1, x2, y2 = region
+        self.quad.update_quad_position(0, 0, x2 - x1, y2 - y1)
+        print("Texture updated", (time.time() - start_time) * 1000, "ms", "strips:", len(strips), "values:", uploaded)
+
+    def upload_strips(self, strips, factor):
+        """
+        :return: count of uploaded values
+        """
+        uploaded = 0
+        for strip in strips:
+            x1, y1, x2, y2 = strip
+            if x2 <= x1 or y2 <= y1:
+                continue
+            with profiler.span("texture clear"):
+                self.texture.clear_cells(x1, y1, x2, y2)
+            chunks, dimensions = self.n_net.get_region_chunks(x1, y1, x2, y2, factor)
+            with profiler.span("texture upload"), alloc_tracker.stage("texture upload"):
+                uploaded += self.texture.upload_cells(chunks, dimensions)
+        return uploaded
+
+    def update_dirty_regions(self, regions):
+        """
+        Upload again the resident cells covering the changed grid regions
+        """
+        start_time = time.time()
+        factor = self.resident_factor
+        strips = dirty_strips(regions, self.resident_region, factor)
+        uploaded = self.upload_strips(strips, factor)
+        print("Dirty regions updated", (time.time() - start_time) * 1000, "ms", "regions:", len(regions),
+              "values:", uploaded)
+
+    def get_region_origin(self):
+        """
+        :return: world position of the first resident cell and its texel
+        """
+        x1, y1, x2, y2 = self.resident_region
+        factor = self.resident_factor
+        world_x = x1 * factor * self.n_net.node_gap_x
+        world_y = y1 * factor * self.n_net.node_gap_y
+        return world_x, world_y, x1 % self.texture.width, y1 % self.texture.height
 
     def draw_scene(self,
                    n_points_shader,
@@ -282,7 +355,8 @@ class NSceneV2:
             self.current_height = self.n_window.height * 2
             self.texture.create_data_container_texture(
                 self.current_width,
-                self.current_height
+                self.current_height,
+                self.n_net.upload_dtype()
             )
         if not self.quad.created:
             self.quad.create_quad()
@@ -290,9 +364,15 @@ class NSceneV2:
         # Update
         self.update_scene_entities()
 
+        if self.resident_region is None:
+            return
         leaf_w = int(self.mega_leaf.w / 0.2)
         leaf_h = int(self.mega_leaf.h / 0.2)
         size = leaf_w * leaf_h
+        x1, y1, x2, y2 = self.resident_region
+        region_w = x2 - x1
+        region_h = y2 - y1
+        world_x, world_y, texel_x, texel_y = self.get_region_origin()
 
         max_points_count = 1000000
         max_nodes_count = 500000
@@ -301,18 +381,24 @@ class NSceneV2:
             n_color_map_v2_texture_shader.use()
             n_color_map_v2_texture_shader.update_texture_width(self.current_width)
             n_color_map_v2_texture_shader.update_texture_height(self.current_height)
-            n_color_map_v2_texture_shader.update_position_offset(self.mega_leaf.x1, self.mega_leaf.y1)
+            n_color_map_v2_texture_shader.update_position_offset(world_x, world_y)
+            n_color_map_v2_texture_shader.update_texture_offset(texel_x, texel_y)
             n_color_map_v2_texture_shader.update_details_factor(self.current_details_level)
+            n_color_map_v2_texture_shader.update_value_scale(*self.n_net.get_value_scale())
+            n_color_map_v2_texture_shader.update_color_transfer(*self.n_net.get_color_transfer())
             self.quad.draw()
         else:
             n_instances_from_texture_shader.use()
             n_instances_from_texture_shader.update_texture_width(self.current_width)
             n_instances_from_texture_shader.update_texture_height(self.current_height)
-            n_instances_from_texture_shader.update_target_width(leaf_w)
-            n_instances_from_texture_shader.update_target_height(leaf_h)
-            n_instances_from_texture_shader.update_position_offset(self.mega_leaf.x1, self.mega_leaf.y1)
+            n_instances_from_texture_shader.update_target_width(region_w)
+            n_instances_from_texture_shader.update_target_height(region_h)
+            n_instances_from_texture_shader.update_position_offset(world_x, world_y)
+            n_instances_from_texture_shader.update_texture_offset(texel_x, texel_y)
             n_instances_from_texture_shader.update_details_factor(self.current_details_level)
+            n_instances_from_texture_shader.update_value_scale(*self.n_net.get_value_scale())
+            n_instances_from_texture_shader.update_color_transfer(*self.n_net.get_color_transfer())
             if size < max_nodes_count:
-                self.texture.draw_nodes(size, 1)
+                self.texture.draw_nodes(region_w * region_h, 1)
             elif size < max_points_count:
-                self.texture.draw_points(size)
+                self.texture.draw_points(region_w * region_h)
@@ -0,0 +1,140 @@
+import numpy as np
+
+from app.draw.gl.n_stats import NTileStats
+
+METRICS = ["abs", "max", "min"]
+
+
+def tile_bounds(stats, metric):
+    """
+    Upper bound of the metric of every tile of the layer
+    """
+    if metric == "abs":
+        bounds = stats.abs_max
+    elif metric == "max":
+        bounds = stats.max
+    else:
+        bounds = -stats.min
+    # Tiles with NaN statistics are not pruned
+    return np.nan_to_num(bounds.astype(np.float64), nan=np.inf)
+
+
+def metric_scores(values, metric):
+    if metric == "abs":
+        scores = np.abs(values)
+    elif metric == "max":
+        scores = values
+    else:
+        scores = -values
+    return np.where(np.isnan(scores), -np.inf, scores)
+
+
+class NTopKSearch:
+    """
+    Top k values of all layers by magnitude, maximum or minimum
+    Tiles are visited from the highest statistics bound down, a tile is read only while its bound can still beat
+    the k-th best value found so far. Outliers are found reading a small part of the model.
+    Tiles are read through Layer.tiles_reader, lazy layers are not loaded into the layers cache.
+    """
+
+    def __init__(self, layers, k, metric="abs", map_func=None, batch_size=16):
+        """
+        :param map_func: map(func, items) used to search the tiles of a batch, Grid.map_layers runs them on its workers
+        :param batch_size: tiles searched between the pruning checks
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}, expected one of {METRICS}")
+        self.layers = layers
+        self.k = k
+        self.metric = metric
+        self.map_func = map_func if map_func is not None else lambda func, items: [func(i) for i in items]
+        self.batch_size = batch_size
+        self.threshold = -np.inf
+        # Layer index -> Layer.tiles_reader, created for the layers the search visits
+        self.readers = {}
+        self.tiles_read = 0
+        self.tiles_count = 0
+
+    def ensure_stats(self):
+        """
+        Layers without statistics (background pass not finished or disabled) get them computed now
+        """
+        for layer in self.layers:
+            if layer.stats is None:
+                stats = NTileStats(layer.shape)
+                stats.compute(layer.tiles_reader(), layer.decode, layer.fill_value)
+                layer.stats = stats
+
+    def search(self):
+        """
+        :return: list of (score, value, layer index, row, column) sorted by score, best first
+        """
+        self.ensure_stats()
+        bounds = []
+        tiles = []
+        for layer_index, layer in enumerate(self.layers):
+            stats = layer.stats
+            valid = stats.count.reshape(-1) > 0
+            tile_indices = np.flatnonzero(valid)
+            bounds.append(tile_bounds(stats, self.metric).reshape(-1)[valid])
+            tiles.append(np.stack((np.full(len(tile_indices), layer_index), tile_indices), axis=1))
+        if len(bounds) == 0 or self.k <= 0:
+            return []
+        bounds = np.concatenate(bounds)
+        tiles = np.concatenate(tiles)
+        order = np.argsort(-bounds, kind="stable")
+        self.tiles_count = len(order)
+
+        scores = np.empty(0, dtype=np.float64)
+        values = np.empty(0, dtype=np.float64)
+        positions = np.empty((0, 3), dtype=np.int64)
+        for start in range(0, len(order), self.batch_size):
+            if len(scores) >= self.k and bounds[order[start]] < self.threshold:
+                break
+            batch = order[start:start + self.batch_size]
+            for layer_index in np.unique(tiles[batch, 0]).tolist():
+                if layer_index not in self.readers:
+                    self.readers[layer_index] = self.layers[layer_index].tiles_reader()
+            results = self.map_func(lambda tile: self.search_tile(*tile), tiles[batch].tolist())
+            self.tiles_read += len(batch)
+            scores = np.concatenate([scores] + [r[0] for r in results])
+            values = np.concatenate([values] + [r[1] for r in results])
+            positions = np.concatenate([positions] + [r[2] for r in results])
+            if len(scores) > self.k:
+                best = np.argpartition(-scores, self.k - 1)[:self.k]
+                scores = scores[best]
+                values = values[best]
+                positions = positions[best]
+            if len(scores) >= self.k:
+                self.threshold = scores.min()
+        ranking = np.argsort(-scores, kind="stable")
+        return [(float(scores[i]), float(values[i])) + tuple(positions[i].tolist()) for i in ranking]
+
+    def search_tile(self, layer_index, tile_index):
+        """
+        :return: best k scores of the tile above the current threshold, their decoded values and
+        (layer index, row, column)
+        """
+        layer = self.layers[layer_index]
+        stats = layer.stats
+        tile_row, tile_column = np.unravel_index(tile_index, stats.tiles_shape) if len(stats.tiles_shape) > 1 \
+            else (tile_index, 0)
+        row_start = tile_row * stats.tile_size
+        column_start = tile_column * stats.tile_size
+        values = layer.decode(self.readers[layer_index](row_start, row_start + stats.tile_size,
+                                                        column_start, column_start + stats.tile_size))
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        scores = metric_scores(values, self.metric)
+        if layer.fill_value is not None:
+            scores[values == layer.fill_value] = -np.inf
+        scores = scores.reshape(-1)
+        if scores.size > self.k:
+            candidates = np.argpartition(-scores, self.k - 1)[:self.k]
+        else:
+            candidates = np.arange(scores.size)
+        candidates = candidates[scores[candidates] > self.threshold]
+        rows, columns = np.unravel_index(candidates, values.shape)
+        positions = np.stack((np.full(len(candidates), layer_index), rows + row_start, columns + column_start), axis=1)
+        return (scores[candidates].astype(np.float64), values[rows, columns].astype(np.float64),
+                positions.astype(np.int64))
@@ -0,0 +1,414 @@
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.draw.gl.n_tiles import TILE_SIZE
+
+STATS_FIELDS = ["min", "max", "mean", "std", "abs_max", "count"]
+# Index file name, saved next to the checkpoint or in the tile store directory
+STATS_FILE = "tensorgrid_stats.npz"
+# Tiles histograms share the bins edges spanning the values of all layers, so they can be merged
+HISTOGRAM_BINS = 64
+
+
+class NTileStats:
+    """
+    Summary statistics of every tile of one layer
+    Struct of arrays, every field is a (tiles rows, tiles columns) array
+    1D data uses tiles of TILE_SIZE * TILE_SIZE values, like TiledArray
+    """
+
+    def __init__(self, shape, tile_size=TILE_SIZE):
+        self.shape = tuple(shape)
+        self.tile_size = tile_size if len(self.shape) > 1 else tile_size * tile_size
+        self.tiles_shape = tuple(-(-dim // self.tile_size) for dim in self.shape)
+        self.min = np.zeros(self.tiles_shape, dtype=np.float32)
+        self.max = np.zeros(self.tiles_shape, dtype=np.float32)
+        self.mean = np.zeros(self.tiles_shape, dtype=np.float32)
+        self.std = np.zeros(self.tiles_shape, dtype=np.float32)
+        self.abs_max = np.zeros(self.tiles_shape, dtype=np.float32)
+        self.count = np.zeros(self.tiles_shape, dtype=np.int64)
+        # (tiles rows, tiles columns, bins) values counts and the bins edges, see compute_histogram
+        self.histogram = None
+        self.edges = None
+        # Summed area tables of the tiles sums, squares sums, counts and histograms, see build_tables
+        self.tables = None
+
+    def compute(self, read, decode, fill_value=None):
+        """
+        Streamed tile by tile, only one tile is read and decoded at a time
+        :param read: function (row_start, row_end, column_start, column_end) returning raw data,
+        see Layer.tiles_reader
+        :param fill_value: padding value of folded layers, excluded from the statistics
+        """
+        for tile_index, tile in self.tiles(read, decode, fill_value):
+            self.set_tile(tile_index, tile)
+
+    def compute_histogram(self, read, decode, edges, fill_value=None):
+        self.edges = edges
+        self.histogram = np.zeros(self.tiles_shape + (len(edges) - 1,), dtype=np.int64)
+        for tile_index, tile in self.tiles(read, decode, fill_value):
+            self.histogram[tile_index] = np.histogram(tile, edges)[0]
+
+    def update(self, read, decode, row_start, row_end, column_start=0, column_end=1, fill_value=None):
+        """
+        Compute again the tiles overlapping the changed region [row_start, row_end) x [column_start, column_end)
+        The histograms keep their bins edges, values outside of them are not counted
+        """
+        tiles_range = [range(row_start // self.tile_size, -(-row_end // self.tile_size))]
+        if len(self.tiles_shape) > 1:
+            tiles_range.append(range(column_start // self.tile_size, -(-column_end // self.tile_size)))
+        for tile_index, tile in self.tiles(read, decode, fill_value, tiles_range):
+            self.set_tile(tile_index, tile)
+            if self.histogram is not None:
+                self.histogram[tile_index] = np.histogram(tile, self.edges)[0]
+        if self.tables is not None:
+            self.build_tables()
+
+    def tiles(self, read, decode, fill_value=None, tiles_range=None):
+        """
+        :param tiles_range: range of tile rows (and tile columns) to read, all tiles by default
+        :return: generator of tile index and decoded values of the tile without the padding
+        """
+        if tiles_range is None:
+            tiles_range = [range(dim) for dim in self.tiles_shape]
+        for tile_index in itertools.product(*tiles_range):
+            row = tile_index[0] * self.tile_size
+            column = tile_index[1] * self.tile_size if len(self.tiles_shape) > 1 else 0
+            tile = decode(read(row, row + self.tile_size, column, column + self.tile_size))
+            if fill_value is not None:
+                tile = tile[tile != fill_value]
+            yield tile_index, tile
+
+    def build_tables(self):
+        """
+        Summed area tables over the tiles, sum of any block of tiles costs 4 lookups
+        Tables have an extra leading zero row (and column) per axis
+        """
+        count = self.count.astype(np.float64)
+        mean = self.mean.astype(np.float64)
+        std = self.std.astype(np.float64)
+        arrays = {
+            "sum": mean * count,
+            "sumsq": (std * std + mean * mean) * count,
+            "count": self.count,
+            "histogram": self.histogram
+        }
+        tables = {}
+        for name, array in arrays.items():
+            table = np.zeros(tuple(dim + 1 for dim in self.tiles_shape) + array.shape[len(self.tiles_shape):],
+                             dtype=array.dtype)
+            for axis in range(len(self.tiles_shape)):
+                array = array.cumsum(axis=axis)
+            table[(slice(1, None),) * len(self.tiles_shape)] = array
+            tables[name] = table
+        self.tables = tables
+
+    def block_sum(self, name, tile_row_start, tile_row_end, tile_column_start=0, tile_column_end=1):
+        table = self.tables[name]
+        if len(self.tiles_shape) == 1:
+            return table[tile_row_end] - table[tile_row_start]
+        return (table[tile_row_end, tile_column_end] - table[tile_row_start, tile_column_end] -
+                table[tile_row_end, tile_column_start] + table[tile_row_start, tile_column_start])
+
+    def add_region(self, region_stats, data, decode, row_start, row_end, column_start=0, column_end=1,
+                   fill_value=None):
+        """
+        Add the values of the region [row_start, row_end) x [column_start, column_end) to the region statistics
+        Tiles fully inside the region are summed from the tables, only the border tiles are read
+        """
+        rows = self.shape[0]
+        columns = self.shape[1] if len(self.shape) > 1 else 1
+        tile_size = self.tile_size
+        # Tiles fully covered, the last tile of the layer may be shorter than the tile size
+        tile_row_start = -(-row_start // tile_size)
+        tile_row_end = self.tiles_shape[0] if row_end >= rows else row_end // tile_size
+        if len(self.shape) > 1:
+            tile_column_start = -(-column_start // tile_size)
+            tile_column_end = self.tiles_shape[1] if column_end >= columns else column_end // tile_size
+        else:
+            tile_column_start, tile_column_end = 0, 1
+        if tile_row_end > tile_row_start and tile_column_end > tile_column_start:
+            block = (tile_row_start, tile_row_end, tile_column_start, tile_column_end)
+            key = (slice(tile_row_start, tile_row_end),)
+            if len(self.shape) > 1:
+                key += (slice(tile_column_start, tile_column_end),)
+            valid = self.count[key] > 0
+            if valid.any():
+                region_stats.add_block(self.block_sum("count", *block), self.block_sum("sum", *block),
+                                       self.block_sum("sumsq", *block), self.min[key][valid].min(),
+                                       self.max[key][valid].max(), self.block_sum("histogram", *block))
+            inner_row_start = tile_row_start * tile_size
+            inner_row_end = min(tile_row_end * tile_size, rows)
+            inner_column_start = tile_column_start * tile_size
+            inner_column_end = min(tile_column_end * tile_size, columns)
+            borders = [(row_start, inner_row_start, column_start, column_end),
+                       (inner_row_end, row_end, column_start, column_end),
+                       (inner_row_start, inner_row_end, column_start, inner_column_start),
+                       (inner_row_start, inner_row_end, inner_column_end, column_end)]
+        else:
+            borders = [(row_start, row_end, column_start, column_end)]
+        for border_row_start, border_row_end, border_column_start, border_column_end in borders:
+            if border_row_end <= border_row_start or border_column_end <= border_column_start:
+                continue
+            if data.ndim == 1:
+                values = data[border_row_start:border_row_end]
+            else:
+                values = data[border_row_start:border_row_end, border_column_start:border_column_end]
+            region_stats.add_values(decode(values), fill_value)
+
+    def set_tile(self, tile_index, tile):
+        self.count[tile_index] = tile.size
+        if tile.size == 0:
+            return
+        low = tile.min()
+        high = tile.max()
+        self.min[tile_index] = low
+        self.max[tile_index] = high
+        self.mean[tile_index] = tile.mean(dtype=np.float64)
+        self.std[tile_index] = tile.std(dtype=np.float64)
+        self.abs_max[tile_index] = max(-low, high)
+
+    def constant_value(self, row_start, row_end, column_start=0, column_end=1):
+        """
+        :return: the value of the region [row_start, row_end) x [column_start, column_end) if all its tiles
+        are constant with the same value, otherwise None
+        """
+        rows = slice(row_start // self.tile_size, -(-row_end // self.tile_size))
+        # Values of the covered tiles, tiles with padding excluded from the statistics are not constant
+        area = self.tiles_extent(rows, 0)
+        if len(self.shape) == 1:
+            low = self.min[rows]
+            high = self.max[rows]
+            count = self.count[rows]
+        else:
+            columns = slice(column_start // self.tile_size, -(-column_end // self.tile_size))
+            area *= self.tiles_extent(columns, 1)
+            low = self.min[rows, columns]
+            high = self.max[rows, columns]
+            count = self.count[rows, columns]
+        if low.size == 0 or count.sum() != area:
+            return None
+        value = low.flat[0]
+        if np.all(low == value) and np.all(high == value):
+            return float(value)
+        return None
+
+    def tiles_extent(self, tiles, axis):
+        """
+        :return: values count of the tiles range along the axis
+        """
+        return max(min(tiles.stop * self.tile_size, self.shape[axis]) - tiles.start * self.tile_size, 0)
+
+    def summary(self):
+        """
+        Layer statistics combined from the tiles
+        :return: min, max, mean, std, abs_max
+        """
+        count = self.count.sum()
+        if count == 0:
+            return 0.0, 0.0, 0.0, 0.0, 0.0
+        weights = self.count / count
+        mean = float((self.mean * weights).sum())
+        variance = float(((self.std.astype(np.float64) ** 2 + self.mean.astype(np.float64) ** 2) * weights).sum())
+        std = max(variance - mean * mean, 0.0) ** 0.5
+        valid = self.count > 0
+        return (float(self.min[valid].min()), float(self.max[valid].max()), mean, std,
+                float(self.abs_max[valid].max()))
+
+    def normalization(self, deviations=3.0):
+        """
+        Scale and offset mapping mean +- deviations * std of the layer to [0, 1]
+        """
+        low, high, mean, std, abs_max = self.summary()
+        spread = 2 * deviations * std
+        if spread <= 0:
+            spread = 2 * abs_max if abs_max > 0 else 1.0
+        scale = 1.0 / spread
+        return scale, 0.5 - mean * scale
+
+
+class NRegionStats:
+    """
+    Statistics of a region merged from blocks of tiles and values read from the border tiles
+    """
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = np.zeros(len(edges) - 1, dtype=np.int64)
+
+    def add_block(self, count, values_sum, values_sumsq, low, high, histogram):
+        self.count += int(count)
+        self.sum += float(values_sum)
+        self.sumsq += float(values_sumsq)
+        self.min = min(self.min, float(low))
+        self.max = max(self.max, float(high))
+        self.histogram += histogram
+
+    def add_values(self, values, fill_value=None):
+        values = values.reshape(-1)
+        if fill_value is not None:
+            values = values[values != fill_value]
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.add_block(values.size, values.sum(dtype=np.float64), np.square(values, dtype=np.float64).sum(),
+                       values.min(), values.max(), np.histogram(values, self.edges)[0])
+
+    def result(self):
+        """
+        :return: dictionary of count, mean, std, variance, min, max, histogram and its bins edges
+        """
+        mean = self.sum / self.count if self.count > 0 else 0.0
+        variance = max(self.sumsq / self.count - mean * mean, 0.0) if self.count > 0 else 0.0
+        return {
+            "count": self.count,
+            "mean": mean,
+            "std": variance ** 0.5,
+            "variance": variance,
+            "min": self.min if self.count > 0 else 0.0,
+            "max": self.max if self.count > 0 else 0.0,
+            "histogram": self.histogram,
+            "edges": self.edges
+        }
+
+
+class NStatsIndex:
+    """
+    Per tile statistics of all layers, computed in a background thread layer after layer
+    The index is persisted as a .npz file, it holds one flat array per field with the tiles of all layers
+    and is reused when the checkpoint fingerprint and the layers names, shapes and types match.
+    """
+
+    def __init__(self, layers, path=None, tile_size=TILE_SIZE, on_ready=None, fingerprint=None):
+        """
+        :param path: .npz file, None to keep the index in memory only
+        :param on_ready: called from the background thread when all layers have statistics
+        :param fingerprint: content key of the checkpoint (n_safetensors.checkpoint_fingerprint)
+        """
+        self.layers = layers
+        self.path = path
+        self.fingerprint = fingerprint if fingerprint is not None else ""
+        self.tile_size = tile_size
+        self.on_ready = on_ready
+        self.ready = False
+        self.stopped = False
+        self.thread = None
+        # Bins edges of the tiles histograms
+        self.edges = None
+
+    def layers_keys(self):
+        return np.array([f"{l.name}|{l.shape}|{l.dtype}" for l in self.layers])
+
+    def start(self):
+        if self.path is not None and os.path.exists(self.path) and self.load(self.path):
+            print("Tile statistics loaded", self.path)
+            self.finish()
+            return
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        start_time = time.time()
+        for index, layer in enumerate(self.layers):
+            if self.stopped:
+                return
+            stats = NTileStats(layer.shape, self.tile_size)
+            stats.compute(layer.tiles_reader(), layer.decode, layer.fill_value)
+            layer.stats = stats
+        print("Tile statistics computed", time.time() - start_time, "s")
+        # Second pass, the histograms bins span the values range of all layers
+        self.edges = self.histogram_edges()
+        for layer in self.layers:
+            if self.stopped:
+                return
+            layer.stats.compute_histogram(layer.tiles_reader(), layer.decode, self.edges, layer.fill_value)
+            layer.stats.build_tables()
+        print("Tile histograms computed", time.time() - start_time, "s")
+        if self.path is not None:
+            self.save(self.path)
+        self.finish()
+
+    def histogram_edges(self, bins=HISTOGRAM_BINS):
+        low = np.inf
+        high = -np.inf
+        for layer in self.layers:
+            valid = layer.stats.count > 0
+            if valid.any():
+                low = min(low, float(np.nanmin(layer.stats.min[valid], initial=np.inf)))
+                high = max(high, float(np.nanmax(layer.stats.max[valid], initial=-np.inf)))
+        if not np.isfinite(low) or not np.isfinite(high):
+            low, high = 0.0, 1.0
+        if high <= low:
+            low, high = low - 0.5, high + 0.5
+        return np.linspace(low, high, bins + 1)
+
+    def finish(self):
+        self.ready = True
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def save(self, path):
+        arrays = {
+            "tile_size": np.array(self.tile_size),
+            "fingerprint": np.array(self.fingerprint),
+            "layers_keys": self.layers_keys(),
+            "tiles_counts": np.array([l.stats.min.size for l in self.layers], dtype=np.int64),
+            "edges": self.edges
+        }
+        for field in STATS_FIELDS:
+            arrays[field] = np.concatenate([getattr(l.stats, field).ravel() for l in self.layers])
+        arrays["histogram"] = np.concatenate([l.stats.histogram.reshape(-1, len(self.edges) - 1)
+                                              for l in self.layers])
+        # np.savez appends .npz to names without it
+        tmp_path = path[:-len(".npz")] + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        print("Tile statistics saved", path)
+
+    def load(self, path):
+        """
+        :return: False if the file belongs to another checkpoint, other layers or tile size
+        """
+        with np.load(path) as arrays:
+            if "histogram" not in arrays or "fingerprint" not in arrays or \
+                    str(arrays["fingerprint"]) != self.fingerprint or int(arrays["tile_size"]) != self.tile_size or \
+                    not np.array_equal(arrays["layers_keys"], self.layers_keys()):
+                print("Tile statistics of another checkpoint, computing them again", path)
+                return False
+            offsets = np.cumsum(np.concatenate(([0], arrays["tiles_counts"])))
+            fields = {field: arrays[field] for field in STATS_FIELDS + ["histogram"]}
+            self.edges = arrays["edges"]
+        for index, layer in enumerate(self.layers):
+            stats = NTileStats(layer.shape, self.tile_size)
+            for field in STATS_FIELDS + ["histogram"]:
+                values = fields[field][offsets[index]:offsets[index + 1]]
+                setattr(stats, field, values.reshape(stats.tiles_shape + values.shape[1:]))
+            stats.edges = self.edges
+            stats.build_tables()
+            layer.stats = stats
+        return True
+
+    def region_stats(self, regions):
+        """
+        :param regions: list of (layer, row_start, row_end, column_start, column_end) in the layers local cells
+        :return: statistics dictionary, see NRegionStats.result
+        """
+        region_stats = NRegionStats(self.edges)
+        for layer, row_start, row_end, column_start, column_end in regions:
+            layer.stats.add_region(region_stats, layer.layer_grid, layer.decode, row_start, row_end,
+                                   column_start, column_end, layer.fill_value)
+        return region_stats.result()
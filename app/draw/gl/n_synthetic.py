@@ -0,0 +1,101 @@
+import numpy as np
+
+from app.draw.gl.n_tiles import TILE_SIZE, TiledArray
+
+# Architectures of decoder only models, parameters count in the comment
+CONFIGS = {
+    # 1.1B
+    "tinyllama-1b": {"hidden": 2048, "intermediate": 5632, "layers": 22, "heads": 32, "kv_heads": 4,
+                     "vocabulary": 32000},
+    # 6.7B
+    "llama-7b": {"hidden": 4096, "intermediate": 11008, "layers": 32, "heads": 32, "kv_heads": 32,
+                 "vocabulary": 32000},
+    # 7.2B
+    "mistral-7b": {"hidden": 4096, "intermediate": 14336, "layers": 32, "heads": 32, "kv_heads": 8,
+                   "vocabulary": 32000},
+    # 69B
+    "llama-70b": {"hidden": 8192, "intermediate": 28672, "layers": 80, "heads": 64, "kv_heads": 8,
+                  "vocabulary": 32000},
+    # 406B
+    "llama-405b": {"hidden": 16384, "intermediate": 53248, "layers": 126, "heads": 128, "kv_heads": 8,
+                   "vocabulary": 128256}
+}
+
+# Standard deviation of the initialized weights, norm weights are centered at 1
+WEIGHT_STD = 0.02
+NORM_STD = 0.05
+
+
+def model_shapes(config):
+    """
+    Tensors of a LLaMA like model (Mistral has the same tensors), in the checkpoint order
+    :param config: name of CONFIGS or dictionary with the same keys
+    :return: list of (name, shape)
+    """
+    if isinstance(config, str):
+        config = CONFIGS[config]
+    hidden = config["hidden"]
+    intermediate = config["intermediate"]
+    kv = hidden // config["heads"] * config["kv_heads"]
+    shapes = [("model.embed_tokens.weight", (config["vocabulary"], hidden))]
+    for block in range(config["layers"]):
+        prefix = f"model.layers.{block}."
+        shapes += [
+            (prefix + "self_attn.q_proj.weight", (hidden, hidden)),
+            (prefix + "self_attn.k_proj.weight", (kv, hidden)),
+            (prefix + "self_attn.v_proj.weight", (kv, hidden)),
+            (prefix + "self_attn.o_proj.weight", (hidden, hidden)),
+            (prefix + "mlp.gate_proj.weight", (intermediate, hidden)),
+            (prefix + "mlp.up_proj.weight", (intermediate, hidden)),
+            (prefix + "mlp.down_proj.weight", (hidden, intermediate)),
+            (prefix + "input_layernorm.weight", (hidden,)),
+            (prefix + "post_attention_layernorm.weight", (hidden,)),
+        ]
+    shapes += [("model.norm.weight", (hidden,)), ("lm_head.weight", (config["vocabulary"], hidden))]
+    return shapes
+
+
+def parameters_count(config):
+    return sum(int(np.prod(shape)) for _, shape in model_shapes(config))
+
+
+def synthetic_tile_loader(shape, seed, layer_index, level, mean, std, tile_size):
+    """
+    Tiles of normally distributed values, every tile has its own generator seeded with
+    (seed, layer, level, tile row, tile column), so a tile has the same values whenever it is generated
+    """
+
+    def load_tile(tile_row, tile_column):
+        if len(shape) == 1:
+            length = tile_size * tile_size
+            tile_shape = (min(length, shape[0] - tile_row * length),)
+        else:
+            tile_shape = (min(tile_size, shape[0] - tile_row * tile_size),
+                          min(tile_size, shape[1] - tile_column * tile_size))
+        generator = np.random.default_rng([seed, layer_index, level, tile_row, tile_column])
+        return (generator.standard_normal(tile_shape, dtype=np.float32) * std + mean).astype(np.float32)
+
+    return load_tile
+
+
+def synthetic_levels(name, shape, layer_index, cache, levels_count, seed=0, tile_size=TILE_SIZE, aggregation="mean"):
+    """
+    Pyramid levels of a synthetic tensor, every level is a TiledArray generated on demand
+    Levels are generated directly instead of reduced from level 0, the mean of n values has the
+    standard deviation std / sqrt(n), a level k value is the mean of 4^k values of a 2D tensor and 2^k values
+    of a 1D tensor, so a zoomed out view costs the same as a zoomed in one
+    Only the mean aggregation has this closed form, the others are refused
+    :return: TiledArray for every pyramid level
+    """
+    if aggregation != "mean":
+        raise ValueError(f"Unsupported aggregation of synthetic levels: {aggregation}, expected mean")
+    mean, std = (1.0, NORM_STD) if len(shape) == 1 else (0.0, WEIGHT_STD)
+    levels = []
+    for level in range(levels_count + 1):
+        if level > 0 and max(shape) <= 1:
+            break
+        reduction = 2 ** (level * len(shape))
+        loader = synthetic_tile_loader(shape, seed, layer_index, level, mean, std / np.sqrt(reduction), tile_size)
+        levels.append(TiledArray(shape, np.float32, loader, cache, (name, level), tile_size))
+        shape = tuple(-(-dim // 2) for dim in shape)
+    return levels
@@ -0,0 +1,257 @@
+"""
+Out of core tile store
+
+Checkpoint is converted once into fixed size tiles for every pyramid level and read back through memory mapping.
+Store layout (one directory per checkpoint hash):
+    index.json          layers, shapes, dtypes and store parameters, written last so it marks a complete store
+    layers/00000.bin    tiles of all levels of the layer, level after level, row major tile order
+    layers/00000.npy    (tiles count, 2) int64 table of tile offsets and lengths in the .bin file
+
+Convert from the command line:
+    python -m app.draw.gl.n_tile_store model.safetensors --workers 8 --compression zlib --memory-budget 32
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import zlib
+
+import numpy as np
+import psutil
+
+from app.draw.gl.n_pyramid import NPyramid
+from app.draw.gl.n_dtypes import decode, encode
+from app.draw.gl.n_safetensors import DTYPE_NAMES, DTYPES, checkpoint_fingerprint, index_safetensors
+from app.draw.gl.n_tiles import TILE_SIZE, NLruCache, TiledArray
+
+STORE_VERSION = 2  # 2: levels of 16 bit tensors are stored in the tensor type
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tensorgrid", "tiles")
+COMPRESSIONS = [None, "zlib"]
+# Peak memory of a worker relative to the tensor bytes: decoded bands of the first level, their concatenation
+# and the smaller levels
+WORKER_MEMORY_FACTOR = 2
+
+
+def checkpoint_hash(paths, tile_size, levels_count, aggregation, compression):
+    """
+    Key of the converted store, computed from the checkpoint fingerprint (n_safetensors.checkpoint_fingerprint)
+    Store parameters are part of the key, so a store converted with different settings is not reused
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{STORE_VERSION}-{tile_size}-{levels_count}-{aggregation}-{compression}".encode())
+    digest.update(checkpoint_fingerprint(paths).encode())
+    return digest.hexdigest()[:32]
+
+
+def layer_shape(shape):
+    if len(shape) == 0:
+        return (1,)
+    if len(shape) > 2:
+        return (shape[0], int(np.prod(shape[1:])))
+    return tuple(shape)
+
+
+def iterate_tiles(data, tile_size):
+    if data.ndim == 1:
+        tile_length = tile_size * tile_size
+        for start in range(0, data.shape[0], tile_length):
+            yield data[start:start + tile_length]
+    else:
+        for row in range(0, data.shape[0], tile_size):
+            for column in range(0, data.shape[1], tile_size):
+                yield data[row:row + tile_size, column:column + tile_size]
+
+
+def convert_layer(job):
+    """
+    Worker process job, writes all pyramid levels of one tensor as tiles
+    """
+    (index, path, offset, nbytes, dtype, shape, out_dir, tile_size, levels_count, aggregation, compression) = job
+    file_map = np.memmap(path, dtype=np.uint8, mode="r")
+    data = file_map[offset:offset + nbytes].view(DTYPES[dtype]).reshape(layer_shape(shape))
+
+    dtype_name = DTYPE_NAMES.get(dtype, np.dtype(DTYPES[dtype]).name)
+    pyramid = NPyramid(levels_count, aggregation)
+    pyramid.build(data, lambda chunk: decode(chunk, dtype_name), encode=lambda values: encode(values, dtype_name))
+
+    table = []
+    levels = []
+    position = 0
+    with open(os.path.join(out_dir, "layers", f"{index:05d}.bin"), "wb") as f:
+        for level_data in pyramid.levels:
+            levels.append({
+                "shape": list(level_data.shape),
+                "dtype": level_data.dtype.name,
+                "first_tile": len(table)
+            })
+            for tile in iterate_tiles(level_data, tile_size):
+                payload = np.ascontiguousarray(tile).tobytes()
+                if compression == "zlib":
+                    payload = zlib.compress(payload, 1)
+                f.write(payload)
+                table.append((position, len(payload)))
+                position += len(payload)
+    np.save(os.path.join(out_dir, "layers", f"{index:05d}.npy"), np.array(table, dtype=np.int64).reshape(-1, 2))
+    return index, levels
+
+
+def convert_workers(jobs, workers=None, memory_budget=None):
+    """
+    Every worker holds the pyramid of its tensor in memory, the workers count is bounded so the largest tensors
+    converted at the same time fit in the memory budget
+    :param memory_budget: bytes, half of the available memory by default
+    """
+    workers = workers or os.cpu_count()
+    if memory_budget is None:
+        memory_budget = psutil.virtual_memory().available // 2
+    largest = max([job[3] for job in jobs], default=0) * WORKER_MEMORY_FACTOR
+    if largest > 0:
+        workers = min(workers, max(1, memory_budget // largest))
+    return workers
+
+
+def convert(paths, out_dir, tile_size=TILE_SIZE, levels_count=6, aggregation="mean", compression=None, workers=None,
+            memory_budget=None):
+    """
+    Offline conversion of a safetensors checkpoint into the tile store, tensors are converted in parallel processes
+    :param memory_budget: bytes the workers may use together, see convert_workers
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}, expected one of {COMPRESSIONS}")
+    start_time = time.time()
+    tensors = index_safetensors(paths)
+    os.makedirs(os.path.join(out_dir, "layers"), exist_ok=True)
+    jobs = [(index, t.path, t.offset, t.nbytes, t.dtype, t.shape, out_dir, tile_size, levels_count, aggregation,
+             compression) for index, t in enumerate(tensors)]
+    # Largest tensors first, so the last running jobs are short
+    jobs.sort(key=lambda job: -job[3])
+
+    layers = [None] * len(tensors)
+    workers = convert_workers(jobs, workers, memory_budget)
+    print("Converting checkpoint to tiles, tensors:", len(tensors), "workers:", workers)
+    with multiprocessing.Pool(workers) as pool:
+        for done, (index, levels) in enumerate(pool.imap_unordered(convert_layer, jobs)):
+            tensor = tensors[index]
+            layers[index] = {
+                "name": tensor.name,
+                "dtype": tensor.dtype_name(),
+                "shape": list(layer_shape(tensor.shape)),
+                "levels": levels
+            }
+            print(f"\rConverting tiles: {int(100 * (done + 1) / len(jobs))}%", end="")
+    print("")
+
+    index_data = {
+        "version": STORE_VERSION,
+        "tile_size": tile_size,
+        "aggregation": aggregation,
+        "compression": compression,
+        "layers": layers
+    }
+    index_path = os.path.join(out_dir, "index.json")
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index_data, f)
+    os.replace(index_path + ".tmp", index_path)
+    print("Checkpoint converted", time.time() - start_time, "s", out_dir)
+
+
+class NTileStore:
+    """
+    Reader of the converted tile store
+    Every pyramid level of every layer is a TiledArray, tiles are memory mapped and kept in one LRU cache,
+    so the resident memory is bounded by the cache size and not by the checkpoint size
+    """
+
+    def __init__(self, path, cache_size=2 * 1024 ** 3):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.index = json.load(f)
+        self.tile_size = self.index["tile_size"]
+        self.compression = self.index["compression"]
+        self.aggregation = self.index["aggregation"]
+        self.cache = NLruCache(cache_size)
+        self.files = {}
+        self.tables = {}
+
+    def layers_count(self):
+        return len(self.index["layers"])
+
+    def open_layer(self, index):
+        if index not in self.files:
+            self.files[index] = np.memmap(os.path.join(self.path, "layers", f"{index:05d}.bin"), dtype=np.uint8,
+                                          mode="r")
+            self.tables[index] = np.load(os.path.join(self.path, "layers", f"{index:05d}.npy"), mmap_mode="r")
+        return self.files[index], self.tables[index]
+
+    def get_levels(self, index):
+        """
+        :return: TiledArray for every pyramid level of the layer
+        """
+        levels = []
+        for level_index, level in enumerate(self.index["layers"][index]["levels"]):
+            levels.append(TiledArray(level["shape"],
+                                     level["dtype"],
+                                     self.tile_loader(index, level),
+                                     self.cache,
+                                     (index, level_index),
+                                     self.tile_size))
+        return levels
+
+    def tile_loader(self, index, level):
+        shape = level["shape"]
+        dtype = np.dtype(level["dtype"])
+        first_tile = level["first_tile"]
+        tile_size = self.tile_size
+        tiles_columns = -(-shape[1] // tile_size) if len(shape) > 1 else 1
+
+        def load_tile(tile_row, tile_column):
+            file_map, table = self.open_layer(index)
+            offset, length = table[first_tile + tile_row * tiles_columns + tile_column]
+            payload = file_map[offset:offset + length]
+            if self.compression == "zlib":
+                payload = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+            tile = payload.view(dtype)
+            if len(shape) == 1:
+                return tile
+            rows = min(tile_size, shape[0] - tile_row * tile_size)
+            return tile.reshape(rows, -1)
+
+        return load_tile
+
+
+def open_store(paths, cache_dir=DEFAULT_CACHE_DIR, cache_size=2 * 1024 ** 3, tile_size=TILE_SIZE, levels_count=6,
+               aggregation="mean", compression=None, workers=None, memory_budget=None):
+    """
+    Open the tile store of the checkpoint, the checkpoint is converted only if no store exists for its hash
+    """
+    key = checkpoint_hash(paths, tile_size, levels_count, aggregation, compression)
+    store_path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(store_path, "index.json")):
+        print("Tile store found", store_path)
+    else:
+        convert(paths, store_path, tile_size, levels_count, aggregation, compression, workers, memory_budget)
+    return NTileStore(store_path, cache_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert safetensors checkpoint into TensorGrid tile store")
+    parser.add_argument("paths", nargs="+", help="safetensors files or checkpoint directory")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--levels", type=int, default=6)
+    parser.add_argument("--aggregation", default="mean")
+    parser.add_argument("--compression", default=None, choices=["zlib"])
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="GB the workers may use together, half of the available memory by default")
+    args = parser.parse_args()
+    memory_budget = int(args.memory_budget * 1024 ** 3) if args.memory_budget is not None else None
+    key = checkpoint_hash(args.paths, args.tile_size, args.levels, args.aggregation, args.compression)
+    convert(args.paths, os.path.join(args.cache_dir, key), args.tile_size, args.levels, args.aggregation,
+            args.compression, args.workers, memory_budget)
+
+
+if __name__ == "__main__":
+    main()
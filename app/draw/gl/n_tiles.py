@@ -0,0 +1,168 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+TILE_SIZE = 256  # tile is TILE_SIZE x TILE_SIZE values, 1D data uses TILE_SIZE * TILE_SIZE values per tile
+
+
+class NLruCache:
+    """
+    Least recently used cache bounded by the total bytes of its values
+    Hits, misses and evictions are counted, so the budget can be tuned
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.used_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.used_bytes += nbytes
+            # The most recent entry is never evicted, even if it alone exceeds the budget
+            while self.used_bytes > self.budget_bytes and len(self.entries) > 1:
+                evicted_key, (evicted_value, evicted_bytes) = self.entries.popitem(last=False)
+                self.used_bytes -= evicted_bytes
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_value))
+        return evicted
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.used_bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "used_bytes": self.used_bytes,
+            "budget_bytes": self.budget_bytes
+        }
+
+
+def normalize_index(item, shape):
+    """
+    Convert slices and integers index of an array like object to (start, stop, step) for every axis
+    :return: list of (start, stop, step), axes indexed with integers which should be squeezed
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+    item = item + (slice(None),) * (len(shape) - len(item))
+    slices = []
+    squeeze = []
+    for axis, index in enumerate(item):
+        if isinstance(index, slice):
+            slices.append(index.indices(shape[axis]))
+        else:
+            index = int(index)
+            if index < 0:
+                index += shape[axis]
+            slices.append((index, index + 1, 1))
+            squeeze.append(axis)
+    return slices, squeeze
+
+
+def squeeze_result(result, squeeze):
+    if len(squeeze) > 0:
+        result = result.squeeze(axis=tuple(squeeze))
+        if result.ndim == 0:
+            return result[()]
+    return result
+
+
+def axis_segments(start, stop, step, size, tile_size):
+    """
+    Split the samples range(start, stop, step) of one axis into per tile segments
+    :return: list of (tile index, output slice, slice inside the tile), samples count
+    """
+    count = len(range(start, stop, step))
+    segments = []
+    out = 0
+    index = start
+    while out < count:
+        tile = index // tile_size
+        tile_end = min((tile + 1) * tile_size, size)
+        n = min(count - out, -(-(tile_end - index) // step))
+        local = index - tile * tile_size
+        segments.append((tile, slice(out, out + n), slice(local, local + (n - 1) * step + 1, step)))
+        out += n
+        index += n * step
+    return segments, count
+
+
+class TiledArray:
+    """
+    Read only array like view of data stored as tiles
+    Supports the slicing used by Grid (slices with steps and single elements), only the tiles
+    covering the requested samples are loaded. Loaded tiles are kept in the shared NLruCache.
+    :param load_tile: function(tile_row, tile_column) -> ndarray, for 1D data tile_column is always 0
+    """
+
+    def __init__(self, shape, dtype, load_tile, cache, key, tile_size=TILE_SIZE):
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(dtype)
+        self.size = int(np.prod(self.shape))
+        self.nbytes = self.size * self.dtype.itemsize
+        self.load_tile = load_tile
+        self.cache = cache
+        self.key = key
+        self.tile_size = tile_size if self.ndim > 1 else tile_size * tile_size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def tiles_shape(self):
+        return tuple(-(-dim // self.tile_size) for dim in self.shape)
+
+    def get_tile(self, tile_row, tile_column=0):
+        cache_key = (self.key, tile_row, tile_column)
+        tile = self.cache.get(cache_key)
+        if tile is None:
+            tile = self.load_tile(tile_row, tile_column)
+            self.cache.put(cache_key, tile, tile.nbytes)
+        return tile
+
+    def __getitem__(self, item):
+        slices, squeeze = normalize_index(item, self.shape)
+        rows_segments, rows_count = axis_segments(*slices[0], self.shape[0], self.tile_size)
+        if self.ndim == 1:
+            result = np.empty(rows_count, dtype=self.dtype)
+            for tile_row, out_rows, tile_rows in rows_segments:
+                result[out_rows] = self.get_tile(tile_row)[tile_rows]
+        else:
+            columns_segments, columns_count = axis_segments(*slices[1], self.shape[1], self.tile_size)
+            result = np.empty((rows_count, columns_count), dtype=self.dtype)
+            for tile_row, out_rows, tile_rows in rows_segments:
+                for tile_column, out_columns, tile_columns in columns_segments:
+                    tile = self.get_tile(tile_row, tile_column)
+                    result[out_rows, out_columns] = tile[tile_rows, tile_columns]
+        return squeeze_result(result, squeeze)
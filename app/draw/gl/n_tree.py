@@ -1,17 +1,31 @@
 import random
 
 from app.draw.bsp_tree.tree_bsp import BSPLeaf, BSPTree
+from app.draw.bsp_tree.tree_implicit import ImplicitTree
 
 
 class NTreeLeaf(BSPLeaf):
     def __init__(self, x, y, w, h, level):
         super().__init__(x, y, w, h, level)
-        self.color = (random.uniform(0, 1), random.uniform(0, 1), random.uniform(0, 1))
         self.w = w
         self.h = h
         self.x1, self.y1 = x, y
         self.x2, self.y2 = x + w, y + h
-        self.id = f"{x}-{y}-{w}-{h}-{level}"
+        # Created on access, most leaves of a lazily generated tree are never drawn
+        self.leaf_color = None
+        self.leaf_id = None
+
+    @property
+    def color(self):
+        if self.leaf_color is None:
+            self.leaf_color = (random.uniform(0, 1), random.uniform(0, 1), random.uniform(0, 1))
+        return self.leaf_color
+
+    @property
+    def id(self):
+        if self.leaf_id is None:
+            self.leaf_id = f"{self.x}-{self.y}-{self.w}-{self.h}-{self.level}"
+        return self.leaf_id
 
     def dump(self):
         return f'x:{self.x}, y:{self.y}, x2:{self.x2}, y2:{self.y2}, w:{self.w}, h:{self.h}'
@@ -24,26 +38,76 @@ class NTreeLeaf(BSPLeaf):
 
 
 class NTree(BSPTree):
-    def __init__(self, depth):
+    def __init__(self, depth, implicit=True):
+        """
+        :param implicit: compute the visible strips of nodes of every level of the ImplicitTree from the viewport
+        (ImplicitTree.visible_strips), leaf objects are created only for the mega leaf and on access to
+        visible_leaves. False walks the BSPLeaf objects, trees of irregular size are walked as well.
+        An update costs 20-40 us in plain Python, nodes arrays and leaves are created on access only.
+        Leaves are generated lazily and pruned (BSPTree.prune, benchmark/bench_tree_prune) only on the BSPLeaf
+        walk, the implicit tree keeps nothing per node and needs no pruning.
+        """
         super().__init__(0, 0, depth)
         self.viewport = None
-        self.visible_leaves = []
+        self.implicit = ImplicitTree(0, 0) if implicit else None
+        # (level, first column, last column, first row, last row) strips of the visible nodes of the implicit tree
+        self.visible_strips = None
+        # (levels, columns, rows) of the visible nodes, expanded from the strips on access
+        self.visible_nodes_arrays = None
+        self.visible_leaves_list = []
         self.mega_leaf = None
 
     def set_size(self, w, h):
         super().set_size(w, h)
         self.leaf = NTreeLeaf(0, 0, self.width, self.height, 0)
+        if self.implicit is not None:
+            self.implicit.set_size(w, h)
+            self.visible_strips = None
+            self.visible_nodes_arrays = None
+            self.visible_leaves_list = []
+
+    @property
+    def visible_nodes(self):
+        """
+        :return: levels, columns, rows int64 arrays of the visible nodes of the implicit tree
+        """
+        if self.visible_nodes_arrays is None and self.visible_strips is not None:
+            self.visible_nodes_arrays = self.implicit.strips_nodes(self.visible_strips)
+        return self.visible_nodes_arrays
+
+    @property
+    def visible_leaves(self):
+        if self.visible_leaves_list is None:
+            self.visible_leaves_list = self.implicit.leaves(*self.visible_nodes, NTreeLeaf)
+        return self.visible_leaves_list
 
     def update_viewport(self, viewport):
+        self.viewport = viewport
+        if self.implicit is not None and self.implicit.is_regular():
+            self.update_implicit_viewport(viewport)
+            return
         visible = []
         not_visible = []
-        self.viewport = viewport
         self.traverse(viewport, visible, not_visible)
-        if visible != self.visible_leaves:
+        if visible != self.visible_leaves_list:
             # print("Visible count: ", len(visible))
-            self.visible_leaves = visible
+            self.visible_leaves_list = visible
             self.build_mega_leaf()
 
+    def update_implicit_viewport(self, viewport):
+        strips = self.implicit.visible_strips(viewport)
+        if strips == self.visible_strips:
+            return
+        self.visible_strips = strips
+        # Created on access
+        self.visible_nodes_arrays = None
+        self.visible_leaves_list = None
+        extent = self.implicit.strips_extent(strips)
+        if extent is None:
+            self.mega_leaf = None
+            return
+        self.update_mega_leaf(*extent)
+
     def build_mega_leaf(self):
         if len(self.visible_leaves) == 0:
             self.mega_leaf = None
@@ -54,7 +118,9 @@ class NTree(BSPTree):
         y1 = min([v.y1 for v in self.visible_leaves])
         y2 = max([v.y2 for v in self.visible_leaves])
         level = max([v.level for v in self.visible_leaves])
+        self.update_mega_leaf(x1, y1, x2, y2, level)
 
+    def update_mega_leaf(self, x1, y1, x2, y2, level):
         if self.mega_leaf is None:
             self.mega_leaf = NTreeLeaf(x1, y1, x2 - x1, y2 - y1, level)
         elif not self.mega_leaf.contains(x1, y1, x2, y2, level):
@@ -1,6 +1,7 @@
 import OpenGL.GL as gl
 import glfw
 
+from app.draw.gl.n_camera import NCameraPath, projection_viewport
 from app.draw.gl.n_projection import Projection
 from app.draw.gl.draw.n_shader import NShader
 
@@ -21,8 +22,15 @@ class NWindow:
         self.projection = Projection()
         self.render_func = None
         self.viewport_updated_func = None
+        self.hover_func = None
+        self.key_func = None
+        self.selection_func = None
+        # World position where the right button was pressed, the selection is made on release
+        self.selection_start = None
         self.zoom_percent = 0
         self.formatted_zoom = None
+        # Viewport updates are recorded while the camera path is recording, see n_camera
+        self.camera_path = NCameraPath()
 
         self.n_debug_shader = NShader()
         self.n_points_shader = NShader()
@@ -67,6 +75,7 @@ class NWindow:
         glfw.set_cursor_pos_callback(self.window, self.mouse_position_callback)
         glfw.set_mouse_button_callback(self.window, self.mouse_button_callback)
         glfw.set_window_refresh_callback(self.window, self.window_refresh_callback)
+        glfw.set_key_callback(self.window, self.key_callback)
 
         # Check if window creation succeeded
         if not self.window:
@@ -90,6 +99,24 @@ class NWindow:
     def set_viewport_updated_func(self, viewport_updated_func):
         self.viewport_updated_func = viewport_updated_func
 
+    def set_hover_func(self, hover_func):
+        """
+        :param hover_func: called with the world position of the mouse when it moves without dragging
+        """
+        self.hover_func = hover_func
+
+    def set_key_func(self, key_func):
+        """
+        :param key_func: called with the glfw key when a key is pressed
+        """
+        self.key_func = key_func
+
+    def set_selection_func(self, selection_func):
+        """
+        :param selection_func: called with the world rectangle x1, y1, x2, y2 selected by a right button drag
+        """
+        self.selection_func = selection_func
+
     def get_projection_matrix(self):
         return self.projection.matrix
 
@@ -98,16 +125,18 @@ class NWindow:
         sy = y / self.height * 2.0
         return sx, sy
 
+    def window_to_world_point(self, x, y):
+        """
+        :return: world position of the window point (0,0 bottom left)
+        """
+        sx, sy = self.window_to_normalized_cords(x, y)
+        return self.projection.window_to_world_point(sx - 1.0, sy - 1.0)
+
     def viewport_to_world_cords(self):
         '''
         :return: current viewport in world coordinates
         '''
-        # Window bottom left
-        x1, y1 = self.projection.window_to_world_point(-1, -1)
-        # Window top right
-        x2, y2 = self.projection.window_to_world_point(1, 1)
-        w, h = x2 - x1, y2 - y1
-        return (x1, y1, w, h, self.zoom_factor)
+        return projection_viewport(self.projection, self.zoom_factor)
 
     def world_coords_to_screen_coords(self, x1, y1, x2, y2):
         '''
@@ -140,6 +169,7 @@ class NWindow:
         return (wx1, wy1, wx2, wy2)
 
     def on_viewport_updated(self):
+        self.camera_path.record(self.projection, self.zoom_factor, self.width, self.height)
         if self.viewport_updated_func:
             self.viewport_updated_func()
 
@@ -173,10 +203,28 @@ class NWindow:
             self.formatted_zoom = formatted
             print("zoom: ", formatted)
 
+    def key_callback(self, window, key, scancode, action, mods):
+        if action == glfw.PRESS and self.key_func:
+            self.key_func(key)
+
+    def center_on(self, world_x, world_y):
+        """
+        Move the camera so the world point is in the center of the window, zoom is kept
+        """
+        sx, sy = self.projection.world_to_window_point(world_x, world_y)
+        self.projection.translate_by(-sx, -sy)
+        self.on_viewport_updated()
+
     def mouse_button_callback(self, window, button, action, mods):
         if button == glfw.MOUSE_BUTTON_RIGHT:
             if action == glfw.PRESS:
-                pass
+                self.selection_start = self.window_to_world_point(self.last_mouse_x, self.last_mouse_y)
+            elif action == glfw.RELEASE and self.selection_start is not None:
+                x1, y1 = self.selection_start
+                x2, y2 = self.window_to_world_point(self.last_mouse_x, self.last_mouse_y)
+                self.selection_start = None
+                if self.selection_func:
+                    self.selection_func(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
         if button == glfw.MOUSE_BUTTON_LEFT:
             if action == glfw.PRESS:
                 self.dragging = True
@@ -188,6 +236,8 @@ class NWindow:
         if not self.dragging:
             self.last_mouse_x = xpos
             self.last_mouse_y = ypos
+            if self.hover_func:
+                self.hover_func(*self.window_to_world_point(xpos, ypos))
             return
 
         # Calculate the translation offset based on mouse movement
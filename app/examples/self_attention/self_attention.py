@@ -2,6 +2,8 @@ import torch  # we use PyTorch: https://pytorch.org
 import torch.nn as nn
 from torch.nn import functional as F
 
+from app.draw.gl.n_live import NLivePublisher
+
 
 # hyperparameters
 batch_size = 16 # how many independent sequences will we process in parallel?
@@ -15,6 +17,7 @@ n_embd = 64
 n_head = 4
 n_layer = 4
 dropout = 0.0
+publish_live = False # stream the weights to a viewer started with NNet.init_from_live
 # ------------
 
 torch.manual_seed(1337)
@@ -190,6 +193,8 @@ print(sum(p.numel() for p in m.parameters())/1e6, 'M parameters')
 
 # create a PyTorch optimizer
 optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+# changed tiles are copied to shared memory at most 5 times per second
+publisher = NLivePublisher(model.named_parameters()) if publish_live else None
 
 for iter in range(max_iters):
 
@@ -206,7 +211,11 @@ for iter in range(max_iters):
     optimizer.zero_grad(set_to_none=True)
     loss.backward()
     optimizer.step()
+    if publisher is not None:
+        publisher.publish(iter)
 
 # generate from the model
 context = torch.zeros((1, 1), dtype=torch.long, device=device)
-print(decode(m.start_generate(context, max_new_tokens=2000)[0].tolist()))
\ No newline at end of file
+print(decode(m.start_generate(context, max_new_tokens=2000)[0].tolist()))
+if publisher is not None:
+    publisher.close()